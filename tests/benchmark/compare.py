@@ -0,0 +1,70 @@
+"""
+Compare a benchmark run against a baseline, both written by
+pytest-benchmark with `--benchmark-json`, and flag the regressions.
+
+    python tests/benchmark/compare.py baselines/main.json current.json [--threshold 10]
+
+Exits with 1 if any benchmark got slower than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str, stat: str):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        bench["fullname"]: bench["stats"][stat]
+        for bench in data.get("benchmarks", [])
+    }
+
+
+def compare(baseline, current, threshold: float):
+    """
+    return:
+        (name, baseline, current, change in percent, regressed) of every
+        benchmark in both runs.
+    """
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name], current[name]
+        change = (after - before) / before * 100 if before else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline", help="The baseline JSON, e.g. of the main branch.")
+    parser.add_argument("current", help="The JSON of the run to check.")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Slowdown in percent flagged as a regression.")
+    parser.add_argument("--stat", default="median",
+                        choices=["min", "max", "mean", "median"],
+                        help="The statistic compared.")
+    args = parser.parse_args()
+
+    baseline = load(args.baseline, args.stat)
+    current = load(args.current, args.stat)
+    rows = compare(baseline, current, args.threshold)
+    width = max([len(row[0]) for row in rows] + [9])
+    print(f"{'benchmark':<{width}}  {'baseline':>10}  {'current':>10}  {'change':>8}")
+    for name, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<{width}}  {before * 1000:>8.2f}ms  {after * 1000:>8.2f}ms  {change:>+7.1f}%{flag}")
+    for name in sorted(set(baseline) - set(current)):
+        print(f"{name}: missing from the current run")
+    for name in sorted(set(current) - set(baseline)):
+        print(f"{name}: new, no baseline")
+
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(f"{len(regressions)} of {len(rows)} benchmarks regressed "
+              f"by more than {args.threshold:g}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
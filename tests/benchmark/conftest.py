@@ -0,0 +1,85 @@
+"""
+Fixtures of the stage benchmarks, run with pytest-benchmark:
+
+    python -m pytest tests/benchmark --benchmark-json=current.json
+    python tests/benchmark/compare.py baselines/main.json current.json
+
+The synthetic corpus is sized with the `--synthetic-*` options.
+"""
+import functools
+import os
+import sys
+import tempfile
+import threading
+
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+# the caches and the slice checkouts of the benchmarked runs never touch
+# the host ones
+os.environ.setdefault(
+    "SPLITTER_CACHE_DIR", tempfile.mkdtemp(prefix="splitter-bench-")
+)
+os.environ.setdefault(
+    "SPLITTER_CONFIG_DIR", tempfile.mkdtemp(prefix="splitter-bench-etc-")
+)
+
+from loadtest import MirrorHandler  # noqa: E402
+from synthetic import make_corpus, make_package  # noqa: E402
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("synthetic", "synthetic benchmark corpus")
+    group.addoption("--synthetic-breadth", type=int, default=8,
+                    help="Packages on each level of the slice dependencies.")
+    group.addoption("--synthetic-depth", type=int, default=4,
+                    help="Levels of the slice dependencies.")
+    group.addoption("--synthetic-files", type=int, default=200,
+                    help="Files of each corpus package.")
+    group.addoption("--synthetic-file-size", type=int, default=8192,
+                    help="Size of each file, in bytes.")
+    group.addoption("--synthetic-large-files", type=int, default=5000,
+                    help="Files of the single large package.")
+    group.addoption("--synthetic-seed", type=int, default=0,
+                    help="Seed of the file names and contents.")
+
+
+@pytest.fixture(scope="session")
+def corpus(request, tmp_path_factory):
+    """
+    The synthetic corpus, its yum repository is served over HTTP so the
+    packages are really downloaded without the package cache.
+    """
+    option = request.config.getoption
+    root = str(tmp_path_factory.mktemp("corpus"))
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(MirrorHandler, directory=root)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield make_corpus(
+            root,
+            breadth=option("--synthetic-breadth"),
+            depth=option("--synthetic-depth"),
+            file_count=option("--synthetic-files"),
+            file_size=option("--synthetic-file-size"),
+            seed=option("--synthetic-seed"),
+            baseurl=f"http://127.0.0.1:{server.server_address[1]}/repo",
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope="session")
+def large_package(request, tmp_path_factory):
+    option = request.config.getoption
+    return make_package(
+        str(tmp_path_factory.mktemp("large")), "synth-large",
+        file_count=option("--synthetic-large-files"),
+        file_size=option("--synthetic-file-size"),
+        seed=option("--synthetic-seed"),
+    )
@@ -0,0 +1,291 @@
+"""
+End-to-end load test of `splitter cut` against local stand-ins of the
+openEuler mirror and of the slice-releases repository.
+
+A synthetic corpus is generated, its yum repository is served over HTTP
+with a simulated latency and bandwidth, its slice repository over the
+git protocol. Many `cut` invocations then run concurrently against them.
+
+    python tests/benchmark/loadtest.py --concurrency 8 --runs 32 \\
+        --latency 50ms --bandwidth 20M
+
+Reports the throughput, the p50/p99 latency and the peak RSS of the
+invocations, exits with 1 if any of them failed.
+"""
+import argparse
+import functools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, NamedTuple, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from synthetic import RELEASE, make_corpus  # noqa: E402
+from tools.download.cache import format_size, parse_size  # noqa: E402
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+CHUNK_SIZE = 64 * 1024
+
+
+class Throttle:
+    """
+    Share a bandwidth of `rate` bytes per second between all transfers.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.available = time.monotonic()
+
+    def wait(self, size: int) -> None:
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # the transfer is due once the ones before it are through
+            self.available = max(now, self.available) + size / self.rate
+            due = self.available
+        time.sleep(max(0.0, due - now))
+
+
+class MirrorHandler(SimpleHTTPRequestHandler):
+    """
+    Serve the yum repository after `latency` seconds per request, at the
+    bandwidth of `throttle`.
+    """
+    latency = 0.0
+    throttle = Throttle(0)
+    stats = {"requests": 0, "bytes": 0}
+    stats_lock = threading.Lock()
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.stats_lock:
+            self.stats["requests"] += 1
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        while True:
+            data = source.read(CHUNK_SIZE)
+            if not data:
+                break
+            self.throttle.wait(len(data))
+            outputfile.write(data)
+            with self.stats_lock:
+                self.stats["bytes"] += len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git(*args: str, cwd: Optional[str] = None) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=loadtest", "-c", "user.email=loadtest@localhost", *args],
+        cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+
+
+def publish_slices(slice_dir: str, served_dir: str, branch: str) -> str:
+    """
+    Commit the generated slice repository to `branch` of a bare
+    repository under `served_dir`.
+
+    return:
+        The path of the bare repository relative to `served_dir`.
+    """
+    _git("init", "-q", cwd=slice_dir)
+    _git("checkout", "-q", "-b", branch, cwd=slice_dir)
+    _git("add", "-A", cwd=slice_dir)
+    _git("commit", "-q", "-m", "synthetic slices", cwd=slice_dir)
+    name = "slice-releases.git"
+    _git("clone", "-q", "--bare", slice_dir, os.path.join(served_dir, name))
+    return name
+
+
+class Run(NamedTuple):
+    index: int
+    returncode: int
+    seconds: float
+    # peak resident set size, in bytes
+    max_rss: int
+
+
+def _wait(process: subprocess.Popen) -> Tuple[int, int]:
+    """
+    Wait for `process`, unlike `Popen.wait` also getting its peak RSS.
+
+    return:
+        The exit code and the peak RSS in bytes.
+    """
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = (
+        -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    )
+    return process.returncode, usage.ru_maxrss * 1024
+
+
+def run_cut(index: int, args, corpus, env: dict, log_dir: str) -> Run:
+    output = os.path.join(args.workdir, "outputs", str(index))
+    command = [
+        sys.executable, "-m", "tools.main", "cut",
+        "-r", RELEASE, "-a", corpus.arch, "-o", output,
+        "--no-rpmdb", *args.cut_arg, *corpus.top_slices,
+    ]
+    start = time.monotonic()
+    with open(os.path.join(log_dir, f"{index}.log"), "wb") as log:
+        process = subprocess.Popen(
+            command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        returncode, max_rss = _wait(process)
+    seconds = time.monotonic() - start
+    if not args.keep_outputs:
+        shutil.rmtree(output, ignore_errors=True)
+    return Run(index, returncode, seconds, max_rss)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    The nearest-rank percentile of `values`.
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _duration(value: str) -> float:
+    value = value.strip()
+    if value.endswith("ms"):
+        return float(value[:-2]) / 1000
+    return float(value.rstrip("s"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Invocations of cut running at the same time.")
+    parser.add_argument("--runs", type=int, default=16,
+                        help="Invocations of cut in total.")
+    parser.add_argument("--latency", type=_duration, default=0.0,
+                        help="Latency of every HTTP request, such as `50ms`.")
+    parser.add_argument("--bandwidth", type=parse_size, default=0,
+                        help="Bandwidth of the mirror per second, such as `20M`, unlimited by default.")
+    parser.add_argument("--breadth", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--files", type=int, default=200,
+                        help="Files of each package.")
+    parser.add_argument("--file-size", type=parse_size, default=8192)
+    parser.add_argument("--shared-cache", action="store_true",
+                        help="Share one SPLITTER_CACHE_DIR and SPLITTER_CONFIG_DIR between the invocations, like a build host.")
+    parser.add_argument("--cut-arg", action="append", default=[],
+                        help="Extra argument of every cut, e.g. `--cut-arg=--package-cache`.")
+    parser.add_argument("--workdir", default=None,
+                        help="Directory of the corpus and the outputs, a temporary one by default.")
+    parser.add_argument("--keep-outputs", action="store_true")
+    parser.add_argument("--json", dest="json_file", default=None,
+                        help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    cleanup = args.workdir is None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="splitter-load-"))
+    served = os.path.join(args.workdir, "served")
+    os.makedirs(served, exist_ok=True)
+
+    MirrorHandler.latency = args.latency
+    MirrorHandler.throttle = Throttle(args.bandwidth)
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(MirrorHandler, directory=served)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mirror_url = f"http://127.0.0.1:{server.server_address[1]}/repo"
+
+    corpus = make_corpus(
+        served, breadth=args.breadth, depth=args.depth,
+        file_count=args.files, file_size=args.file_size, baseurl=mirror_url
+    )
+    git_port = _free_port()
+    repo_name = publish_slices(corpus.slice_dir, served, f"openEuler-{RELEASE}")
+    daemon = subprocess.Popen(
+        ["git", "daemon", "--reuseaddr", "--export-all", "--listen=127.0.0.1",
+         f"--port={git_port}", f"--base-path={served}", served],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    print(f"Serving {len(corpus.packages)} packages at {mirror_url}, "
+          f"slices at git://127.0.0.1:{git_port}/{repo_name}")
+
+    log_dir = os.path.join(args.workdir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    envs = []
+    for index in range(args.runs):
+        env = dict(os.environ)
+        env["SPLITTER_SLICE_REPO"] = f"git://127.0.0.1:{git_port}/{repo_name}"
+        cache = "shared" if args.shared_cache else str(index)
+        env["SPLITTER_CACHE_DIR"] = os.path.join(args.workdir, "caches", cache)
+        # the slice checkouts too, the host ones are never touched
+        env["SPLITTER_CONFIG_DIR"] = os.path.join(args.workdir, "config", cache)
+        envs.append(env)
+
+    try:
+        time.sleep(0.5)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            runs = list(executor.map(
+                lambda index: run_cut(index, args, corpus, envs[index], log_dir),
+                range(args.runs)
+            ))
+        elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+        daemon.terminate()
+        daemon.wait()
+
+    seconds = [run.seconds for run in runs]
+    failed = [run for run in runs if run.returncode]
+    report = {
+        "runs": len(runs),
+        "failed": len(failed),
+        "concurrency": args.concurrency,
+        "elapsed": elapsed,
+        "throughput": len(runs) / elapsed,
+        "p50": percentile(seconds, 50),
+        "p99": percentile(seconds, 99),
+        "peak_rss": max(run.max_rss for run in runs),
+        "requests": MirrorHandler.stats["requests"],
+        "bytes": MirrorHandler.stats["bytes"],
+    }
+    print(f"Runs:        {report['runs']} ({report['failed']} failed), "
+          f"concurrency {report['concurrency']}")
+    print(f"Throughput:  {report['throughput'] * 60:.1f} cuts/min")
+    print(f"Latency:     p50 {report['p50']:.2f}s, p99 {report['p99']:.2f}s")
+    print(f"Peak RSS:    {format_size(report['peak_rss'])}")
+    print(f"Mirror:      {report['requests']} requests, {format_size(report['bytes'])} served")
+    for run in failed:
+        print(f"Run {run.index} exited with {run.returncode}, "
+              f"see {os.path.join(log_dir, f'{run.index}.log')}")
+    if args.json_file:
+        with open(args.json_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if cleanup and not failed:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
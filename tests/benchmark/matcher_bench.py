@@ -0,0 +1,95 @@
+"""
+Micro-benchmark of the compiled pattern matcher against `fnmatch`.
+
+    python tests/benchmark/matcher_bench.py [--files N] [--patterns N]
+"""
+import argparse
+import fnmatch
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from tools.parse.matcher import PatternMatcher  # noqa: E402
+
+DIRS = ["usr/bin", "usr/lib64", "usr/lib64/gconv", "usr/share/doc",
+        "usr/share/locale/de/LC_MESSAGES", "usr/share/man/man1", "etc",
+        "usr/libexec/getconf", "var/lib", "usr/include/bits"]
+EXTS = ["", ".so", ".so.6", ".mo", ".gz", ".h", ".conf", ".py"]
+
+
+def make_files(count: int, rng: random.Random):
+    files = []
+    for i in range(count):
+        d = rng.choice(DIRS)
+        files.append(f"./{d}/file{i}{rng.choice(EXTS)}")
+    return files
+
+
+def make_patterns(count: int, files, rng: random.Random):
+    patterns = []
+    for _ in range(count):
+        kind = rng.randrange(5)
+        if kind == 0:
+            patterns.append(rng.choice(files))
+        elif kind == 1:
+            patterns.append(f"./{rng.choice(DIRS)}/*")
+        elif kind == 2:
+            patterns.append(f"./{rng.choice(DIRS)}/*{rng.choice(EXTS[1:])}")
+        elif kind == 3:
+            patterns.append(f"./usr/*/file{rng.randrange(100)}?")
+        else:
+            patterns.append(f"./{rng.choice(DIRS)}/[fg]ile{rng.randrange(10)}*")
+    return patterns
+
+
+def fnmatch_files(files, patterns):
+    matched = []
+    for file in files:
+        for pattern in patterns:
+            if fnmatch.fnmatch(file, pattern):
+                matched.append(file)
+                break
+    return matched
+
+
+def fnmatch_unmatched(files, patterns):
+    return [pattern for pattern in dict.fromkeys(patterns)
+            if not fnmatch.filter(files, pattern)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--patterns", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = make_files(args.files, rng)
+    patterns = make_patterns(args.patterns, files, rng)
+
+    expected, fnmatch_time = timed(fnmatch_files, files, patterns)
+    (matched, unmatched), matcher_time = timed(
+        lambda: PatternMatcher(patterns).filter(files)
+    )
+    assert matched == expected, "matched files differ from fnmatch"
+    assert unmatched == fnmatch_unmatched(files, patterns), \
+        "unmatched patterns differ from fnmatch"
+
+    print(f"{len(files)} files, {len(patterns)} patterns, {len(matched)} matched")
+    print(f"fnmatch:         {fnmatch_time:.3f}s")
+    print(f"PatternMatcher:  {matcher_time:.3f}s "
+          f"({fnmatch_time / matcher_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Synthetic inputs of the benchmarks and load tests, all generated
+locally from a seed: RPM packages, slice repositories and the yum
+repository serving the packages.
+"""
+import gzip
+import hashlib
+import os
+import random
+import stat
+import struct
+import time
+import yaml
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from tools.parse.rpmfile import (
+    RPM_BIN_TYPE,
+    RPM_I18NSTRING_TYPE,
+    RPM_INT16_TYPE,
+    RPM_INT32_TYPE,
+    RPM_STRING_ARRAY_TYPE,
+    RPM_STRING_TYPE,
+    RPMTAG_ARCH,
+    RPMTAG_BASENAMES,
+    RPMTAG_DIRINDEXES,
+    RPMTAG_DIRNAMES,
+    RPMTAG_FILEDEVICES,
+    RPMTAG_FILEDIGESTALGO,
+    RPMTAG_FILEDIGESTS,
+    RPMTAG_FILEFLAGS,
+    RPMTAG_FILEINODES,
+    RPMTAG_FILELINKTOS,
+    RPMTAG_FILEMODES,
+    RPMTAG_FILEMTIMES,
+    RPMTAG_FILESIZES,
+    RPMTAG_LICENSE,
+    RPMTAG_NAME,
+    RPMTAG_PAYLOADCOMPRESSOR,
+    RPMTAG_PAYLOADFORMAT,
+    RPMTAG_RELEASE,
+    RPMTAG_SOURCERPM,
+    RPMTAG_SUMMARY,
+    RPMTAG_VERSION,
+    RPMFile,
+)
+
+RPMTAG_HEADERI18NTABLE = 100
+RPMTAG_OS = 1021
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMSIGTAG_SIZE = 1000
+RPMSIGTAG_SHA256 = 273
+RPMSENSE_EQUAL = 8
+PGPHASHALGO_SHA256 = 8
+
+LEAD_SIZE = 96
+MTIME = 1700000000
+RELEASE = "24.03-LTS"
+ARCH = "x86_64"
+
+DIRS = ["usr/bin", "usr/lib64", "usr/lib64/gconv", "usr/share/doc",
+        "usr/share/locale/de/LC_MESSAGES", "usr/share/man/man1", "etc",
+        "usr/libexec", "var/lib", "usr/include/bits"]
+EXTS = ["", ".so", ".so.6", ".mo", ".gz", ".h", ".conf", ".py"]
+
+REPO_TEMPLATE = """[synthetic]
+name=synthetic
+baseurl={baseurl}
+enabled=1
+gpgcheck=0
+"""
+
+
+class SyntheticFile(NamedTuple):
+    path: str
+    mode: int
+    data: bytes = b""
+    linkto: str = ""
+
+
+class Corpus(NamedTuple):
+    """
+    A generated slice repository with the yum repository of its packages.
+    """
+    root: str
+    # the slice repository, see `--slice-dir`
+    slice_dir: str
+    repo_dir: str
+    packages: List[str]
+    # the slices requiring the whole corpus
+    top_slices: List[str]
+    release: str = RELEASE
+    arch: str = ARCH
+
+
+def _header(tags: List[Tuple[int, int, object]]) -> bytes:
+    index = b""
+    store = b""
+    for tag, tag_type, value in sorted(tags, key=lambda tag: tag[0]):
+        align = {RPM_INT16_TYPE: 2, RPM_INT32_TYPE: 4}.get(tag_type, 1)
+        store += b"\0" * (-len(store) % align)
+        offset = len(store)
+        if tag_type == RPM_STRING_TYPE:
+            store += value.encode("utf-8") + b"\0"
+            count = 1
+        elif tag_type in (RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE):
+            store += b"".join(item.encode("utf-8") + b"\0" for item in value)
+            count = len(value)
+        elif tag_type == RPM_BIN_TYPE:
+            store += value
+            count = len(value)
+        elif tag_type == RPM_INT16_TYPE:
+            store += struct.pack(f">{len(value)}H", *value)
+            count = len(value)
+        else:
+            store += struct.pack(f">{len(value)}I", *value)
+            count = len(value)
+        index += struct.pack(">IIII", tag, tag_type, offset, count)
+    return (
+        b"\x8e\xad\xe8\x01\0\0\0\0"
+        + struct.pack(">II", len(tags), len(store)) + index + store
+    )
+
+
+def _cpio(name: str, mode: int, data: bytes, ino: int, mtime: int) -> bytes:
+    encoded = name.encode("utf-8") + b"\0"
+    fields = (ino, mode, 0, 0, 1, mtime, len(data), 0, 0, 0, 0, len(encoded), 0)
+    entry = b"070701" + b"".join(b"%08x" % field for field in fields) + encoded
+    entry += b"\0" * (-len(entry) % 4)
+    return entry + data + b"\0" * (-len(data) % 4)
+
+
+def write_rpm(path: str, name: str, files: List[SyntheticFile],
+              version: str = "1.0", release: str = "1",
+              arch: str = ARCH) -> str:
+    """
+    Write a gzip compressed RPM package of `files`.
+    """
+    payload = b""
+    dirnames: List[str] = []
+    dirindexes = []
+    basenames = []
+    for ino, file in enumerate(files, 1):
+        dirname, basename = os.path.split(file.path)
+        dirname = dirname.rstrip("/") + "/"
+        if dirname not in dirnames:
+            dirnames.append(dirname)
+        dirindexes.append(dirnames.index(dirname))
+        basenames.append(basename)
+        data = file.linkto.encode("utf-8") if stat.S_ISLNK(file.mode) else file.data
+        payload += _cpio(f".{file.path}", file.mode, data, ino, MTIME)
+    payload += _cpio("TRAILER!!!", 0, b"", 0, 0)
+    payload = gzip.compress(payload, mtime=0)
+
+    header = _header([
+        (RPMTAG_HEADERI18NTABLE, RPM_STRING_ARRAY_TYPE, ["C"]),
+        (RPMTAG_NAME, RPM_STRING_TYPE, name),
+        (RPMTAG_VERSION, RPM_STRING_TYPE, version),
+        (RPMTAG_RELEASE, RPM_STRING_TYPE, release),
+        (RPMTAG_SUMMARY, RPM_I18NSTRING_TYPE, [f"Synthetic package {name}"]),
+        (RPMTAG_LICENSE, RPM_STRING_TYPE, "MIT"),
+        (RPMTAG_OS, RPM_STRING_TYPE, "linux"),
+        (RPMTAG_ARCH, RPM_STRING_TYPE, arch),
+        (RPMTAG_SOURCERPM, RPM_STRING_TYPE, f"{name}-{version}-{release}.src.rpm"),
+        (RPMTAG_PROVIDENAME, RPM_STRING_ARRAY_TYPE, [name]),
+        (RPMTAG_PROVIDEFLAGS, RPM_INT32_TYPE, [RPMSENSE_EQUAL]),
+        (RPMTAG_PROVIDEVERSION, RPM_STRING_ARRAY_TYPE, [f"{version}-{release}"]),
+        (RPMTAG_FILESIZES, RPM_INT32_TYPE, [
+            len(file.linkto.encode("utf-8")) if stat.S_ISLNK(file.mode) else len(file.data)
+            for file in files
+        ]),
+        (RPMTAG_FILEMODES, RPM_INT16_TYPE, [file.mode for file in files]),
+        (RPMTAG_FILEMTIMES, RPM_INT32_TYPE, [MTIME] * len(files)),
+        (RPMTAG_FILEDIGESTS, RPM_STRING_ARRAY_TYPE, [
+            hashlib.sha256(file.data).hexdigest() if stat.S_ISREG(file.mode) else ""
+            for file in files
+        ]),
+        (RPMTAG_FILELINKTOS, RPM_STRING_ARRAY_TYPE, [file.linkto for file in files]),
+        (RPMTAG_FILEFLAGS, RPM_INT32_TYPE, [0] * len(files)),
+        (RPMTAG_FILEDEVICES, RPM_INT32_TYPE, [1] * len(files)),
+        (RPMTAG_FILEINODES, RPM_INT32_TYPE, list(range(1, len(files) + 1))),
+        (RPMTAG_DIRINDEXES, RPM_INT32_TYPE, dirindexes),
+        (RPMTAG_BASENAMES, RPM_STRING_ARRAY_TYPE, basenames),
+        (RPMTAG_DIRNAMES, RPM_STRING_ARRAY_TYPE, dirnames),
+        (RPMTAG_PAYLOADFORMAT, RPM_STRING_TYPE, "cpio"),
+        (RPMTAG_PAYLOADCOMPRESSOR, RPM_STRING_TYPE, "gzip"),
+        (RPMTAG_FILEDIGESTALGO, RPM_INT32_TYPE, [PGPHASHALGO_SHA256]),
+    ])
+    signature = _header([
+        (RPMSIGTAG_SIZE, RPM_INT32_TYPE, [len(header) + len(payload)]),
+        (RPMSIGTAG_SHA256, RPM_STRING_TYPE, hashlib.sha256(header).hexdigest()),
+    ])
+    signature += b"\0" * (-len(signature) % 8)
+    lead = b"\xed\xab\xee\xdb\x03\x00" + b"\0" * (LEAD_SIZE - 6)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(lead + signature + header + payload)
+    return path
+
+
+def make_files(count: int, size: int, rng: random.Random) -> List[SyntheticFile]:
+    """
+    Generate `count` files of about `size` bytes spread over typical
+    directories, one in ten is a symlink.
+    """
+    files = []
+    for i in range(count):
+        path = f"/{rng.choice(DIRS)}/file{i}{rng.choice(EXTS)}"
+        if files and i % 10 == 9:
+            files.append(SyntheticFile(
+                path, stat.S_IFLNK | 0o777, linkto=os.path.basename(files[-1].path)
+            ))
+            continue
+        # compressible, like real binaries and text
+        data = bytes(rng.getrandbits(4) for _ in range(min(size, 256)))
+        data = (data * (size // max(len(data), 1) + 1))[:size]
+        mode = 0o755 if "bin" in path or "libexec" in path else 0o644
+        files.append(SyntheticFile(path, stat.S_IFREG | mode, data))
+    return files
+
+
+def make_package(directory: str, name: str, file_count: int = 100,
+                 file_size: int = 4096, seed: int = 0) -> str:
+    """
+    Write the synthetic package `name` to `directory`.
+
+    return:
+        Path to the package.
+    """
+    rng = random.Random(f"{seed}-{name}")
+    path = os.path.join(directory, f"{name}-1.0-1.{ARCH}.rpm")
+    return write_rpm(path, name, make_files(file_count, file_size, rng))
+
+
+def _package_name(level: int, index: int) -> str:
+    return f"synth-{level}-{index}"
+
+
+def make_slice_repo(slice_dir: str, breadth: int, depth: int,
+                    baseurl: Optional[str] = None) -> List[str]:
+    """
+    Write a slice repository of `breadth` packages on each of `depth`
+    levels. The `libs` slice of every package requires the `libs`
+    slices of up to `breadth` packages of the next level, the `bins`
+    slice requires its own `libs`.
+
+    args:
+        slice_dir: The repository directory, see `--slice-dir`.
+        baseurl: The yum repository of the packages, if any.
+    return:
+        The `bins` slices of the top level.
+    """
+    sdf_dir = os.path.join(slice_dir, "slices")
+    os.makedirs(sdf_dir, exist_ok=True)
+    for level in range(depth):
+        for index in range(breadth):
+            package = _package_name(level, index)
+            libs_deps = [
+                f"{_package_name(level + 1, dep)}_libs"
+                for dep in range(breadth) if level + 1 < depth
+            ]
+            sdf = {
+                "package": package,
+                "slices": {
+                    "bins": {
+                        "deps": [f"{package}_libs"],
+                        "contents": {"common": ["/usr/bin/*", "/usr/libexec/*"]},
+                    },
+                    "libs": {
+                        "deps": libs_deps,
+                        "contents": {"common": ["/usr/lib64/*.so*", "/usr/lib64/gconv/*"]},
+                    },
+                    "data": {
+                        "contents": {"common": ["/usr/share/**", "/etc/*.conf"]},
+                    },
+                },
+            }
+            with open(os.path.join(sdf_dir, f"{package}.yaml"), "w", encoding="utf-8") as f:
+                yaml.safe_dump(sdf, f, sort_keys=False)
+    if baseurl:
+        repo_dir = os.path.join(slice_dir, "repo")
+        os.makedirs(repo_dir, exist_ok=True)
+        with open(os.path.join(repo_dir, "openEuler.template"), "w", encoding="utf-8") as f:
+            f.write(REPO_TEMPLATE.format(baseurl=baseurl))
+    return [f"{_package_name(0, index)}_bins" for index in range(breadth)]
+
+
+def _header_range(path: str) -> Tuple[int, int]:
+    """
+    Get the byte range of the main header, after the padded signature.
+    """
+    with open(path, "rb") as f:
+        f.seek(LEAD_SIZE + 8)
+        count, size = struct.unpack(">II", f.read(8))
+        signature = 16 + 16 * count + size
+        start = LEAD_SIZE + signature + (-signature % 8)
+        f.seek(start + 8)
+        count, size = struct.unpack(">II", f.read(8))
+        return start, start + 16 + 16 * count + size
+
+
+def _package_xml(path: str, href: str, checksum: str, rpm_file: RPMFile) -> Tuple[str, str]:
+    name = escape(rpm_file.name)
+    arch = escape(rpm_file.arch)
+    version = (
+        f'<version epoch="{rpm_file.epoch}" ver={quoteattr(rpm_file.version)} '
+        f'rel={quoteattr(rpm_file.release)}/>'
+    )
+    start, end = _header_range(path)
+    size = os.path.getsize(path)
+    files = "".join(
+        f"<file>{escape(filename[1:])}</file>" for filename in rpm_file.filenames()
+    )
+    primary = (
+        f'<package type="rpm"><name>{name}</name><arch>{arch}</arch>{version}'
+        f'<checksum type="sha256" pkgid="YES">{checksum}</checksum>'
+        f'<summary>{name}</summary><description>{name}</description>'
+        f'<packager/><url/><time file="{MTIME}" build="{MTIME}"/>'
+        f'<size package="{size}" installed="0" archive="0"/>'
+        f'<location href={quoteattr(href)}/>'
+        f'<format><rpm:license>MIT</rpm:license><rpm:vendor/><rpm:group/>'
+        f'<rpm:buildhost/><rpm:sourcerpm/>'
+        f'<rpm:header-range start="{start}" end="{end}"/>'
+        f'<rpm:provides><rpm:entry name="{name}" flags="EQ" epoch="{rpm_file.epoch}" '
+        f'ver={quoteattr(rpm_file.version)} rel={quoteattr(rpm_file.release)}/></rpm:provides>'
+        f'</format></package>'
+    )
+    filelists = (
+        f'<package pkgid="{checksum}" name="{name}" arch="{arch}">{version}{files}</package>'
+    )
+    return primary, filelists
+
+
+def _write_metadata(repodata: str, kind: str, xml: str) -> str:
+    data = gzip.compress(xml.encode("utf-8"), mtime=0)
+    name = f"{kind}.xml.gz"
+    with open(os.path.join(repodata, name), "wb") as f:
+        f.write(data)
+    return (
+        f'<data type="{kind}">'
+        f'<checksum type="sha256">{hashlib.sha256(data).hexdigest()}</checksum>'
+        f'<open-checksum type="sha256">{hashlib.sha256(xml.encode("utf-8")).hexdigest()}</open-checksum>'
+        f'<location href="repodata/{name}"/><timestamp>{int(time.time())}</timestamp>'
+        f'<size>{len(data)}</size><open-size>{len(xml.encode("utf-8"))}</open-size></data>'
+    )
+
+
+def write_repodata(repo_dir: str) -> str:
+    """
+    Write the yum metadata, primary and filelists, of all the packages
+    under `repo_dir`, like `createrepo_c` would.
+
+    return:
+        Path to `repomd.xml`.
+    """
+    primary = []
+    filelists = []
+    for dirpath, _, filenames in sorted(os.walk(repo_dir)):
+        for filename in sorted(filenames):
+            if not filename.endswith(".rpm"):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                checksum = hashlib.sha256(f.read()).hexdigest()
+            entries = _package_xml(
+                path, os.path.relpath(path, repo_dir), checksum, RPMFile(path)
+            )
+            primary.append(entries[0])
+            filelists.append(entries[1])
+
+    repodata = os.path.join(repo_dir, "repodata")
+    os.makedirs(repodata, exist_ok=True)
+    data = [
+        _write_metadata(repodata, "primary", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+            'xmlns:rpm="http://linux.duke.edu/metadata/rpm" '
+            f'packages="{len(primary)}">{"".join(primary)}</metadata>'
+        )),
+        _write_metadata(repodata, "filelists", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<filelists xmlns="http://linux.duke.edu/metadata/filelists" '
+            f'packages="{len(filelists)}">{"".join(filelists)}</filelists>'
+        )),
+    ]
+    path = os.path.join(repodata, "repomd.xml")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+            'xmlns:rpm="http://linux.duke.edu/metadata/rpm">'
+            f'<revision>{int(time.time())}</revision>{"".join(data)}</repomd>'
+        )
+    return path
+
+
+def make_corpus(root: str, breadth: int = 4, depth: int = 3,
+                file_count: int = 100, file_size: int = 4096,
+                seed: int = 0, baseurl: Optional[str] = None) -> Corpus:
+    """
+    Generate a slice repository and the yum repository of its packages.
+
+    args:
+        root: The directory to generate the corpus in.
+        breadth: The packages on each level of the slice dependencies.
+        depth: The levels of the slice dependencies.
+        file_count: The files of each package.
+        file_size: The size of each file.
+        seed: The seed of the file names and contents.
+        baseurl: The url the yum repository is served at, defaults to
+                 the `file://` url of the repository directory.
+    """
+    repo_dir = os.path.join(root, "repo")
+    packages_dir = os.path.join(repo_dir, "Packages")
+    packages = [
+        make_package(packages_dir, _package_name(level, index), file_count, file_size, seed)
+        for level in range(depth)
+        for index in range(breadth)
+    ]
+    write_repodata(repo_dir)
+    slice_dir = os.path.join(root, "slice-releases")
+    top_slices = make_slice_repo(
+        slice_dir, breadth, depth, baseurl or f"file://{os.path.abspath(repo_dir)}"
+    )
+    return Corpus(root, slice_dir, repo_dir, packages, top_slices)
+
+
+def package_files(packages: List[str]) -> Dict[str, List[str]]:
+    """
+    List the payload members of each package, keyed by package path.
+    """
+    return {path: RPMFile(path).filenames() for path in packages}
@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+if shutil.which("rpm") is None or shutil.which("rpmdb") is None:
+    pytest.skip("the rpm tools are not installed", allow_module_level=True)
+if os.geteuid() != 0:
+    pytest.skip("the rpmdb is only written as root", allow_module_level=True)
+
+from tools.cert.cert import RPMCertPacker  # noqa: E402
+
+
+def _packer(tmp_path, round_id):
+    root = str(tmp_path / f"root{round_id}")
+    return RPMCertPacker(db_root=root)
+
+
+def test_pack_cert(benchmark, corpus, tmp_path):
+    rounds = iter(range(1000))
+
+    def setup():
+        return (_packer(tmp_path, next(rounds)),), {}
+
+    def pack(packer):
+        return all(packer.pack_cert(package) for package in corpus.packages)
+
+    assert benchmark.pedantic(pack, setup=setup, rounds=3)
+
+
+def test_pack_certs(benchmark, corpus, tmp_path):
+    rounds = iter(range(1000))
+
+    def setup():
+        return (_packer(tmp_path, next(rounds)),), {}
+
+    def pack(packer):
+        return packer.pack_certs(corpus.packages)
+
+    assert benchmark.pedantic(pack, setup=setup, rounds=3)
@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("dnf")
+
+from tools.splitter.splitter import Splitter  # noqa: E402
+
+
+def _cut(corpus, output, **kwargs):
+    Splitter(
+        corpus.release, corpus.arch, output, corpus.top_slices,
+        slice_dir=corpus.slice_dir,
+        rpmdb=False,
+        **kwargs
+    ).cut()
+
+
+@pytest.mark.parametrize("package_cache", [False, True], ids=["download", "cached"])
+def test_cut(benchmark, corpus, tmp_path, package_cache):
+    output = str(tmp_path / "output")
+    # the first cut fills the metadata and package caches
+    _cut(corpus, output, package_cache=package_cache, rebuild=True)
+
+    def setup():
+        shutil.rmtree(output, ignore_errors=True)
+
+    benchmark.pedantic(
+        _cut, args=(corpus, output), kwargs={"package_cache": package_cache},
+        setup=setup, rounds=3
+    )
+    assert os.listdir(output)
+
+
+def test_cut_unchanged(benchmark, corpus, tmp_path):
+    output = str(tmp_path / "output")
+    _cut(corpus, output)
+    # every package is reused from the last build into the output
+    benchmark.pedantic(_cut, args=(corpus, output), rounds=3)
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from tools.splitter.loader import SplitterLoader, load_cache  # noqa: E402
+
+RELEASE = "openEuler-24.03-LTS"
+
+
+def _sdf_dir(corpus):
+    return os.path.join(corpus.slice_dir, "slices")
+
+
+def test_load_cache(benchmark, corpus):
+    sdf_objs = benchmark(load_cache, _sdf_dir(corpus))
+    assert len(sdf_objs) == len(corpus.packages)
+
+
+def test_resolve_on_demand(benchmark, corpus):
+    def resolve():
+        return SplitterLoader(_sdf_dir(corpus), RELEASE).resolve(corpus.top_slices)
+
+    slices = benchmark(resolve)
+    assert set(corpus.top_slices) <= set(slices)
+
+
+def test_get_deps(benchmark, corpus):
+    def setup():
+        return (SplitterLoader(_sdf_dir(corpus), RELEASE),), {}
+
+    def get_deps(loader):
+        cached_deps = set()
+        return [loader.get_deps(sc, cached_deps) for sc in corpus.top_slices]
+
+    deps = benchmark.pedantic(get_deps, setup=setup, rounds=20)
+    assert deps[0]
@@ -0,0 +1,55 @@
+import shutil
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from tools.parse import parse  # noqa: E402
+from tools.parse.rpmfile import RPMFile  # noqa: E402
+
+PATTERNS = [
+    "/usr/bin/*",
+    "/usr/lib64/*.so*",
+    "/usr/lib64/gconv/*",
+    "/usr/share/locale/*/LC_MESSAGES/*.mo",
+    "/etc/*.conf",
+    "/usr/include/bits/file1?.h",
+    "/usr/libexec/file100",
+]
+
+
+def test_match_files(benchmark, large_package):
+    filenames = [name[1:] for name in RPMFile(large_package).filenames()]
+    matched = benchmark(parse.match_files, filenames, PATTERNS)
+    assert matched
+
+
+def test_list_pkg_files(benchmark, large_package):
+    assert benchmark(parse.list_pkg_files, large_package)
+
+
+def test_extract_files(benchmark, large_package, tmp_path):
+    output = str(tmp_path / "output")
+
+    def setup():
+        shutil.rmtree(output, ignore_errors=True)
+
+    result = benchmark.pedantic(
+        parse.extract_files, args=(large_package, output, PATTERNS),
+        setup=setup, rounds=10
+    )
+    assert result.files
+
+
+def test_extract_many(benchmark, large_package, tmp_path):
+    outputs = [str(tmp_path / f"output{i}") for i in range(4)]
+    jobs = [parse.ExtractJob(output, PATTERNS) for output in outputs]
+
+    def setup():
+        for output in outputs:
+            shutil.rmtree(output, ignore_errors=True)
+
+    results = benchmark.pedantic(
+        parse.extract_many, args=(large_package, jobs), setup=setup, rounds=10
+    )
+    assert all(result.files for result in results)
@@ -0,0 +1,134 @@
+import fnmatch
+import re
+
+import pytest
+
+from tools.parse.matcher import PatternMatcher, translate_globstar
+
+PATHS = [
+    "/usr",
+    "/usr/",
+    "/usr/bin",
+    "/usr/bin/",
+    "/usr/bin/bash",
+    "/usr/bin/sh",
+    "/usr/bin/a]b",
+    "/usr/bin/x86_64-linux-gnu/ld",
+    "/usr/bin2/x",
+    "/usr/lib64/libc.so.6",
+    "/usr/lib64/libm.so",
+    "/usr/lib64/gconv/UTF-16.so",
+    "/usr/share/doc/a.txt",
+    "/usr/share/doc/a\ntxt",
+    "/etc/b.conf",
+    "/etc/bash.bashrc",
+    "/etc/[x]",
+    "/etc/[",
+    "/etc/x",
+    "/etcx",
+    "/etc/a/b",
+]
+
+PATTERNS = [
+    # literals
+    "/usr/bin/bash",
+    "/etc/b.conf",
+    "/usr/bin",
+    # literal prefixes
+    "/usr/bin/*",
+    "/usr/bin/**",
+    "/usr/**",
+    # `*` and `?`
+    "/usr/lib64/*.so*",
+    "/usr/lib64/lib?.so*",
+    "/usr/lib*/*/*.so",
+    "/usr/bin*",
+    "/usr/share/doc/a?txt",
+    "/etc/*",
+    "/etc?x",
+    # `[...]`
+    "/etc/[ab]*",
+    "/etc/[!b]*",
+    "/etc/[^b]*",
+    "/etc/[x]",
+    "/etc/[[]x]",
+    "/etc/[",
+    "/usr/bin/[]a]*",
+    "/etc[!b]x",
+    "/etc[/]x",
+    # `**`
+    "/usr/**/ld",
+    "/**/*.so",
+    "/**/b",
+    "/usr/**/gconv/*",
+]
+
+
+def _globstar_match(path: str, pattern: str) -> bool:
+    """
+    Match component by component with `fnmatch`, a `**` component spans
+    any number of components, at least one at the end of the pattern.
+    """
+    def match(parts, globs):
+        if not globs:
+            return not parts
+        if globs[0] == "**":
+            if len(globs) == 1:
+                return bool(parts)
+            return any(match(parts[i:], globs[1:]) for i in range(len(parts) + 1))
+        return (
+            bool(parts) and fnmatch.fnmatchcase(parts[0], globs[0])
+            and match(parts[1:], globs[1:])
+        )
+    return match(path.split("/"), pattern.split("/"))
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_fnmatch(pattern):
+    matcher = PatternMatcher([pattern])
+    for path in PATHS:
+        assert matcher.match(path) == fnmatch.fnmatchcase(path, pattern), path
+
+
+@pytest.mark.parametrize("pattern", [pattern for pattern in PATTERNS if "**" not in pattern])
+def test_translate_globstar_names(pattern):
+    # within a single component `*` and `?` match as with `fnmatch`
+    pattern = pattern.replace("/", "_")
+    regex = re.compile(translate_globstar(pattern))
+    for path in PATHS:
+        name = path.replace("/", "_")
+        assert bool(regex.match(name)) == fnmatch.fnmatchcase(name, pattern), name
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_globstar(pattern):
+    matcher = PatternMatcher([pattern], globstar=True)
+    regex = re.compile(translate_globstar(pattern))
+    for path in PATHS:
+        expected = _globstar_match(path, pattern)
+        assert matcher.match(path) == expected, path
+        assert bool(regex.match(path)) == expected, path
+
+
+@pytest.mark.parametrize("globstar", [False, True])
+def test_combined(globstar):
+    matcher = PatternMatcher(PATTERNS, globstar=globstar)
+    match = _globstar_match if globstar else fnmatch.fnmatchcase
+    expected = [path for path in PATHS if any(match(path, pattern) for pattern in PATTERNS)]
+    assert [path for path in PATHS if matcher.match(path)] == expected
+
+    matched, unmatched = matcher.filter(PATHS)
+    assert matched == expected
+    assert unmatched == [
+        pattern for pattern in PATTERNS
+        if not any(match(path, pattern) for path in PATHS)
+    ]
+
+
+@pytest.mark.parametrize("globstar", [False, True])
+def test_filter_unmatched(globstar):
+    files = ["/usr/bin/bash", "/usr/lib64/libc.so.6"]
+    patterns = ["/usr/bin/bash", "/usr/bin/*", "/usr/lib64/*.so*", "/usr/lib64/*.a", "/opt/*", "/opt"]
+    matched, unmatched = PatternMatcher(patterns, globstar=globstar).filter(files)
+    assert matched == files
+    assert unmatched == ["/usr/lib64/*.a", "/opt/*", "/opt"]
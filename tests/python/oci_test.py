@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+from tools.image import oci
+from tools.image.layer import MEDIA_TYPES, COMPRESSION_GZIP, LayerInfo
+
+
+def _layer(layout_dir, data):
+    descriptor = oci.write_blob(layout_dir, data, MEDIA_TYPES[COMPRESSION_GZIP])
+    digest = descriptor["digest"]
+    return LayerInfo(
+        oci.blob_path(layout_dir, digest), descriptor["mediaType"], digest,
+        descriptor["size"], digest
+    )
+
+
+def _index(layout_dir):
+    with open(os.path.join(layout_dir, "index.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _refs(layout_dir):
+    return [
+        descriptor["annotations"][oci.ANNOTATION_REF_NAME]
+        for descriptor in _index(layout_dir)["manifests"]
+    ]
+
+
+def _blobs(layout_dir):
+    return {
+        f"sha256:{name}" for name in os.listdir(os.path.join(layout_dir, "blobs", "sha256"))
+    }
+
+
+def test_keeps_other_refs(tmp_path):
+    layout = str(tmp_path)
+    base = _layer(layout, b"base")
+    app = _layer(layout, b"app-1")
+    first = oci.write_oci_layout(layout, [base, app], "x86_64")
+    other = oci.write_oci_layout(layout, [base, _layer(layout, b"tools")], "x86_64", ref_name="tools")
+    assert _refs(layout) == ["latest", "tools"]
+    assert oci.referenced_blobs(layout, _index(layout)["manifests"]) == _blobs(layout)
+    assert {first, other} <= _blobs(layout)
+
+    # the image of a ref is replaced, the blobs only it referenced go
+    second = oci.write_oci_layout(layout, [base, _layer(layout, b"app-2")], "x86_64")
+    assert _refs(layout) == ["tools", "latest"]
+    blobs = _blobs(layout)
+    assert first not in blobs and app.digest not in blobs
+    assert {second, other, base.digest} <= blobs
+    assert oci.referenced_blobs(layout, _index(layout)["manifests"]) == blobs
+
+
+def test_keeps_foreign_images(tmp_path):
+    layout = str(tmp_path)
+    oci.write_oci_layout(layout, [_layer(layout, b"app")], "x86_64")
+    # an image index of another tool, nesting the manifest of its image
+    foreign_layer = _layer(layout, b"foreign")
+    config = oci.write_blob(layout, b"{}", oci.MEDIA_TYPE_CONFIG)
+    manifest = oci.write_blob(layout, oci._dumps({
+        "schemaVersion": 2, "config": config,
+        "layers": [oci.layer_descriptor(foreign_layer)],
+    }), oci.MEDIA_TYPE_MANIFEST)
+    nested = oci.write_blob(layout, oci._dumps({
+        "schemaVersion": 2, "manifests": [manifest],
+    }), oci.MEDIA_TYPE_INDEX)
+    index = _index(layout)
+    index["manifests"].append(nested)
+    index["annotations"] = {"owner": "other"}
+    with open(os.path.join(layout, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    # a blob being written by another process
+    tmp = oci.blob_path(layout, "sha256:" + "0" * 64) + ".tmp-1"
+    open(tmp, "wb").close()
+
+    oci.write_oci_layout(layout, [_layer(layout, b"app-2")], "x86_64")
+    blobs = _blobs(layout)
+    assert {nested["digest"], manifest["digest"], config["digest"], foreign_layer.digest} <= blobs
+    assert os.path.exists(tmp)
+    assert _index(layout)["annotations"] == {"owner": "other"}
+    assert len(_index(layout)["manifests"]) == 2
+
+
+def test_new_layout_prunes_nothing(tmp_path):
+    layout = str(tmp_path)
+    stray = oci.write_blob(layout, b"stray", oci.MEDIA_TYPE_CONFIG)
+    oci.write_oci_layout(layout, [_layer(layout, b"app")], "x86_64")
+    assert stray["digest"] in _blobs(layout)
+
+
+@pytest.mark.parametrize("content", [b"{not json", b"[]", b'{"manifests": {}}'])
+def test_refuses_foreign_index(tmp_path, content):
+    layout = str(tmp_path)
+    stray = oci.write_blob(layout, b"stray", oci.MEDIA_TYPE_CONFIG)
+    with open(os.path.join(layout, "index.json"), "wb") as f:
+        f.write(content)
+    with pytest.raises(RuntimeError, match="Refusing to overwrite"):
+        oci.write_oci_layout(layout, [_layer(layout, b"app")], "x86_64")
+    with open(os.path.join(layout, "index.json"), "rb") as f:
+        assert f.read() == content
+    assert stray["digest"] in _blobs(layout)
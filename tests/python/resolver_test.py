@@ -0,0 +1,98 @@
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from tools.splitter.resolver import SliceResolver
+
+
+class FakeLoader:
+    """
+    Serves slices from a dict of slice -> deps, as `SplitterLoader`.
+    """
+
+    def __init__(self, slices):
+        self.slices = slices
+        self.calls = Counter()
+
+    def get_slice(self, slice):
+        self.calls[slice] += 1
+        package = slice.rsplit("_", 1)[0]
+        if not any(name.startswith(f"{package}_") for name in self.slices):
+            raise ValueError(f"Slice definition file: {package}.yaml is not found!")
+        if slice not in self.slices:
+            return package, None
+        return package, SimpleNamespace(deps=self.slices[slice])
+
+
+SLICES = {
+    "app_bins": ["libc_libs", "bash_bins"],
+    "bash_bins": ["libc_libs", "ncurses_libs"],
+    "ncurses_libs": ["libc_libs"],
+    "libc_libs": ["glibc-common", "filesystem_dirs"],
+    "filesystem_dirs": [],
+}
+
+
+def test_resolve_order():
+    order = SliceResolver(FakeLoader(SLICES)).resolve(["app_bins"])
+    assert sorted(order) == sorted(SLICES)
+    for slice, deps in SLICES.items():
+        for dep in deps:
+            if dep in SLICES:
+                assert order.index(dep) < order.index(slice)
+
+
+def test_resolve_memoized():
+    loader = FakeLoader(SLICES)
+    resolver = SliceResolver(loader)
+    first = resolver.resolve(["bash_bins", "ncurses_libs"])
+    assert resolver.resolve(["app_bins", "bash_bins"]) == first + ["app_bins"]
+    # every slice is looked up once
+    assert set(loader.calls.values()) == {1}
+    assert resolver.closure("bash_bins") == {
+        "bash_bins", "ncurses_libs", "libc_libs", "filesystem_dirs"
+    }
+    assert resolver.closure("filesystem_dirs") == {"filesystem_dirs"}
+
+
+@pytest.mark.parametrize("slices, message", [
+    (
+        {"a_x": ["b_x"], "b_x": ["c_x"], "c_x": ["a_x"]},
+        "Circular slice dependency: a_x -> b_x -> c_x -> a_x",
+    ),
+    (
+        {"root_x": ["a_x"], "a_x": ["b_x"], "b_x": ["a_x"]},
+        "Circular slice dependency: a_x -> b_x -> a_x",
+    ),
+    (
+        {"root_x": ["a_x"], "a_x": ["a_x"]},
+        "Circular slice dependency: a_x -> a_x",
+    ),
+])
+def test_cycle(slices, message):
+    root = next(iter(slices))
+    with pytest.raises(ValueError) as e:
+        SliceResolver(FakeLoader(slices)).resolve([root])
+    assert str(e.value) == message
+
+
+def test_missing_slice():
+    slices = {"a_x": ["b_x"], "b_x": ["b_y"]}
+    with pytest.raises(ValueError) as e:
+        SliceResolver(FakeLoader(slices)).resolve(["a_x"])
+    assert str(e.value) == "Slice: b_y is not found! Required by: a_x -> b_x -> b_y"
+
+
+def test_missing_sdf():
+    slices = {"a_x": ["b_x"], "b_x": ["c_x"]}
+    with pytest.raises(ValueError) as e:
+        SliceResolver(FakeLoader(slices)).resolve(["a_x"])
+    assert str(e.value) == (
+        "Slice definition file: c.yaml is not found! Required by: a_x -> b_x -> c_x"
+    )
+
+
+def test_missing_root():
+    with pytest.raises(ValueError, match="Slice: a_y is not found! Required by: a_y$"):
+        SliceResolver(FakeLoader({"a_x": []})).resolve(["a_x", "a_y"])
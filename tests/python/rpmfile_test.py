@@ -0,0 +1,243 @@
+import gzip
+import os
+import stat
+import struct
+
+import pytest
+
+from tools.parse.rpmfile import (
+    CPIO_TRAILER,
+    LEAD_MAGIC,
+    LEAD_SIZE,
+    RPM_INT16_TYPE,
+    RPM_INT32_TYPE,
+    RPM_STRING_ARRAY_TYPE,
+    RPM_STRING_TYPE,
+    RPMTAG_ARCH,
+    RPMTAG_FILEDEVICES,
+    RPMTAG_FILEFLAGS,
+    RPMTAG_FILEINODES,
+    RPMTAG_FILELINKTOS,
+    RPMTAG_FILEMODES,
+    RPMTAG_FILEMTIMES,
+    RPMTAG_FILESIZES,
+    RPMTAG_NAME,
+    RPMTAG_OLDFILENAMES,
+    RPMTAG_PAYLOADCOMPRESSOR,
+    RPMTAG_RELEASE,
+    RPMTAG_VERSION,
+    RPMFile,
+    _safe_join,
+)
+
+MTIME = 1700000000
+DIR = stat.S_IFDIR | 0o755
+REG = stat.S_IFREG | 0o644
+EXE = stat.S_IFREG | 0o755
+LNK = stat.S_IFLNK | 0o777
+
+# (path, mode, data or link target, inode), `bin/a` and `bin/b` are
+# hardlinks of each other
+FILES = [
+    ("/usr", DIR, b"", 1),
+    ("/usr/bin", DIR, b"", 2),
+    ("/usr/bin/a", EXE, b"#!/bin/sh\necho hardlinked\n", 3),
+    ("/usr/bin/b", EXE, b"#!/bin/sh\necho hardlinked\n", 3),
+    ("/usr/bin/c", LNK, b"a", 4),
+    ("/usr/share/doc", REG, b"doc", 5),
+]
+
+
+def _header(tags):
+    index = b""
+    store = b""
+    for tag, tag_type, value in tags:
+        store += b"\0" * (-len(store) % 4)
+        offset = len(store)
+        if tag_type == RPM_STRING_TYPE:
+            store += value.encode("utf-8") + b"\0"
+            count = 1
+        elif tag_type == RPM_STRING_ARRAY_TYPE:
+            store += b"".join(item.encode("utf-8") + b"\0" for item in value)
+            count = len(value)
+        elif tag_type == RPM_INT16_TYPE:
+            store += struct.pack(f">{len(value)}H", *value)
+            count = len(value)
+        else:
+            store += struct.pack(f">{len(value)}I", *value)
+            count = len(value)
+        index += struct.pack(">IIII", tag, tag_type, offset, count)
+    return (
+        b"\x8e\xad\xe8\x01\0\0\0\0"
+        + struct.pack(">II", len(tags), len(store)) + index + store
+    )
+
+
+def _newc(name, mode, data, ino, nlink=1):
+    encoded = name.encode("utf-8") + b"\0"
+    fields = (ino, mode, 0, 0, nlink, MTIME, len(data), 0, 1, 0, 0, len(encoded), 0)
+    entry = b"070701" + b"".join(b"%08x" % field for field in fields) + encoded
+    entry += b"\0" * (-len(entry) % 4)
+    return entry + data + b"\0" * (-len(data) % 4)
+
+
+def _stripped(fx, data):
+    return b"07070X" + b"%08x" % fx + b"00" + data + b"\0" * (-len(data) % 4)
+
+
+def _payload(files, stripped=False):
+    """
+    The cpio archive of `files`, the data of a hardlink group comes with
+    its last member as written by rpm.
+    """
+    last_links = {}
+    for fx, (_, mode, _, ino) in enumerate(files):
+        last_links[ino] = fx
+    nlinks = {ino: sum(1 for file in files if file[3] == ino) for ino in last_links}
+    payload = b""
+    for fx, (path, mode, data, ino) in enumerate(files):
+        if stat.S_ISREG(mode) and last_links[ino] != fx:
+            data = b""
+        if stripped:
+            payload += _stripped(fx, data)
+        else:
+            payload += _newc(f".{path}", mode, data, ino, nlinks[ino])
+    return payload + _newc(CPIO_TRAILER, 0, b"", 0)
+
+
+def write_rpm(path, files=FILES, payload=None):
+    header = _header([
+        (RPMTAG_NAME, RPM_STRING_TYPE, "demo"),
+        (RPMTAG_VERSION, RPM_STRING_TYPE, "1.0"),
+        (RPMTAG_RELEASE, RPM_STRING_TYPE, "1"),
+        (RPMTAG_ARCH, RPM_STRING_TYPE, "noarch"),
+        (RPMTAG_OLDFILENAMES, RPM_STRING_ARRAY_TYPE, [file[0] for file in files]),
+        (RPMTAG_FILESIZES, RPM_INT32_TYPE, [len(file[2]) for file in files]),
+        (RPMTAG_FILEMODES, RPM_INT16_TYPE, [file[1] for file in files]),
+        (RPMTAG_FILEMTIMES, RPM_INT32_TYPE, [MTIME] * len(files)),
+        (RPMTAG_FILELINKTOS, RPM_STRING_ARRAY_TYPE, [
+            file[2].decode() if stat.S_ISLNK(file[1]) else "" for file in files
+        ]),
+        (RPMTAG_FILEFLAGS, RPM_INT32_TYPE, [0] * len(files)),
+        (RPMTAG_FILEDEVICES, RPM_INT32_TYPE, [1] * len(files)),
+        (RPMTAG_FILEINODES, RPM_INT32_TYPE, [file[3] for file in files]),
+        (RPMTAG_PAYLOADCOMPRESSOR, RPM_STRING_TYPE, "gzip"),
+    ])
+    signature = _header([(1000, RPM_INT32_TYPE, [len(header)])])
+    signature += b"\0" * (-len(signature) % 8)
+    lead = LEAD_MAGIC + b"\x03\x00" + b"\0" * (LEAD_SIZE - 6)
+    if payload is None:
+        payload = _payload(files)
+    with open(path, "wb") as f:
+        f.write(lead + signature + header + gzip.compress(payload, mtime=0))
+    return str(path)
+
+
+def _names():
+    return [f".{file[0]}" for file in FILES]
+
+
+def test_header(tmp_path):
+    rpm_file = RPMFile(write_rpm(tmp_path / "demo.rpm"))
+    assert (rpm_file.name, rpm_file.version, rpm_file.release, rpm_file.arch) == \
+        ("demo", "1.0", "1", "noarch")
+    assert rpm_file.epoch == 0
+    assert rpm_file.filenames() == _names()
+    assert rpm_file.hardlinks() == {(1, 3): [2, 3]}
+
+
+@pytest.mark.parametrize("stripped", [False, True], ids=["newc", "stripped"])
+def test_extract(tmp_path, stripped):
+    path = write_rpm(tmp_path / "demo.rpm", payload=_payload(FILES, stripped))
+    output = tmp_path / "output"
+    written = RPMFile(path).extract(str(output), _names())
+    assert sorted(written) == sorted(_names())
+
+    a, b = output / "usr/bin/a", output / "usr/bin/b"
+    assert a.read_bytes() == FILES[2][2]
+    assert os.stat(a).st_ino == os.stat(b).st_ino
+    assert stat.S_IMODE(os.stat(a).st_mode) == 0o755
+    assert os.readlink(output / "usr/bin/c") == "a"
+    assert (output / "usr/share/doc").read_bytes() == b"doc"
+    assert os.stat(output / "usr/share/doc").st_mtime == MTIME
+    assert os.stat(output / "usr/bin").st_mtime == MTIME
+
+
+@pytest.mark.parametrize("stripped", [False, True], ids=["newc", "stripped"])
+def test_extract_hardlink_without_data(tmp_path, stripped):
+    # the wanted member carries no data, it comes with the other link
+    path = write_rpm(tmp_path / "demo.rpm", payload=_payload(FILES, stripped))
+    output = tmp_path / "output"
+    assert RPMFile(path).extract(str(output), ["./usr/bin/a"]) == ["./usr/bin/a"]
+    assert (output / "usr/bin/a").read_bytes() == FILES[2][2]
+    assert not (output / "usr/bin/b").exists()
+
+
+def test_open_payload_stripped(tmp_path):
+    path = write_rpm(tmp_path / "demo.rpm", payload=_payload(FILES, stripped=True))
+    with RPMFile(path).open_payload() as reader:
+        entries = {entry.name: (entry, reader.read()) for entry in reader}
+    assert list(entries) == _names()
+    link, target = entries["./usr/bin/c"]
+    assert stat.S_ISLNK(link.mode) and target == b"a"
+    assert entries["./usr/bin/a"][0].nlink == 2
+    assert entries["./usr/bin/a"][1] == b""
+    assert entries["./usr/bin/b"][1] == FILES[3][2]
+
+
+@pytest.mark.parametrize("name", ["../etc/passwd", "./../x", "/../x", "usr/../../x", ".", "/"])
+def test_safe_join_refuses(tmp_path, name):
+    with pytest.raises(RuntimeError, match="unsafe path"):
+        _safe_join(str(tmp_path), name)
+
+
+def test_safe_join(tmp_path):
+    assert _safe_join(str(tmp_path), "./usr/bin/a") == os.path.join(str(tmp_path), "usr/bin/a")
+    assert _safe_join(str(tmp_path), "/usr/../etc") == os.path.join(str(tmp_path), "etc")
+
+
+def test_extract_refuses_unsafe_member(tmp_path):
+    files = [("/../escaped", REG, b"evil", 1)]
+    path = write_rpm(tmp_path / "demo.rpm", files=files)
+    output = tmp_path / "output"
+    with pytest.raises(RuntimeError, match="unsafe path"):
+        RPMFile(path).extract(str(output), ["./../escaped"])
+    assert not (tmp_path / "escaped").exists()
+
+
+def test_not_an_rpm(tmp_path):
+    path = tmp_path / "demo.rpm"
+    path.write_bytes(b"\0" * LEAD_SIZE * 2)
+    with pytest.raises(RuntimeError, match="Not a RPM package"):
+        RPMFile(str(path))
+
+
+@pytest.mark.parametrize("size", [10, LEAD_SIZE, LEAD_SIZE + 20, LEAD_SIZE + 40])
+def test_truncated_header(tmp_path, size):
+    data = open(write_rpm(tmp_path / "demo.rpm"), "rb").read()
+    path = tmp_path / "truncated.rpm"
+    path.write_bytes(data[:size])
+    with pytest.raises(RuntimeError, match="Unexpected end of RPM file"):
+        RPMFile(str(path))
+
+
+def test_corrupt_header(tmp_path):
+    data = bytearray(open(write_rpm(tmp_path / "demo.rpm"), "rb").read())
+    data[LEAD_SIZE] ^= 0xff
+    path = tmp_path / "corrupt.rpm"
+    path.write_bytes(bytes(data))
+    with pytest.raises(RuntimeError, match="Bad RPM header magic"):
+        RPMFile(str(path))
+
+
+def test_truncated_payload(tmp_path):
+    payload = _payload(FILES)
+    path = write_rpm(tmp_path / "demo.rpm", payload=payload[:len(payload) // 2])
+    with pytest.raises(RuntimeError, match="Unexpected end"):
+        RPMFile(path).extract(str(tmp_path / "output"), _names())
+
+
+def test_corrupt_payload(tmp_path):
+    path = write_rpm(tmp_path / "demo.rpm", payload=b"070799" + _payload(FILES)[6:])
+    with pytest.raises(RuntimeError, match="Bad cpio magic"):
+        RPMFile(path).extract(str(tmp_path / "output"), _names())
@@ -0,0 +1,141 @@
+import json
+import os
+
+from tools.cert.sbom import PackageRecord
+from tools.splitter.state import (
+    STATE_FILE,
+    STATE_VERSION,
+    BuildState,
+    PackageState,
+    input_key,
+    snapshot,
+)
+
+CHECKSUM = ("sha256", "ab" * 32)
+MANIFEST = "./.splitter-sbom.json"
+
+
+def _write(output, name, data=b"data"):
+    path = os.path.join(output, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _package(output, key, files, record=True):
+    for name in files:
+        if not name.endswith("/"):
+            _write(output, name)
+    files = [name.rstrip("/") for name in files]
+    return PackageState(
+        key, "bash-5.2-1.x86_64", snapshot(output, files),
+        PackageRecord("bash", 0, "5.2", "1", "x86_64") if record else None
+    )
+
+
+def test_input_key():
+    key = input_key("bash-5.2-1.x86_64", CHECKSUM, ["/usr/bin/*"], [], False)
+    assert key == input_key("bash-5.2-1.x86_64", CHECKSUM, ["/usr/bin/*"], [], False)
+    assert len({
+        key,
+        input_key("bash-5.2-2.x86_64", CHECKSUM, ["/usr/bin/*"], [], False),
+        input_key("bash-5.2-1.x86_64", ("sha256", "cd" * 32), ["/usr/bin/*"], [], False),
+        input_key("bash-5.2-1.x86_64", CHECKSUM, ["/usr/bin/bash"], [], False),
+        input_key("bash-5.2-1.x86_64", CHECKSUM, ["/usr/bin/*"], [{"copy": []}], False),
+        input_key("bash-5.2-1.x86_64", CHECKSUM, ["/usr/bin/*"], [], True),
+    }) == 6
+
+
+def test_save_load(tmp_path):
+    output = str(tmp_path)
+    state = BuildState(
+        ["bash_bins"], {"bash": _package(output, "key", ["./usr/bin/bash"])}, [MANIFEST]
+    )
+    state.save(output)
+    loaded = BuildState.load(output)
+    assert loaded.slices == ["bash_bins"]
+    assert loaded.manifests == [MANIFEST]
+    assert loaded.packages["bash"].to_dict() == state.packages["bash"].to_dict()
+
+
+def test_load_ignores_other_versions(tmp_path):
+    output = str(tmp_path)
+    BuildState(["bash_bins"]).save(output)
+    path = os.path.join(output, STATE_FILE)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] = STATE_VERSION - 1
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert BuildState.load(output).slices == []
+
+
+def test_load_ignores_unreadable(tmp_path):
+    output = str(tmp_path)
+    assert BuildState.load(output).packages == {}
+    _write(output, STATE_FILE, b"{not json")
+    assert BuildState.load(output).packages == {}
+    _write(output, STATE_FILE, json.dumps({"version": STATE_VERSION}).encode())
+    assert BuildState.load(output).packages == {}
+
+
+def test_reusable(tmp_path):
+    output = str(tmp_path)
+    state = BuildState(packages={
+        "bash": _package(output, "key", ["./usr/bin/", "./usr/bin/bash", "./usr/bin/sh"]),
+        "zsh": _package(output, "key", ["./usr/bin/zsh"], record=False),
+    })
+    assert state.reusable("bash", "key", output) is state.packages["bash"]
+    assert state.reusable("bash", "other", output) is None
+    assert state.reusable("missing", "key", output) is None
+    # without its record the SBOM could not be written again
+    assert state.reusable("zsh", "key", output) is None
+    # new files in a directory of the package change nothing
+    _write(output, "./usr/bin/ksh")
+    assert state.reusable("bash", "key", output) is state.packages["bash"]
+
+
+def test_reusable_changed(tmp_path):
+    output = str(tmp_path)
+    state = BuildState(packages={
+        "bash": _package(output, "key", ["./usr/bin/bash", "./usr/bin/sh"]),
+    })
+    _write(output, "./usr/bin/bash", b"modified")
+    assert state.reusable("bash", "key", output) is None
+
+    state.packages["bash"] = _package(output, "key", ["./usr/bin/bash", "./usr/bin/sh"])
+    os.utime(os.path.join(output, "./usr/bin/sh"), ns=(0, 0))
+    assert state.reusable("bash", "key", output) is None
+
+    state.packages["bash"] = _package(output, "key", ["./usr/bin/bash", "./usr/bin/sh"])
+    os.unlink(os.path.join(output, "./usr/bin/sh"))
+    assert state.reusable("bash", "key", output) is None
+
+
+def test_remove_stale(tmp_path):
+    output = str(tmp_path)
+    previous = BuildState(
+        packages={
+            "bash": _package(output, "a", ["./usr/", "./usr/bin/", "./usr/bin/bash", "./etc/bashrc"]),
+            "vim": _package(output, "b", ["./usr/share/", "./usr/share/vim/", "./usr/share/vim/vimrc"]),
+        },
+        manifests=[MANIFEST, "./old-manifest.json"]
+    )
+    _write(output, MANIFEST)
+    _write(output, "./old-manifest.json")
+    # a file of the user in a directory of a removed package
+    _write(output, "./usr/share/notes")
+    current = BuildState(
+        packages={"bash": _package(output, "c", ["./usr/", "./usr/bin/", "./usr/bin/bash"])},
+        manifests=[MANIFEST]
+    )
+
+    # `./usr/share` still holds a file
+    assert previous.remove_stale(output, current) == 4
+    remaining = sorted(
+        os.path.relpath(os.path.join(root, name), output)
+        for root, dirs, files in os.walk(output) for name in dirs + files
+    )
+    assert remaining == [
+        ".splitter-sbom.json", "etc", "usr", "usr/bin", "usr/bin/bash", "usr/share", "usr/share/notes"
+    ]
@@ -0,0 +1,93 @@
+import os
+import stat
+
+import pytest
+
+from rpmfile_test import FILES, write_rpm
+from tools.parse import rpmfile
+from tools.parse.fileops import LINK_COPY, LINK_HARDLINK, LINK_REFLINK
+from tools.parse.parse import ExtractJob, extract_many
+from tools.parse.store import MEMBERS_FILE, TREE_DIR, FileStore
+
+CHECKSUM = ("sha256", "ab" * 32)
+NAMES = [f".{file[0]}" for file in FILES]
+
+
+def _extract(tmp_path, store, outputs, patterns=("/usr", "/usr/*")):
+    path = write_rpm(tmp_path / "demo.rpm")
+    jobs = [ExtractJob(str(tmp_path / output), list(patterns), None) for output in outputs]
+    return extract_many(path, jobs, store=store, checksum=CHECKSUM)
+
+
+def test_entry_path(tmp_path):
+    store = FileStore(str(tmp_path / "store"))
+    assert store.entry_path(CHECKSUM) == str(tmp_path / "store" / "sha256" / "ab" / CHECKSUM[1])
+
+
+@pytest.mark.parametrize("link", [LINK_HARDLINK, LINK_REFLINK, LINK_COPY])
+def test_placement(tmp_path, link):
+    store = FileStore(str(tmp_path / "store"), link=link)
+    results = _extract(tmp_path, store, ["o1", "o2"])
+    assert [sorted(result.files) for result in results] == [sorted(NAMES)] * 2
+
+    tree = os.path.join(store.entry_path(CHECKSUM), TREE_DIR)
+    for output in ("o1", "o2"):
+        a, b = tmp_path / output / "usr/bin/a", tmp_path / output / "usr/bin/b"
+        assert a.read_bytes() == FILES[2][2]
+        assert stat.S_IMODE(os.stat(a).st_mode) == 0o755
+        # the hardlinks of the package stay hardlinks in each output
+        assert os.stat(a).st_ino == os.stat(b).st_ino
+        assert os.readlink(tmp_path / output / "usr/bin/c") == "a"
+        shared = os.stat(a).st_ino == os.stat(os.path.join(tree, "usr/bin/a")).st_ino
+        assert shared == (link == LINK_HARDLINK)
+
+
+def test_extracted_once(tmp_path, monkeypatch):
+    store = FileStore(str(tmp_path / "store"))
+    _extract(tmp_path, store, ["o1"], ["/usr/bin/*"])
+    with store.entry(CHECKSUM) as entry:
+        assert entry.missing(NAMES) == ["./usr", "./usr/bin", "./usr/share/doc"]
+
+    extracted = []
+    extract = rpmfile.RPMFile.extract
+
+    def spy(self, output_dir, names):
+        extracted.append(sorted(names))
+        return extract(self, output_dir, names)
+
+    monkeypatch.setattr(rpmfile.RPMFile, "extract", spy)
+    # only the members missing from the store are extracted
+    _extract(tmp_path, store, ["o2"], ["/usr/bin/*", "/usr/share/*"])
+    assert extracted == [["./usr/share/doc"]]
+    _extract(tmp_path, store, ["o3"], ["/usr/bin/*", "/usr/share/*"])
+    assert extracted == [["./usr/share/doc"]]
+    assert (tmp_path / "o3/usr/share/doc").read_bytes() == b"doc"
+
+
+def test_missing_from_tree(tmp_path):
+    store = FileStore(str(tmp_path / "store"))
+    _extract(tmp_path, store, ["o1"])
+    with store.entry(CHECKSUM) as entry:
+        assert entry.missing(NAMES) == []
+        os.unlink(os.path.join(entry.tree, "usr/share/doc"))
+        assert entry.missing(NAMES) == ["./usr/share/doc"]
+
+
+def test_gc(tmp_path):
+    store = FileStore(str(tmp_path / "store"))
+    _extract(tmp_path, store, ["o1"])
+    other = ("sha256", "cd" * 32)
+    with store.entry(other) as entry:
+        entry.add([])
+    assert len(store.entries()) == 2
+
+    members = os.path.join(store.entry_path(CHECKSUM), MEMBERS_FILE)
+    os.utime(members, (0, 0))
+    # an entry in use by a cut is kept
+    with store.entry(CHECKSUM):
+        assert store.gc(max_age=60) == []
+    removed = store.gc(max_age=60)
+    assert [entry.path for entry in removed] == [store.entry_path(CHECKSUM)]
+    assert [entry.path for entry in store.entries()] == [store.entry_path(other)]
+    # the outputs keep their files
+    assert (tmp_path / "o1/usr/share/doc").read_bytes() == b"doc"
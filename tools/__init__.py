@@ -1,6 +1,5 @@
 # coding=utf-8
 import os
-import shutil
 
 PATHS = [
     os.path.join(os.path.dirname(os.__file__), "../../etc/splitter/"),
@@ -15,19 +14,32 @@ for path in PATHS:
     if os.path.exists(path):
         EP_SPLITTER_PATH = path
         break
+if os.environ.get("SPLITTER_CONFIG_DIR"):
+    EP_SPLITTER_PATH = os.environ.get("SPLITTER_CONFIG_DIR")
 
 SLICE_REPO = "https://gitee.com/openeuler/slice-releases.git"
+if os.environ.get("SPLITTER_SLICE_REPO"):
+    SLICE_REPO = os.environ.get("SPLITTER_SLICE_REPO")
 SLICE_PATH = os.path.join(EP_SPLITTER_PATH, "slice-releases")
 SLICE_DIR = os.path.join(SLICE_PATH, "slices")
-CACHE_PATH = os.path.join(EP_SPLITTER_PATH, "cache")
-REPO_PATH = os.path.join(EP_SPLITTER_PATH, "repo")
 SDF_DIR_PREFIX = os.path.join(EP_SPLITTER_PATH, "data")
 
-if os.path.exists(CACHE_PATH):
-    shutil.rmtree(CACHE_PATH)
+# Persistent caches survive across runs and are never removed implicitly.
+SPLITTER_CACHE_DIR = "/var/cache/splitter/"
+if os.environ.get("SPLITTER_CACHE_DIR"):
+    SPLITTER_CACHE_DIR = os.environ.get("SPLITTER_CACHE_DIR")
+PACKAGE_CACHE_PATH = os.path.join(SPLITTER_CACHE_DIR, "packages")
+METADATA_CACHE_PATH = os.path.join(SPLITTER_CACHE_DIR, "metadata")
+SLICE_MIRROR_PATH = os.path.join(SPLITTER_CACHE_DIR, "slice-releases")
+SLICE_INDEX_PATH = os.path.join(SPLITTER_CACHE_DIR, "index")
+LAYER_CACHE_PATH = os.path.join(SPLITTER_CACHE_DIR, "layers")
+FILE_STORE_PATH = os.path.join(SPLITTER_CACHE_DIR, "files")
+# Each run renders its repo files and downloads its packages to a
+# directory of its own here, removed when the run ends.
+RUN_PATH = os.path.join(SPLITTER_CACHE_DIR, "runs")
+SERVE_PATH = os.path.join(SPLITTER_CACHE_DIR, "serve")
+SERVE_SOCKET_PATH = os.path.join(SERVE_PATH, "splitter.sock")
+if os.environ.get("SPLITTER_SOCKET"):
+    SERVE_SOCKET_PATH = os.environ.get("SPLITTER_SOCKET")
+SERVE_TOKEN_PATH = os.path.join(SERVE_PATH, "token")
 
-if os.path.exists(REPO_PATH):
-    shutil.rmtree(REPO_PATH)
-
-if os.path.exists(SLICE_PATH):
-    shutil.rmtree(SLICE_PATH)
\ No newline at end of file
@@ -1,10 +1,14 @@
 import subprocess
 import os
-from typing import Optional
-from tools.logger import logger
+from typing import Iterable, List, Optional, Set
+from tools.logger import logger, tracer
+from tools.parse.rpmfile import RPMFile
 
 
 DEFAULT_RPMDB_PATH="/var/lib/rpm"
+# query formats of `verify_packages`, the NEVRA matches `PackageRecord.nevra`
+QUERY_NAME = "%{NAME}"
+QUERY_NEVRA = "%{NAME}-%|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}.%{ARCH}"
 
 def run_command(cmd: list, check: bool = True) -> bool:
     try:
@@ -24,7 +28,8 @@ def run_command(cmd: list, check: bool = True) -> bool:
 
 def init_rpm_db(db_path: str) -> bool:
     logger.info("Initializing RPM database...")
-    return run_command(["rpmdb", "--initdb", "--dbpath", db_path])
+    with tracer.span("cert.init_db"):
+        return run_command(["rpmdb", "--initdb", "--dbpath", db_path])
 
 
 def add_package_to_db(db_path: str, rpm_file: str) -> bool:
@@ -47,6 +52,82 @@ def add_package_to_db(db_path: str, rpm_file: str) -> bool:
     return run_command(command)
 
 
+def add_packages_to_db(db_path: str, rpm_files: List[str]) -> bool:
+    """
+    Register all `rpm_files` in one `rpm` transaction, so the rpmdb is
+    opened, locked and written once instead of once per package.
+    """
+    missing = [rpm_file for rpm_file in rpm_files if not os.path.isfile(rpm_file)]
+    for rpm_file in missing:
+        logger.error(f"RPM file not found: {rpm_file}")
+    if missing:
+        return False
+    if not rpm_files:
+        return True
+
+    logger.info(f"Adding {len(rpm_files)} packages to RPM database...")
+    command = [
+        "rpm",
+        "-ivh",
+        "--ignorearch",
+        "--force",
+        "--nodeps",
+        "--justdb",
+        "--dbpath",
+        db_path,
+        *rpm_files
+    ]
+    return run_command(command)
+
+
+def remove_packages_from_db(db_path: str, pkgs: List[str]) -> bool:
+    logger.info(f"Removing {len(pkgs)} packages from RPM database...")
+    command = [
+        "rpm",
+        "-e",
+        "--nodeps",
+        "--justdb",
+        "--noscripts",
+        "--notriggers",
+        "--dbpath",
+        db_path,
+        *pkgs
+    ]
+    return run_command(command)
+
+
+def verify_packages(db_path: str, pkg_names: Iterable[str],
+                    query_format: str = QUERY_NAME) -> Set[str]:
+    """
+    Query all `pkg_names` at once.
+
+    args:
+        pkg_names: The packages, as printed with `query_format`.
+        query_format: QUERY_NAME or QUERY_NEVRA.
+    return:
+        The packages of `pkg_names` found in the database.
+    """
+    pkg_names = list(pkg_names)
+    if not pkg_names:
+        return set()
+    try:
+        # `rpm -q` fails if any of the packages is missing, the
+        # installed ones are printed nevertheless
+        result = subprocess.run(
+            ["rpm", "--dbpath", db_path, "-q", "--qf", f"{query_format}\\n", *pkg_names],
+            check=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+    except FileNotFoundError:
+        logger.error("Command not found: rpm")
+        return set()
+    # missing packages are reported as `package x is not installed`
+    found = {line.strip() for line in result.stdout.splitlines()}
+    return found & set(pkg_names)
+
+
 def verify_package(db_path: str, pkg_name: str) -> Optional[str]:
     try:
         result = subprocess.run(
@@ -71,15 +152,60 @@ class RPMCertPacker:
         if init_rpm_db(db_path=self.db_path):
             logger.info("Succeed to initalize RPM DB.")
         else:
-            raise("Failed to initalize RPM DB.")
+            raise RuntimeError("Failed to initalize RPM DB.")
 
     def pack_cert(self, rpm_file: str) -> bool:
         if os.geteuid() != 0:
-            raise("This script must be run as root!")
-        if not add_package_to_db(db_path=self.db_path, rpm_file=rpm_file):
-            return False
-        pkg_name = os.path.basename(rpm_file).replace(".rpm", "").split("-")[0]
-        pkg_info = verify_package(db_path=self.db_path, pkg_name=pkg_name)
-        if not pkg_info:
-            return False
-        return True
+            raise RuntimeError("This script must be run as root!")
+        with tracer.span("cert.pack_cert", package=os.path.basename(rpm_file)):
+            if not add_package_to_db(db_path=self.db_path, rpm_file=rpm_file):
+                return False
+            pkg_name = os.path.basename(rpm_file).replace(".rpm", "").split("-")[0]
+            pkg_info = verify_package(db_path=self.db_path, pkg_name=pkg_name)
+            if not pkg_info:
+                return False
+            return True
+
+    def pack_certs(self, rpm_files: List[str]) -> bool:
+        """
+        Register all `rpm_files` in one transaction and verify them
+        with a single query.
+
+        return:
+            True if every package is found in the database afterwards.
+        """
+        if os.geteuid() != 0:
+            raise RuntimeError("This script must be run as root!")
+        rpm_files = list(dict.fromkeys(rpm_files))
+        with tracer.span("cert.pack_certs", packages=len(rpm_files)):
+            if not add_packages_to_db(db_path=self.db_path, rpm_files=rpm_files):
+                return False
+            pkg_names = [RPMFile(rpm_file).name for rpm_file in rpm_files]
+            missing = set(pkg_names) - verify_packages(self.db_path, pkg_names)
+        for pkg_name in sorted(missing):
+            logger.error(f"Package {pkg_name} is missing from the RPM database")
+        return not missing
+
+    def remove_certs(self, pkgs: List[str]) -> bool:
+        """
+        Remove the packages `pkgs`, given by NEVRA, in one transaction.
+
+        `rpm -e` erases nothing if any of its packages is missing, those
+        which were never registered, e.g. after a failed `pack_certs`,
+        are left out.
+
+        return:
+            True if none of the packages is in the database afterwards.
+        """
+        if os.geteuid() != 0:
+            raise RuntimeError("This script must be run as root!")
+        if not pkgs:
+            return True
+        with tracer.span("cert.remove_certs", packages=len(pkgs)):
+            installed = verify_packages(self.db_path, pkgs, QUERY_NEVRA)
+            if installed:
+                remove_packages_from_db(db_path=self.db_path, pkgs=sorted(installed))
+            left = verify_packages(self.db_path, installed, QUERY_NEVRA)
+        for pkg in sorted(left):
+            logger.error(f"Package {pkg} is still in the RPM database")
+        return not left
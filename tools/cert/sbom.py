@@ -0,0 +1,489 @@
+import json
+import os
+import time
+import uuid
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from tools.logger import logger
+from tools.parse.rpmfile import RPMFile
+from tools.parse.rpmfile import (
+    RPMTAG_BUILDTIME,
+    RPMTAG_FILEDIGESTALGO,
+    RPMTAG_LICENSE,
+    RPMTAG_PAYLOADDIGEST,
+    RPMTAG_PAYLOADDIGESTALGO,
+    RPMTAG_SOURCERPM,
+    RPMTAG_SUMMARY,
+    RPMTAG_URL,
+)
+
+# provenance files are written to this directory of the output
+SBOM_DIR = "var/lib/splitter"
+MANIFEST_FILE = "manifest.wall"
+SPDX_FILE = "sbom.spdx.json"
+CYCLONEDX_FILE = "sbom.cdx.json"
+
+TOOL_NAME = "splitter"
+PURL_NAMESPACE = "openeuler"
+
+# RPM digest algorithm ids -> SPDX/CycloneDX algorithm names
+DIGEST_ALGOS = {
+    1: ("MD5", "MD5"),
+    2: ("SHA1", "SHA-1"),
+    8: ("SHA256", "SHA-256"),
+    9: ("SHA384", "SHA-384"),
+    10: ("SHA512", "SHA-512"),
+    11: ("SHA224", "SHA-224"),
+}
+# repository checksum types -> RPM digest algorithm ids
+CHECKSUM_TYPES = {
+    "md5": 1,
+    "sha1": 2,
+    "sha": 2,
+    "sha256": 8,
+    "sha384": 9,
+    "sha512": 10,
+    "sha224": 11,
+}
+
+
+def _string(header, tag: int) -> str:
+    value = header.get(tag, "")
+    # i18n strings hold one entry per locale, the first one is `C`
+    if isinstance(value, list):
+        return value[0] if value else ""
+    return value
+
+
+class FileRecord:
+    __slots__ = ("path", "mode", "size", "digest", "linkto")
+
+    def __init__(self, path: str, mode: int, size: int, digest: str, linkto: str):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.digest = digest
+        self.linkto = linkto
+
+
+class PackageRecord:
+    """
+    Provenance of one package in the output, read from its RPM header.
+    """
+
+    def __init__(self, name: str, epoch: int, version: str, release: str,
+                 arch: str):
+        self.name = name
+        self.epoch = epoch
+        self.version = version
+        self.release = release
+        self.arch = arch
+        self.license = ""
+        self.sourcerpm = ""
+        self.summary = ""
+        self.url = ""
+        self.buildtime = 0
+        # RPM digest algorithm id -> hex digest of the package file
+        self.checksums: Dict[int, str] = {}
+        self.payload_digest: Optional[Tuple[int, str]] = None
+        self.file_digest_algo = 1
+        self.slices: List[str] = []
+        self.files: List[FileRecord] = []
+
+    @property
+    def evr(self) -> str:
+        evr = f"{self.version}-{self.release}"
+        return f"{self.epoch}:{evr}" if self.epoch else evr
+
+    @property
+    def nevra(self) -> str:
+        return f"{self.name}-{self.evr}.{self.arch}"
+
+    @property
+    def purl(self) -> str:
+        purl = f"pkg:rpm/{PURL_NAMESPACE}/{self.name}@{self.version}-{self.release}?arch={self.arch}"
+        if self.epoch:
+            purl += f"&epoch={self.epoch}"
+        return purl
+
+    def add_checksum(self, checksum_type: str, digest: str) -> None:
+        """
+        Record a checksum of the package file, e.g. from the repository
+        metadata.
+        """
+        algo = CHECKSUM_TYPES.get(checksum_type.lower())
+        if algo is None:
+            logger.debug(f"Ignoring {checksum_type} checksum of {self.nevra}")
+            return
+        self.checksums[algo] = digest.lower()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "epoch": self.epoch,
+            "version": self.version,
+            "release": self.release,
+            "arch": self.arch,
+            "license": self.license,
+            "sourcerpm": self.sourcerpm,
+            "summary": self.summary,
+            "url": self.url,
+            "buildtime": self.buildtime,
+            "checksums": {str(algo): digest for algo, digest in self.checksums.items()},
+            "payload_digest": list(self.payload_digest) if self.payload_digest else None,
+            "file_digest_algo": self.file_digest_algo,
+            "slices": self.slices,
+            "files": [
+                [file.path, file.mode, file.size, file.digest, file.linkto]
+                for file in self.files
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PackageRecord":
+        record = cls(
+            data["name"], data["epoch"], data["version"],
+            data["release"], data["arch"]
+        )
+        record.license = data["license"]
+        record.sourcerpm = data["sourcerpm"]
+        record.summary = data["summary"]
+        record.url = data["url"]
+        # missing from the records of older states and layer caches
+        record.buildtime = data.get("buildtime", 0)
+        record.checksums = {
+            int(algo): digest for algo, digest in data["checksums"].items()
+        }
+        if data["payload_digest"]:
+            record.payload_digest = tuple(data["payload_digest"])
+        record.file_digest_algo = data["file_digest_algo"]
+        record.slices = list(data["slices"])
+        record.files = [FileRecord(*file) for file in data["files"]]
+        return record
+
+    @classmethod
+    def from_rpm(cls, rpm_file: RPMFile, slices: List[str],
+                 files: List[str]) -> "PackageRecord":
+        """
+        Build the record from an already parsed RPM header.
+
+        args:
+            rpm_file: The parsed package.
+            slices: The slices the package was cut for.
+            files: Names of the payload members written to the output,
+                   e.g. `./usr/bin/bash`.
+        """
+        header = rpm_file.header
+        record = cls(
+            rpm_file.name, rpm_file.epoch, rpm_file.version,
+            rpm_file.release, rpm_file.arch
+        )
+        record.license = _string(header, RPMTAG_LICENSE)
+        record.sourcerpm = _string(header, RPMTAG_SOURCERPM)
+        record.summary = _string(header, RPMTAG_SUMMARY)
+        record.url = _string(header, RPMTAG_URL)
+        record.buildtime = header.scalar(RPMTAG_BUILDTIME, 0)
+        payload_digest = header.get(RPMTAG_PAYLOADDIGEST)
+        if payload_digest:
+            record.payload_digest = (
+                header.scalar(RPMTAG_PAYLOADDIGESTALGO, 8), payload_digest[0]
+            )
+        record.file_digest_algo = header.scalar(RPMTAG_FILEDIGESTALGO, 1)
+        record.slices = list(slices)
+
+        infos = {info.name: info for info in rpm_file.files}
+        for name in sorted(files):
+            info = infos.get(name[1:])
+            if info is None:
+                continue
+            record.files.append(FileRecord(
+                info.name, info.mode, info.size, info.digest, info.linkto
+            ))
+        return record
+
+
+def build_epoch(records: List[PackageRecord]) -> int:
+    """
+    Get the creation time of an output of `records`: `SOURCE_DATE_EPOCH`
+    if set, the latest build time of the packages otherwise, so the same
+    packages always give the same SBOMs and image digests.
+    """
+    value = os.environ.get("SOURCE_DATE_EPOCH")
+    if value:
+        return int(value)
+    return max((record.buildtime for record in records), default=0)
+
+
+def _created(records: List[PackageRecord]) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(build_epoch(records)))
+
+
+def _serial(records: List[PackageRecord]) -> uuid.UUID:
+    # the same set of packages always gets the same identifier
+    return uuid.uuid5(
+        uuid.NAMESPACE_URL,
+        "\n".join(sorted(record.nevra for record in records))
+    )
+
+
+def _spdx_id(ids: Set[str], kind: str, *parts: str) -> str:
+    """
+    Get an SPDXID of `parts`, unique among the `ids` of the document.
+    SPDXIDs only allow letters, digits, `.` and `-`, paths such as
+    `a_b` and `a+b` are told apart by a counter.
+    """
+    ident = "-".join(parts)
+    safe = "".join(c if c.isalnum() or c in ".-" else "-" for c in ident)
+    base = f"SPDXRef-{kind}-{safe}"
+    spdx_id = base
+    count = 1
+    while spdx_id in ids:
+        count += 1
+        spdx_id = f"{base}-{count}"
+    ids.add(spdx_id)
+    return spdx_id
+
+
+def spdx_document(records: List[PackageRecord], name: str) -> dict:
+    """
+    Build an SPDX 2.3 document, every package contains the files
+    extracted from it.
+    """
+    packages = []
+    files = []
+    relationships = []
+    ids = {"SPDXRef-DOCUMENT"}
+    for record in records:
+        package_id = _spdx_id(ids, "Package", record.name, record.arch)
+        checksums = [
+            {"algorithm": DIGEST_ALGOS[algo][0], "checksumValue": digest}
+            for algo, digest in sorted(record.checksums.items())
+            if algo in DIGEST_ALGOS
+        ]
+        package = {
+            "SPDXID": package_id,
+            "name": record.name,
+            "versionInfo": record.evr,
+            "downloadLocation": "NOASSERTION",
+            "filesAnalyzed": bool(record.files),
+            "licenseConcluded": "NOASSERTION",
+            "licenseDeclared": "NOASSERTION",
+            "copyrightText": "NOASSERTION",
+            "externalRefs": [{
+                "referenceCategory": "PACKAGE-MANAGER",
+                "referenceType": "purl",
+                "referenceLocator": record.purl,
+            }],
+        }
+        if record.license:
+            # RPM license tags are not always valid SPDX expressions
+            package["licenseComments"] = record.license
+        if record.sourcerpm:
+            package["sourceInfo"] = f"built from: {record.sourcerpm}"
+        if record.summary:
+            package["summary"] = record.summary
+        if record.url:
+            package["homepage"] = record.url
+        if checksums:
+            package["checksums"] = checksums
+        packages.append(package)
+        relationships.append({
+            "spdxElementId": "SPDXRef-DOCUMENT",
+            "relationshipType": "DESCRIBES",
+            "relatedSpdxElement": package_id,
+        })
+
+        file_algo = DIGEST_ALGOS.get(record.file_digest_algo)
+        for file in record.files:
+            file_id = _spdx_id(ids, "File", record.name, file.path)
+            entry = {
+                "SPDXID": file_id,
+                "fileName": f".{file.path}",
+                "licenseConcluded": "NOASSERTION",
+                "copyrightText": "NOASSERTION",
+            }
+            if file.digest and file_algo:
+                entry["checksums"] = [
+                    {"algorithm": file_algo[0], "checksumValue": file.digest}
+                ]
+            files.append(entry)
+            relationships.append({
+                "spdxElementId": package_id,
+                "relationshipType": "CONTAINS",
+                "relatedSpdxElement": file_id,
+            })
+
+    return {
+        "spdxVersion": "SPDX-2.3",
+        "dataLicense": "CC0-1.0",
+        "SPDXID": "SPDXRef-DOCUMENT",
+        "name": name,
+        "documentNamespace": f"https://openeuler.org/spdx/{TOOL_NAME}/{_serial(records)}",
+        "creationInfo": {
+            "created": _created(records),
+            "creators": [f"Tool: {TOOL_NAME}"],
+        },
+        "packages": packages,
+        "files": files,
+        "relationships": relationships,
+    }
+
+
+def cyclonedx_document(records: List[PackageRecord]) -> dict:
+    """
+    Build a CycloneDX 1.5 BOM, the extracted files of every package
+    are nested as `file` components.
+    """
+    components = []
+    for record in records:
+        component = {
+            "type": "library",
+            "bom-ref": record.purl,
+            "name": record.name,
+            "version": record.evr,
+            "purl": record.purl,
+            "properties": [
+                {"name": "rpm:arch", "value": record.arch},
+                {"name": "rpm:slices", "value": ",".join(record.slices)},
+            ],
+        }
+        hashes = [
+            {"alg": DIGEST_ALGOS[algo][1], "content": digest}
+            for algo, digest in sorted(record.checksums.items())
+            if algo in DIGEST_ALGOS
+        ]
+        if hashes:
+            component["hashes"] = hashes
+        if record.license:
+            component["licenses"] = [{"license": {"name": record.license}}]
+        if record.sourcerpm:
+            component["properties"].append(
+                {"name": "rpm:sourcerpm", "value": record.sourcerpm}
+            )
+        if record.payload_digest:
+            algo, digest = record.payload_digest
+            component["properties"].append({
+                "name": "rpm:payloaddigest",
+                "value": f"{DIGEST_ALGOS.get(algo, (str(algo),))[0]}:{digest}",
+            })
+        if record.summary:
+            component["description"] = record.summary
+
+        file_algo = DIGEST_ALGOS.get(record.file_digest_algo)
+        files = []
+        for file in record.files:
+            entry = {
+                "type": "file",
+                "bom-ref": f"{record.purl}#{file.path}",
+                "name": file.path,
+            }
+            if file.digest and file_algo:
+                entry["hashes"] = [{"alg": file_algo[1], "content": file.digest}]
+            files.append(entry)
+        if files:
+            component["components"] = files
+        components.append(component)
+
+    return {
+        "bomFormat": "CycloneDX",
+        "specVersion": "1.5",
+        "serialNumber": f"urn:uuid:{_serial(records)}",
+        "version": 1,
+        "metadata": {
+            "timestamp": _created(records),
+            "tools": {"components": [{"type": "application", "name": TOOL_NAME}]},
+        },
+        "components": components,
+    }
+
+
+def manifest_lines(records: List[PackageRecord]) -> List[str]:
+    """
+    Build a jsonwall manifest: a header line followed by one sorted JSON
+    line per package, slice and path.
+    """
+    entries = []
+    for record in records:
+        package = {
+            "kind": "package",
+            "name": record.name,
+            "version": record.evr,
+            "arch": record.arch,
+        }
+        checksum = record.checksums.get(8)
+        if checksum:
+            package["sha256"] = checksum
+        entries.append(package)
+        for slice in record.slices:
+            entries.append({"kind": "slice", "name": slice})
+        for file in record.files:
+            path = {
+                "kind": "path",
+                "path": file.path,
+                "mode": f"0{file.mode & 0o7777:o}",
+                "package": record.name,
+            }
+            if file.linkto:
+                path["link"] = file.linkto
+            elif file.digest:
+                path["digest"] = file.digest
+                path["size"] = file.size
+            entries.append(path)
+
+    lines = sorted({json.dumps(entry, sort_keys=True) for entry in entries})
+    header = json.dumps(
+        {"jsonwall": "1.0", "schema": "1.0", "count": len(lines) + 1},
+        sort_keys=True
+    )
+    return [header] + lines
+
+
+def _write(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def manifest_text(records: List[PackageRecord]) -> str:
+    return "\n".join(manifest_lines(records)) + "\n"
+
+
+def write_manifest(path: str, records: List[PackageRecord]) -> None:
+    _write(path, manifest_text(records))
+
+
+def sbom_files(records: List[PackageRecord], name: str) -> List[Tuple[str, str]]:
+    """
+    Render the SPDX and CycloneDX SBOMs and the manifest of `records`.
+
+    return:
+        (path relative to the output, content) of each file.
+    """
+    records = sorted(records, key=lambda record: record.name)
+    return [
+        (os.path.join(SBOM_DIR, SPDX_FILE),
+         json.dumps(spdx_document(records, name), indent=2) + "\n"),
+        (os.path.join(SBOM_DIR, CYCLONEDX_FILE),
+         json.dumps(cyclonedx_document(records), indent=2) + "\n"),
+        (os.path.join(SBOM_DIR, MANIFEST_FILE), manifest_text(records)),
+    ]
+
+
+def write_sbom(output: str, records: List[PackageRecord],
+               name: str) -> List[str]:
+    """
+    Write the SPDX and CycloneDX SBOMs and the manifest of `records` to
+    `SBOM_DIR` of the output.
+
+    return:
+        Paths of the written files, relative to `output`.
+    """
+    written = []
+    for relpath, text in sbom_files(records, name):
+        _write(os.path.join(output, relpath), text)
+        written.append(relpath)
+    logger.info(f"SBOM of {len(records)} packages written to {os.path.join(output, SBOM_DIR)}")
+    return written
@@ -0,0 +1,112 @@
+import click
+from tools.cmd.cache import DURATION, SIZE
+from tools.parse.fileops import LINK_HARDLINK, LINK_MODES
+from tools.download.rpm import DEFAULT_METADATA_EXPIRE, DEFAULT_PARALLEL_DOWNLOADS
+from tools.slice.repository import DEFAULT_SLICE_TTL
+from tools.splitter.batch import build as build_targets, load_targets
+
+@click.command(
+    name="build",
+    help="Split slices for many images at once, as listed in a build spec file."
+)
+@click.option(
+    "-f",
+    "--file",
+    "spec_file",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="The build spec, a yaml file with the `release`, `arch`, `output` and `parts` of each image."
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The maximum number of release/arch groups built concurrently, defaults to the CPU count."
+)
+@click.option(
+    "--parallel-downloads",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLEL_DOWNLOADS,
+    show_default=True,
+    help="The maximum number of concurrent package downloads of each group."
+)
+@click.option(
+    "--cache-max-size",
+    type=SIZE,
+    default=None,
+    help="Evict least recently used cached packages beyond this size, such as `20G`."
+)
+@click.option(
+    "--metadata-expire",
+    type=DURATION,
+    default=DEFAULT_METADATA_EXPIRE,
+    show_default=True,
+    help="Seconds, or a duration such as `6h`, before the cached repository metadata is refreshed."
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Refresh the cached repository metadata regardless of its age."
+)
+@click.option(
+    "--slice-ttl",
+    type=DURATION,
+    default=DEFAULT_SLICE_TTL,
+    show_default=True,
+    help="Seconds, or a duration such as `1h`, before the mirrored release is checked for updates."
+)
+@click.option(
+    "--preload",
+    is_flag=True,
+    help="Parse all slice definition files up front instead of on demand."
+)
+@click.option(
+    "--globstar",
+    is_flag=True,
+    help="Let `*` in slice contents match within a directory only, and `**` across directories."
+)
+@click.option(
+    "--rpmdb/--no-rpmdb",
+    default=True,
+    help="Register the packages in an rpmdb of each output, next to the SBOM."
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Rebuild all packages, even those unchanged since the last build into an output."
+)
+@click.option(
+    "--file-store/--no-file-store",
+    default=False,
+    show_default=True,
+    help="Extract each file once into the persistent file store and place it in the outputs from there."
+)
+@click.option(
+    "--link-mode",
+    type=click.Choice(LINK_MODES),
+    default=LINK_HARDLINK,
+    show_default=True,
+    help="How files of the file store are placed in the outputs, hardlinked outputs must not be modified in place."
+)
+def build(spec_file, jobs, parallel_downloads, cache_max_size,
+          metadata_expire, refresh, slice_ttl, preload, globstar, rpmdb,
+          rebuild, file_store, link_mode):
+    try:
+        targets = load_targets(spec_file)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--file")
+    # packages are always shared through the persistent package cache
+    options = dict(
+        parallel_downloads=parallel_downloads,
+        metadata_expire=metadata_expire,
+        refresh=refresh,
+        slice_ttl=slice_ttl,
+        preload=preload,
+        globstar=globstar,
+        rpmdb=rpmdb,
+        rebuild=rebuild,
+        file_store=file_store,
+        link_mode=link_mode
+    )
+    build_targets(targets, options, jobs=jobs, cache_max_size=cache_max_size)
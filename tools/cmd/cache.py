@@ -0,0 +1,87 @@
+import click
+from datetime import datetime
+from tools.download.cache import PackageCache, format_size
+from tools.download.cache import parse_duration, parse_size
+
+
+class SizeParamType(click.ParamType):
+    name = "size"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            return parse_size(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
+class DurationParamType(click.ParamType):
+    name = "duration"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            return parse_duration(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
+SIZE = SizeParamType()
+DURATION = DurationParamType()
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return "-"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@click.group(
+    name="cache",
+    help="Manage the persistent package cache."
+)
+def cache():
+    pass
+
+
+@cache.command(
+    name="stats",
+    help="Show the usage of the package cache."
+)
+def stats():
+    info = PackageCache().stats()
+    click.echo(f"Path:      {info['path']}")
+    click.echo(f"Packages:  {info['packages']}")
+    click.echo(f"Size:      {format_size(info['size'])}")
+    click.echo(f"Oldest:    {_format_time(info['oldest'])}")
+    click.echo(f"Newest:    {_format_time(info['newest'])}")
+
+
+@cache.command(
+    name="prune",
+    help="Evict least recently used packages from the package cache."
+)
+@click.option(
+    "--max-size",
+    type=SIZE,
+    default=None,
+    help="The size to shrink the cache to, such as `20G`."
+)
+@click.option(
+    "--all",
+    "prune_all",
+    is_flag=True,
+    help="Remove every package which is not in use."
+)
+def prune(max_size, prune_all):
+    if prune_all:
+        max_size = 0
+    if max_size is None:
+        raise click.UsageError("Either `--max-size` or `--all` is required.")
+    evicted = PackageCache().prune(max_size)
+    click.echo(
+        f"Removed {len(evicted)} packages, "
+        f"{format_size(sum(entry.size for entry in evicted))} freed."
+    )
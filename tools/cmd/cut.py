@@ -1,5 +1,27 @@
+import os
+import sys
+
 import click
-from tools.splitter.splitter import Splitter
+from tools import SERVE_SOCKET_PATH
+from tools.cmd.cache import DURATION, SIZE
+from tools.parse.fileops import LINK_HARDLINK, LINK_MODES
+from tools.download.rpm import DEFAULT_METADATA_EXPIRE, DEFAULT_PARALLEL_DOWNLOADS
+from tools.slice.repository import DEFAULT_SLICE_TTL
+from tools.image.layer import COMPRESSIONS
+from tools.logger import tracer
+from tools.logger.profiler import PROFILER_SAMPLING, PROFILERS, profiled
+from tools.serve.client import SplitterClient
+from tools.serve.server import JOB_SUCCEEDED
+from tools.splitter.layers import parse_layer
+from tools.splitter.splitter import FORMAT_DIR, FORMATS, Splitter
+
+
+def _parse_layers(ctx, param, values):
+    try:
+        return [parse_layer(value) for value in values]
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx=ctx, param=param)
+
 
 @click.command(
     name="cut",
@@ -24,7 +46,243 @@ from tools.splitter.splitter import Splitter
     required=True,
     help="The path to output generated parts."
 )
+@click.option(
+    "-j",
+    "--parallel-downloads",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLEL_DOWNLOADS,
+    show_default=True,
+    help="The maximum number of concurrent package downloads."
+)
+@click.option(
+    "--package-cache/--no-package-cache",
+    default=False,
+    show_default=True,
+    help="Reuse downloaded packages across runs from the persistent package cache."
+)
+@click.option(
+    "--cache-max-size",
+    type=SIZE,
+    default=None,
+    help="Evict least recently used cached packages beyond this size, such as `20G`."
+)
+@click.option(
+    "--metadata-expire",
+    type=DURATION,
+    default=DEFAULT_METADATA_EXPIRE,
+    show_default=True,
+    help="Seconds, or a duration such as `6h`, before the cached repository metadata is refreshed."
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Refresh the cached repository metadata regardless of its age."
+)
+@click.option(
+    "--slice-commit",
+    default=None,
+    help="Pin the slice repository to this commit instead of the head of the release."
+)
+@click.option(
+    "--slice-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Use a local slice repository checkout instead of the mirror."
+)
+@click.option(
+    "--slice-ttl",
+    type=DURATION,
+    default=DEFAULT_SLICE_TTL,
+    show_default=True,
+    help="Seconds, or a duration such as `1h`, before the mirrored release is checked for updates."
+)
+@click.option(
+    "--preload",
+    is_flag=True,
+    help="Parse every slice definition file in parallel up front, e.g. to validate the slice repository."
+)
+@click.option(
+    "--globstar",
+    is_flag=True,
+    help="Let `*` in slice contents match within a directory only, and `**` across directories."
+)
+@click.option(
+    "--rpmdb/--no-rpmdb",
+    default=True,
+    help="Register the packages in an rpmdb of the output, next to the SBOM."
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Rebuild all packages, even those unchanged since the last build into the output."
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(list(FORMATS)),
+    default=FORMAT_DIR,
+    show_default=True,
+    help="Write a directory tree, an OCI image layout with a single layer, or a layer tarball at the output."
+)
+@click.option(
+    "--layer-compression",
+    type=click.Choice(COMPRESSIONS),
+    default=None,
+    help="The compression of the layer of the OCI image layout, gzip by default."
+)
+@click.option(
+    "--layer",
+    "layers",
+    multiple=True,
+    callback=_parse_layers,
+    metavar="NAME=SLICE[,SLICE...]",
+    help="Put the closure of these slices into a layer of its own, below the requested parts. "
+         "Repeat from the bottom layer up, requires `--format oci-layer`."
+)
+@click.option(
+    "--layer-cache/--no-layer-cache",
+    default=False,
+    show_default=True,
+    help="Reuse layers built from the same inputs across runs, outputs and releases."
+)
+@click.option(
+    "--file-store/--no-file-store",
+    default=False,
+    show_default=True,
+    help="Extract each file once into the persistent file store and place it in the outputs from there."
+)
+@click.option(
+    "--link-mode",
+    type=click.Choice(LINK_MODES),
+    default=LINK_HARDLINK,
+    show_default=True,
+    help="How files of the file store are placed in the outputs, hardlinked outputs must not be modified in place."
+)
+@click.option(
+    "--trace-out",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Write the timed stages of the run as a Chrome trace, for chrome://tracing or Perfetto."
+)
+@click.option(
+    "--otlp-endpoint",
+    default=None,
+    help="Also export the stages as OpenTelemetry spans, e.g. to `http://localhost:4318/v1/traces`."
+)
+@click.option(
+    "--profile",
+    type=click.Path(file_okay=False, writable=True),
+    default=None,
+    help="Profile the run and write collapsed stacks per stage and a hot function summary to this directory."
+)
+@click.option(
+    "--profiler",
+    type=click.Choice(PROFILERS),
+    default=PROFILER_SAMPLING,
+    show_default=True,
+    help="Sample the stacks of all threads, or trace every call of the main thread with cProfile."
+)
+@click.option(
+    "--remote",
+    is_flag=True,
+    help="Submit the cut to `splitter serve` and follow its log, the server runs it with its loaded slices and metadata."
+)
+@click.option(
+    "--server",
+    default=SERVE_SOCKET_PATH,
+    show_default=True,
+    help="The unix socket or the URL of the server, with `--remote`."
+)
 @click.argument("parts", nargs=-1)
-def cut(release, arch, output, parts):
-    splitter = Splitter(release, arch, output, parts)
-    splitter.cut()
+def cut(release, arch, output, parallel_downloads,
+        package_cache, cache_max_size, metadata_expire, refresh,
+        slice_commit, slice_dir, slice_ttl, preload, globstar, rpmdb,
+        rebuild, output_format, layer_compression, layers, layer_cache,
+        file_store, link_mode, trace_out, otlp_endpoint, profile, profiler,
+        remote, server, parts):
+    if remote:
+        # the caches, metadata, slices and exporter are those of the server
+        fixed = [
+            name for name, value, default in (
+                ("--package-cache", package_cache, False),
+                ("--cache-max-size", cache_max_size, None),
+                ("--metadata-expire", metadata_expire, DEFAULT_METADATA_EXPIRE),
+                ("--refresh", refresh, False),
+                ("--slice-ttl", slice_ttl, DEFAULT_SLICE_TTL),
+                ("--preload", preload, False),
+                ("--otlp-endpoint", otlp_endpoint, None),
+            )
+            if value != default
+        ]
+        if fixed:
+            raise click.UsageError(
+                f"{', '.join(fixed)} cannot be used with `--remote`, the server runs the cut with its own."
+            )
+        _cut_remote(server, {
+            "release": release,
+            "arch": arch,
+            "output": os.path.abspath(output),
+            "parts": list(parts),
+            "slice_commit": slice_commit,
+            "slice_dir": slice_dir and os.path.abspath(slice_dir),
+            "parallel_downloads": parallel_downloads,
+            "globstar": globstar,
+            "rpmdb": rpmdb,
+            "rebuild": rebuild,
+            "format": output_format,
+            "layer_compression": layer_compression,
+            "layers": layers,
+            "layer_cache": layer_cache,
+            "file_store": file_store,
+            "link_mode": link_mode,
+            "profile": profile and os.path.abspath(profile),
+            "profiler": profiler,
+            "trace_out": trace_out and os.path.abspath(trace_out),
+        })
+        return
+    # the timing report is logged after every run
+    tracer.enable()
+    # the construction, checking out the slices, is profiled with the cut
+    try:
+        with profiled(profile, profiler):
+            splitter = Splitter(
+                release, arch, output, parts,
+                parallel_downloads=parallel_downloads,
+                package_cache=package_cache,
+                cache_max_size=cache_max_size,
+                metadata_expire=metadata_expire,
+                refresh=refresh,
+                slice_commit=slice_commit,
+                slice_dir=slice_dir,
+                slice_ttl=slice_ttl,
+                preload=preload,
+                globstar=globstar,
+                rpmdb=rpmdb,
+                rebuild=rebuild,
+                format=output_format,
+                layer_compression=layer_compression,
+                layers=layers,
+                layer_cache=layer_cache,
+                file_store=file_store,
+                link_mode=link_mode,
+                profile=profile,
+                profiler=profiler
+            )
+            splitter.cut()
+    finally:
+        tracer.report(trace_out, otlp_endpoint)
+        tracer.disable()
+
+
+def _cut_remote(server, request):
+    client = SplitterClient(server)
+    try:
+        job = client.submit(request)
+        click.echo(f"Submitted job {job['id']} to {server}", err=True)
+        status = client.wait(job["id"])
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if status["status"] != JOB_SUCCEEDED:
+        # killed jobs have a negative return code
+        returncode = status["returncode"] or 0
+        sys.exit(returncode if returncode > 0 else 1)
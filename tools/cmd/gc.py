@@ -0,0 +1,41 @@
+import click
+from tools.cmd.cache import DURATION, SIZE
+from tools.download.cache import format_size
+from tools.image.cache import LayerCache
+from tools.parse.store import FileStore
+
+
+@click.command(
+    name="gc",
+    help="Remove unused entries of the extracted-file store and the layer cache."
+)
+@click.option(
+    "--max-size",
+    type=SIZE,
+    default=None,
+    help="The size to shrink each store to, such as `20G`, least recently used entries go first."
+)
+@click.option(
+    "--max-age",
+    type=DURATION,
+    default=None,
+    help="Remove the entries unused for this long, such as `30d`."
+)
+@click.option(
+    "--all",
+    "gc_all",
+    is_flag=True,
+    help="Remove every entry which is not in use."
+)
+def gc(max_size, max_age, gc_all):
+    if gc_all:
+        max_size = 0
+    if max_size is None and max_age is None:
+        raise click.UsageError("Either `--max-size`, `--max-age` or `--all` is required.")
+    removed = FileStore().gc(max_size=max_size, max_age=max_age)
+    click.echo(
+        f"Removed {len(removed)} packages from the file store, "
+        f"{format_size(sum(entry.size for entry in removed))} freed."
+    )
+    layers = LayerCache().gc(max_size=max_size, max_age=max_age)
+    click.echo(f"Removed {layers} layers from the layer cache.")
@@ -0,0 +1,133 @@
+import signal
+import sys
+
+import click
+from tools import SERVE_PATH, SERVE_SOCKET_PATH, SERVE_TOKEN_PATH
+from tools.cmd.cache import DURATION, SIZE
+from tools.download.rpm import DEFAULT_METADATA_EXPIRE, DEFAULT_PARALLEL_DOWNLOADS
+from tools.logger import logger
+from tools.serve.server import DEFAULT_JOBS, SplitterServer, make_http_server, write_token
+from tools.slice.repository import DEFAULT_SLICE_TTL
+
+
+def _parse_targets(ctx, param, values):
+    targets = []
+    for value in values:
+        release, _, arch = value.rpartition("/")
+        if not release or not arch:
+            raise click.BadParameter(f"{value} is not RELEASE/ARCH", ctx=ctx, param=param)
+        targets.append((release, arch))
+    return targets
+
+
+def _terminate(signum, frame):
+    # unwinds `serve_forever`, the running cuts are stopped on the way
+    sys.exit(128 + signum)
+
+
+@click.command(
+    name="serve",
+    help="Run cuts sent by `splitter cut --remote`, keeping the slices and package metadata loaded between them."
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=SERVE_SOCKET_PATH,
+    show_default=True,
+    help="The unix socket to listen on."
+)
+@click.option(
+    "--port",
+    type=click.IntRange(min=1, max=65535),
+    default=None,
+    help="Listen on this TCP port of 127.0.0.1 instead of the unix socket, clients authenticate "
+         f"with the token written to {SERVE_TOKEN_PATH} or SPLITTER_TOKEN."
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="The maximum number of cuts running at the same time, the others are queued."
+)
+@click.option(
+    "--parallel-downloads",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLEL_DOWNLOADS,
+    show_default=True,
+    help="The maximum number of concurrent package downloads of each cut."
+)
+@click.option(
+    "--package-cache/--no-package-cache",
+    default=True,
+    show_default=True,
+    help="Reuse downloaded packages across cuts from the persistent package cache."
+)
+@click.option(
+    "--cache-max-size",
+    type=SIZE,
+    default=None,
+    help="Evict least recently used cached packages beyond this size, such as `20G`."
+)
+@click.option(
+    "--metadata-expire",
+    type=DURATION,
+    default=DEFAULT_METADATA_EXPIRE,
+    show_default=True,
+    help="Seconds, or a duration such as `6h`, before the loaded repository metadata is refreshed."
+)
+@click.option(
+    "--slice-ttl",
+    type=DURATION,
+    default=DEFAULT_SLICE_TTL,
+    show_default=True,
+    help="Seconds, or a duration such as `1h`, before the loaded slices are checked for updates."
+)
+@click.option(
+    "--preload",
+    is_flag=True,
+    help="Parse every slice definition file of a release when it is loaded."
+)
+@click.option(
+    "--warm",
+    "targets",
+    multiple=True,
+    callback=_parse_targets,
+    metavar="RELEASE/ARCH",
+    help="Load the slices and package metadata of this release and arch at startup, e.g. `24.03-LTS/x86_64`."
+)
+def serve(socket_path, port, jobs, parallel_downloads, package_cache,
+          cache_max_size, metadata_expire, slice_ttl, preload, targets):
+    server = SplitterServer(
+        state_dir=SERVE_PATH,
+        jobs=jobs,
+        options={
+            "parallel_downloads": parallel_downloads,
+            "package_cache": package_cache,
+            "cache_max_size": cache_max_size,
+            "metadata_expire": metadata_expire,
+            "slice_ttl": slice_ttl,
+            "preload": preload,
+        }
+    )
+    for release, arch in targets:
+        server.warm(release, arch)
+    token = None
+    if port is not None:
+        token = write_token(SERVE_TOKEN_PATH)
+    httpd = make_http_server(server, socket_path=socket_path, port=port, token=token)
+    if port is not None:
+        logger.info(f"Listening on 127.0.0.1:{port}, the token is in {SERVE_TOKEN_PATH}")
+    else:
+        logger.info(f"Listening on {socket_path}")
+    signal.signal(signal.SIGTERM, _terminate)
+    server.start()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        server.stop()
@@ -0,0 +1,296 @@
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from tools.logger import logger
+from tools import PACKAGE_CACHE_PATH
+
+
+LOCK_FILE = ".lock"
+TMP_PREFIX = ".tmp-"
+# temporary files older than this are left over by killed runs
+STALE_TMP_AGE = 24 * 3600
+
+SIZE_UNITS = {
+    "": 1,
+    "K": 1024,
+    "M": 1024 ** 2,
+    "G": 1024 ** 3,
+    "T": 1024 ** 4,
+}
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a human readable size such as `20G` or `512M` into bytes.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+DURATION_UNITS = {
+    "": 1,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 24 * 3600,
+}
+
+
+def parse_duration(duration: str) -> int:
+    """
+    Parse a duration such as `30m`, `6h` or `2d` into seconds.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", str(duration), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid duration: {duration}")
+    return int(match.group(1)) * DURATION_UNITS[match.group(2).lower()]
+
+
+def format_size(size: int) -> str:
+    for unit in ("", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.1f}{unit}B" if unit else f"{size}B"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+class CacheEntry(NamedTuple):
+    path: str
+    size: int
+    last_used: float
+
+
+def _checksum(pkg) -> Tuple[str, str]:
+    algo, digest = pkg.returnIdSum()
+    return algo, digest.lower()
+
+
+def _hash_file(f, algo: str) -> str:
+    h = hashlib.new(algo)
+    while True:
+        data = f.read(1024 * 1024)
+        if not data:
+            break
+        h.update(data)
+    return h.hexdigest()
+
+
+class PackageCache:
+    """
+    A persistent RPM cache shared by concurrent runs.
+
+    Entries are addressed by the package checksum from the repository
+    metadata and named after the package NEVRA. Packages in use are held
+    with a shared `flock`, eviction only removes entries it can lock
+    exclusively, so concurrent runs never lose a package they are using.
+    """
+
+    def __init__(self, root: str = PACKAGE_CACHE_PATH,
+                 max_size: Optional[int] = None, verify: bool = True):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.verify = verify
+        # open files holding shared locks on the entries in use
+        self._held: Dict[str, object] = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_path(self, pkg) -> str:
+        algo, digest = _checksum(pkg)
+        return os.path.join(
+            self.root, algo, digest[:2], digest,
+            os.path.basename(pkg.location)
+        )
+
+    def _hold(self, path: str) -> bool:
+        """
+        Take a shared lock on the entry at `path` for this run.
+        """
+        if path in self._held:
+            return True
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return False
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            # the entry may have been evicted before the lock was taken
+            if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                f.close()
+                return False
+        except FileNotFoundError:
+            f.close()
+            return False
+        self._held[path] = f
+        return True
+
+    def _drop(self, path: str) -> None:
+        f = self._held.pop(path, None)
+        if f:
+            f.close()
+
+    def get(self, pkg) -> Optional[str]:
+        """
+        Look up a verified cached copy of `pkg`.
+
+        return:
+            Path to the cached package, or None on a cache miss.
+        """
+        path = self.entry_path(pkg)
+        if not self._hold(path):
+            return None
+        if self.verify:
+            algo, digest = _checksum(pkg)
+            f = self._held[path]
+            f.seek(0)
+            if _hash_file(f, algo) != digest:
+                logger.warning(f"Discarding corrupted cache entry: {path}")
+                self._drop(path)
+                self._remove(path)
+                return None
+        # the modification time records the last use for LRU eviction
+        os.utime(path)
+        logger.debug(f"Package cache hit: {pkg}")
+        return path
+
+    def put(self, pkg, local_pkg: str) -> str:
+        """
+        Add a downloaded package to the cache.
+
+        return:
+            Path to the cached package.
+        """
+        path = self.entry_path(pkg)
+        entry_dir = os.path.dirname(path)
+        os.makedirs(entry_dir, exist_ok=True)
+        tmp = os.path.join(
+            entry_dir, f"{TMP_PREFIX}{os.getpid()}-{threading.get_ident()}"
+        )
+        try:
+            try:
+                os.link(local_pkg, tmp)
+            except OSError:
+                shutil.copyfile(local_pkg, tmp)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        if not self._hold(path):
+            return local_pkg
+        return path
+
+    def release(self) -> None:
+        """
+        Release all entries held by this run.
+        """
+        for path in list(self._held):
+            self._drop(path)
+
+    def entries(self) -> List[CacheEntry]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename == LOCK_FILE or filename.startswith(TMP_PREFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append(CacheEntry(path, st.st_size, st.st_mtime))
+        return entries
+
+    def stats(self) -> Dict[str, object]:
+        entries = self.entries()
+        last_used = [entry.last_used for entry in entries]
+        return {
+            "path": self.root,
+            "packages": len(entries),
+            "size": sum(entry.size for entry in entries),
+            "oldest": min(last_used) if last_used else None,
+            "newest": max(last_used) if last_used else None,
+        }
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        # drop the emptied checksum directories
+        entry_dir = os.path.dirname(path)
+        while entry_dir != self.root:
+            try:
+                os.rmdir(entry_dir)
+            except OSError:
+                break
+            entry_dir = os.path.dirname(entry_dir)
+
+    def _evict(self, entry: CacheEntry) -> bool:
+        try:
+            f = open(entry.path, "rb")
+        except FileNotFoundError:
+            return True
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # in use by a running cut
+                return False
+            self._remove(entry.path)
+        return True
+
+    def prune(self, max_size: Optional[int] = None) -> List[CacheEntry]:
+        """
+        Evict least recently used packages until the cache fits in
+        `max_size` bytes, `0` empties the cache.
+
+        return:
+            The evicted entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return []
+
+        evicted = []
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock:
+            # only one run evicts at a time
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._remove_stale_tmp()
+            entries = sorted(self.entries(), key=lambda entry: entry.last_used)
+            total = sum(entry.size for entry in entries)
+            for entry in entries:
+                if total <= max_size:
+                    break
+                if entry.path in self._held or not self._evict(entry):
+                    continue
+                total -= entry.size
+                evicted.append(entry)
+        if evicted:
+            logger.info(
+                f"Evicted {len(evicted)} packages "
+                f"({format_size(sum(e.size for e in evicted))}) from {self.root}"
+            )
+        return evicted
+
+    def _remove_stale_tmp(self) -> None:
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.startswith(TMP_PREFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.stat(path).st_mtime > STALE_TMP_AGE:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    continue
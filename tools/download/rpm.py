@@ -1,15 +1,26 @@
 import dnf
+import fcntl
 import os
+import queue
 import shutil
+import tempfile
+import threading
 
 from jinja2 import Template
 
-from packaging import version
+from tools.logger import logger, tracer
+from tools.logger.trace import BYTES_DOWNLOADED, PACKAGES_CACHED
+from tools import METADATA_CACHE_PATH, RUN_PATH, SLICE_PATH
 
-from tools.logger import logger
-from tools import CACHE_PATH, REPO_PATH
-from tools import SLICE_PATH, EP_SPLITTER_PATH
+from typing import IO, Dict, Iterator, List, Optional, Tuple
 
+from tools.download.cache import LOCK_FILE, TMP_PREFIX, PackageCache
+
+DEFAULT_PARALLEL_DOWNLOADS = 4
+# seconds before the cached repository metadata is checked for updates
+DEFAULT_METADATA_EXPIRE = 6 * 3600
+# the locks held on the run directories of this process
+_run_locks: Dict[str, IO] = {}
 
 class Progress(dnf.callback.DownloadProgress):
     """Custom download progress callback"""
@@ -42,10 +53,105 @@ class Progress(dnf.callback.DownloadProgress):
     def end(self, payload, status, msg):
         pass
 
-def init_dnf_client(arch: str, release: str, output: str) -> dnf.Base:
+
+class PipelineProgress(Progress):
+    """Download progress callback handing over each finished package"""
+
+    def __init__(self, finished: queue.Queue, parent=None):
+        super().__init__()
+        self.finished = finished
+        # the span the downloads are traced under
+        self.parent = parent
+        self.started = {}
+        self.batch_start = tracer.now()
+
+    def progress(self, payload, done):
+        if tracer.enabled and payload not in self.started:
+            self.started[payload] = tracer.now()
+        super().progress(payload, done)
+
+    def end(self, payload, status, msg):
+        pkg = getattr(payload, "pkg", None)
+        if pkg is None:
+            return
+        if tracer.enabled:
+            size = payload.download_size if status == dnf.callback.STATUS_OK else 0
+            tracer.record(
+                "download.package",
+                self.started.pop(payload, self.batch_start), tracer.now(),
+                parent=self.parent, package=str(pkg), bytes=size,
+                status="failed" if status == dnf.callback.STATUS_FAILED else "ok"
+            )
+            tracer.count(BYTES_DOWNLOADED, size)
+        if status in (dnf.callback.STATUS_OK,
+                      dnf.callback.STATUS_ALREADY_EXISTS):
+            self.finished.put((pkg, pkg.localPkg()))
+        elif status == dnf.callback.STATUS_FAILED:
+            logger.error(f"Failed to download {pkg}: {msg}")
+            self.finished.put((pkg, ""))
+
+
+def _remove_run_dir(path: str) -> None:
+    """
+    Remove the run directory at `path` unless its run holds its lock.
+    """
+    try:
+        f = open(os.path.join(path, LOCK_FILE), "rb")
+    except FileNotFoundError:
+        # half removed already
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    except OSError as e:
+        logger.debug(f"Keeping run directory {path}: {e}")
+        return
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # in use by a running cut, maybe of another pid namespace
+            return
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def new_run_dir() -> str:
+    """
+    Create the directory of the transient files of a run, under
+    `RUN_PATH`, see `clear`.
+
+    The run holds an exclusive `flock` on a lock file in the directory
+    until it is cleared. The directories whose lock is free, left behind
+    by runs which died, are removed on the way.
+
+    return:
+        Path to the directory.
+    """
+    os.makedirs(RUN_PATH, exist_ok=True)
+    for name in os.listdir(RUN_PATH):
+        if not name.startswith(TMP_PREFIX):
+            _remove_run_dir(os.path.join(RUN_PATH, name))
+    # locked before it is renamed in place, so it is never collected
+    tmp = tempfile.mkdtemp(prefix=f"{TMP_PREFIX}{os.getpid()}-", dir=RUN_PATH)
+    lock = open(os.path.join(tmp, LOCK_FILE), "ab")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    run_dir = os.path.join(RUN_PATH, os.path.basename(tmp)[len(TMP_PREFIX):])
+    os.rename(tmp, run_dir)
+    _run_locks[run_dir] = lock
+    return run_dir
+
+
+def init_dnf_client(arch: str, release: str, output: str,
+                    run_dir: str,
+                    metadata_expire: int = DEFAULT_METADATA_EXPIRE,
+                    refresh: bool = False,
+                    slice_path: str = SLICE_PATH) -> dnf.Base:
     """
     Initialize the DNF Base object and configure repositories.
 
+    The repository metadata is cached per release and arch across runs,
+    it is only checked for updates after `metadata_expire` seconds or
+    when `refresh` is set. The repo file is rendered and the packages
+    are downloaded to `run_dir`, which no other run shares.
+
     return:
         Configured dnf.Base object
     """
@@ -58,28 +164,58 @@ def init_dnf_client(arch: str, release: str, output: str) -> dnf.Base:
         conf.substitutions["basearch"] = arch
 
         # Initialize the repository using the openEuler.template.
-        conf.reposdir = init_dnf_repo(arch, release)
-        if not os.path.exists(CACHE_PATH):
-            os.makedirs(CACHE_PATH)
-        conf.cachedir = CACHE_PATH
+        conf.reposdir = init_dnf_repo(arch, release, slice_path, run_dir)
+        metadata_dir = os.path.join(METADATA_CACHE_PATH, f"{release}-{arch}")
+        os.makedirs(metadata_dir, exist_ok=True)
+        conf.cachedir = metadata_dir
+        conf.metadata_expire = 0 if refresh else metadata_expire
+        # the filelists are needed to match the slice contents before
+        # downloading, newer dnf only loads them on request
+        if hasattr(conf, "optional_metadata_types"):
+            types = list(conf.optional_metadata_types)
+            if "filelists" not in types:
+                conf.optional_metadata_types = types + ["filelists"]
 
         dnf_client.read_all_repos()
-        dnf_client.fill_sack()
+        for repo in dnf_client.repos.iter_enabled():
+            repo.metadata_expire = conf.metadata_expire
+        set_package_dir(dnf_client, os.path.join(run_dir, "packages"))
+
+        # Concurrent runs of the same release and arch share the metadata,
+        # only one of them refreshes it at a time.
+        with open(os.path.join(metadata_dir, ".lock"), "a") as lock:
+            with tracer.span("dnf.metadata_lock"):
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # the host rpmdb is never needed to split packages
+            with tracer.span("dnf.fill_sack", release=release, arch=arch) as span:
+                dnf_client.fill_sack(load_system_repo=False)
+                span.set(packages=len(dnf_client.sack))
         return dnf_client
     except Exception as e:
         logger.error(f"Failed to client DNF API client: {e}")
         raise e
 
 
-def init_dnf_repo(arch: str, release: str,) -> str:
-    repo_dir = os.path.join(REPO_PATH, release)
+def set_package_dir(dnf_client: dnf.Base, package_dir: str) -> None:
+    """
+    Download the packages of every enabled repository to a directory of
+    its own under `package_dir`.
+    """
+    for repo in dnf_client.repos.iter_enabled():
+        repo.pkgdir = os.path.join(package_dir, repo.id)
+        os.makedirs(repo.pkgdir, exist_ok=True)
+
+
+def init_dnf_repo(arch: str, release: str, slice_path: str,
+                  run_dir: str) -> str:
+    repo_dir = os.path.join(run_dir, "repo")
     if not os.path.exists(repo_dir):
         os.makedirs(repo_dir)
     repo_file = os.path.join(repo_dir, "openEuler.repo")
     params = {"release": release, "basearch": arch}
 
     template_file = os.path.join(
-        SLICE_PATH,
+        slice_path,
         "repo",
         "openEuler.template"
     )
@@ -92,6 +228,122 @@ def init_dnf_repo(arch: str, release: str,) -> str:
     return os.path.dirname(repo_file)
 
 
+def resolve(dnf_client: dnf.Base, packages: List[str]) -> Dict[str, dnf.package.Package]:
+    """
+    Resolve the latest available version of every package up front,
+    in a single query over the sack.
+
+    Versions are compared by RPM's own EVR ordering, epoch included.
+
+    return:
+        Resolved packages keyed by name, in the order of `packages`.
+        Packages which are not found are left out.
+    """
+    names = list(dict.fromkeys(packages))
+    with tracer.span("dnf.resolve", packages=len(names)):
+        query = dnf_client.sack.query().available().filter(name=names).latest()
+        latest = {}
+        for pkg in query:
+            current = latest.get(pkg.name)
+            # `latest` keeps the newest build of every name and arch,
+            # prefer the arch build over a noarch one of the same EVR
+            if current is None or pkg.evr_gt(current) or (
+                pkg.evr_eq(current) and current.arch == "noarch"
+            ):
+                latest[pkg.name] = pkg
+
+    resolved = {}
+    for name in names:
+        pkg = latest.get(name)
+        if pkg is None:
+            logger.error(f"Not found package: {name}!")
+            continue
+        logger.debug(f"Resolved {name}: {pkg}")
+        resolved[name] = pkg
+    logger.info(f"Resolved {len(resolved)} of {len(names)} packages")
+    return resolved
+
+
+def download_all(dnf_client: dnf.Base,
+                 packages: Dict[str, dnf.package.Package],
+                 parallel: int = DEFAULT_PARALLEL_DOWNLOADS,
+                 cache: Optional[PackageCache] = None
+                 ) -> Iterator[Tuple[str, str]]:
+    """
+    Download resolved packages with up to `parallel` concurrent transfers.
+
+    All packages are handed to dnf in a single batch from a background
+    thread, each package is yielded as soon as its transfer finishes so
+    the caller can process it while the others are still downloading.
+    Packages found in `cache` are yielded first and not downloaded,
+    downloaded packages are added to it.
+
+    return:
+        Iterator of (package name, local package path), the path is empty
+        if the download failed.
+    """
+    # the downloads are traced under the span of the caller
+    parent = tracer.current()
+    if cache:
+        missing = {}
+        for name, pkg in packages.items():
+            cached_pkg = cache.get(pkg)
+            if cached_pkg:
+                tracer.count(PACKAGES_CACHED)
+                yield name, cached_pkg
+            else:
+                missing[name] = pkg
+        packages = missing
+        if not packages:
+            return
+
+    def _done(pkg, local_pkg: str) -> str:
+        if cache and local_pkg:
+            return cache.put(pkg, local_pkg)
+        return local_pkg
+
+    dnf_client.conf.max_parallel_downloads = parallel
+    finished = queue.Queue()
+    pending = {pkg: name for name, pkg in packages.items()}
+    errors = []
+
+    def worker():
+        try:
+            dnf_client.download_packages(
+                list(packages.values()),
+                progress=PipelineProgress(finished, parent)
+            )
+        except Exception as e:
+            errors.append(e)
+        finally:
+            finished.put(None)
+
+    thread = threading.Thread(target=worker, name="splitter-download", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = finished.get()
+            if item is None:
+                break
+            pkg, local_pkg = item
+            name = pending.pop(pkg, None)
+            if name is not None:
+                yield name, _done(pkg, local_pkg)
+    finally:
+        # dnf cannot abort a batch, a caller giving up early waits for
+        # the transfers in flight before the client may be closed
+        thread.join()
+
+    for e in errors:
+        logger.error(f"Unexpected error while downloading packages: {e}")
+    # packages served from the local cache finish without a callback
+    for pkg, name in pending.items():
+        local_pkg = pkg.localPkg()
+        if not local_pkg or not os.path.exists(local_pkg):
+            local_pkg = ""
+        yield name, _done(pkg, local_pkg)
+
+
 def download(dnf_client: dnf.Base, package: str) -> str:
     """
     Download the package using the specified release and arch.
@@ -102,17 +354,9 @@ def download(dnf_client: dnf.Base, package: str) -> str:
 
     # download openEuler rpms by `openEuler.repo`
     try:
-        query = dnf_client.sack.query()
-        packages = query.available().filter(name=package)
-        if not packages:
-            logger.error(f"Not found package: {package}!")
+        latest_package = resolve(dnf_client, [package]).get(package)
+        if not latest_package:
             return ""
-
-        # select the latest released package version
-        latest_package = max(
-            packages,
-            key=lambda p: (version.parse(p.version), p.release)
-        )
         logger.debug(f"Downloading package: {latest_package}...")
         # download
         dnf_client.download_packages([latest_package], progress=Progress())
@@ -130,14 +374,15 @@ def download(dnf_client: dnf.Base, package: str) -> str:
     return local_pkg
 
 
-def clear(base: dnf.Base) -> None:
+def clear(base: Optional[dnf.Base], run_dir: Optional[str] = None) -> None:
+    """
+    Close the client and remove the transient files of its run, the
+    other runs are left alone.
+    """
     if base:
         base.close()
-    if os.path.exists(CACHE_PATH):
-        shutil.rmtree(CACHE_PATH)
-    if os.path.exists(REPO_PATH):
-        shutil.rmtree(REPO_PATH)
-    if os.path.exists(SLICE_PATH):
-        shutil.rmtree(SLICE_PATH)
-    if os.path.exists(EP_SPLITTER_PATH):
-        shutil.rmtree(EP_SPLITTER_PATH)
+    if run_dir:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        lock = _run_locks.pop(run_dir, None)
+        if lock:
+            lock.close()
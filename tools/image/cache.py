@@ -0,0 +1,272 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+
+from typing import IO, Dict, List, NamedTuple, Optional, Tuple
+
+from tools.cert.sbom import PackageRecord
+from tools.image.layer import LayerInfo
+from tools.logger import logger
+from tools import LAYER_CACHE_PATH
+
+LOCK_FILE = ".lock"
+# the suffix of files being written, see `_link`
+TMP_SUFFIX = ".tmp-"
+
+
+class CachedLayer(NamedTuple):
+    """
+    A layer built earlier from the same inputs.
+    """
+    layer: LayerInfo
+    # payload members in the layer, keyed by package name
+    files: Dict[str, List[str]]
+    records: Dict[str, PackageRecord]
+
+
+def _link(src: str, dst: str) -> None:
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}{TMP_SUFFIX}{os.getpid()}"
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+class LayerCache:
+    """
+    A persistent store of built layers, shared by all outputs.
+
+    Layers are addressed by the digest of their inputs, see
+    `tools.splitter.layers.layer_key`, and their blobs by the digest of
+    their content, so identical layers of different images and releases
+    are built and stored only once.
+
+    A blob returned by `get` is locked shared until it is placed in the
+    output by `link`, or until `release`, `gc` leaves it alone meanwhile.
+    Adding layers and `gc` exclude each other with the lock of the cache.
+    """
+
+    def __init__(self, root: str = LAYER_CACHE_PATH):
+        self.root = os.path.abspath(root)
+        # the locks of the blobs in use, one per `get`
+        self._held: Dict[str, List[IO]] = {}
+
+    def index_path(self, key: str) -> str:
+        return os.path.join(self.root, "index", key[:2], f"{key}.json")
+
+    def blob_path(self, digest: str) -> str:
+        algo, hexdigest = digest.split(":", 1)
+        return os.path.join(self.root, "blobs", algo, hexdigest)
+
+    def lock_path(self, digest: str) -> str:
+        algo, hexdigest = digest.split(":", 1)
+        return os.path.join(self.root, "locks", algo, hexdigest)
+
+    def _lock(self, mode: int) -> IO:
+        os.makedirs(self.root, exist_ok=True)
+        lock = open(os.path.join(self.root, LOCK_FILE), "a")
+        fcntl.flock(lock, mode)
+        return lock
+
+    def _lock_blob(self, digest: str) -> IO:
+        """
+        Lock the blob `digest` shared, see `_remove_blob`.
+        """
+        path = self.lock_path(digest)
+        while True:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock = open(path, "a")
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                # the blob may have been collected before the lock was taken
+                if os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino:
+                    return lock
+            except FileNotFoundError:
+                pass
+            lock.close()
+
+    def _unlock_blob(self, digest: str) -> None:
+        held = self._held.get(digest)
+        if held:
+            held.pop().close()
+            if not held:
+                del self._held[digest]
+
+    def release(self) -> None:
+        """
+        Release the blobs taken by `get` and not linked.
+        """
+        for held in self._held.values():
+            for lock in held:
+                lock.close()
+        self._held.clear()
+
+    def get(self, key: str) -> Optional[CachedLayer]:
+        """
+        Look up the layer built from the inputs `key`.
+        """
+        path = self.index_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            layer = LayerInfo(**data["layer"])
+            layer = layer._replace(path=self.blob_path(layer.digest))
+            cached = CachedLayer(
+                layer,
+                data["files"],
+                {
+                    name: PackageRecord.from_dict(record)
+                    for name, record in data["records"].items()
+                }
+            )
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable layer cache entry {path}: {e}")
+            return None
+        lock = self._lock_blob(layer.digest)
+        try:
+            if os.path.getsize(layer.path) != layer.size:
+                raise ValueError(f"size of {layer.path} differs")
+            # the modification time records the last use
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            lock.close()
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Ignoring unreadable layer cache entry {path}: {e}")
+            return None
+        self._held.setdefault(layer.digest, []).append(lock)
+        logger.debug(f"Layer cache hit: {layer.digest}")
+        return cached
+
+    def put(self, key: str, layer: LayerInfo, files: Dict[str, List[str]],
+            records: Dict[str, PackageRecord]) -> None:
+        """
+        Add a layer built from the inputs `key`.
+        """
+        # the blob is indexed before `gc` may run again
+        with self._lock(fcntl.LOCK_SH):
+            _link(layer.path, self.blob_path(layer.digest))
+            path = self.index_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}{TMP_SUFFIX}{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({
+                    "layer": layer._replace(path="")._asdict(),
+                    "files": files,
+                    "records": {
+                        name: record.to_dict() for name, record in records.items()
+                    },
+                }, f, sort_keys=True)
+            os.replace(tmp, path)
+
+    def link(self, layer: LayerInfo, path: str) -> LayerInfo:
+        """
+        Place the blob of a cached layer at `path`, hardlinked when the
+        cache and the output share a filesystem, and release it.
+        """
+        try:
+            _link(layer.path, path)
+        finally:
+            self._unlock_blob(layer.digest)
+        return layer._replace(path=path)
+
+    def _remove_blob(self, path: str, digest: str) -> bool:
+        lock_path = self.lock_path(digest)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # taken by a running cut
+                return False
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                return False
+            finally:
+                # a waiting `get` sees the lock replaced and looks again
+                os.unlink(lock_path)
+        return True
+
+    def _entries(self) -> List[Tuple[str, float, str, int]]:
+        """
+        List (index path, last use, blob digest, blob size) of all layers.
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, "index")):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        layer = json.load(f)["layer"]
+                    entries.append((
+                        path, os.stat(path).st_mtime, layer["digest"], layer["size"]
+                    ))
+                except (OSError, ValueError, KeyError, TypeError):
+                    entries.append((path, 0, "", 0))
+        return entries
+
+    def gc(self, max_size: Optional[int] = None,
+           max_age: Optional[int] = None) -> int:
+        """
+        Remove the layers unused for `max_age` seconds, then the least
+        recently used ones until the cache fits in `max_size` bytes.
+
+        return:
+            The number of removed layer blobs.
+        """
+        with self._lock(fcntl.LOCK_EX):
+            return self._gc(max_size, max_age)
+
+    def _gc(self, max_size: Optional[int], max_age: Optional[int]) -> int:
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        # a blob may be built from several inputs, it is kept while any
+        # of them is
+        users: Dict[str, int] = {}
+        sizes: Dict[str, int] = {}
+        for _, _, digest, size in entries:
+            users[digest] = users.get(digest, 0) + 1
+            sizes[digest] = size
+        total = sum(sizes.values())
+        for path, last_used, digest, _ in entries:
+            expired = max_age is not None and now - last_used > max_age
+            oversized = max_size is not None and total > max_size
+            if not expired and not oversized and digest:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            users[digest] -= 1
+            if not users[digest]:
+                total -= sizes[digest]
+
+        kept = {
+            self.blob_path(digest) for digest, count in users.items()
+            if count and digest
+        }
+        removed = 0
+        blobs = os.path.join(self.root, "blobs")
+        for dirpath, _, filenames in os.walk(blobs):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if path in kept or TMP_SUFFIX in filename:
+                    continue
+                digest = ":".join(os.path.relpath(path, blobs).split(os.sep, 1))
+                if self._remove_blob(path, digest):
+                    removed += 1
+        if removed:
+            logger.info(f"Removed {removed} layers from {self.root}")
+        return removed
@@ -0,0 +1,296 @@
+import gzip
+import hashlib
+import io
+import os
+import stat
+import tarfile
+
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from tools.logger import logger
+from tools.parse.rpmfile import CpioEntry, CpioReader, RPMFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS = [COMPRESSION_GZIP, COMPRESSION_ZSTD]
+
+MEDIA_TYPES = {
+    COMPRESSION_GZIP: "application/vnd.oci.image.layer.v1.tar+gzip",
+    COMPRESSION_ZSTD: "application/vnd.oci.image.layer.v1.tar+zstd",
+}
+
+DEFAULT_ZSTD_LEVEL = 3
+DEFAULT_GZIP_LEVEL = 6
+
+
+def source_date_epoch() -> Optional[int]:
+    """
+    Get the timestamp all layer mtimes are clamped to, if any.
+    """
+    value = os.environ.get("SOURCE_DATE_EPOCH")
+    return int(value) if value else None
+
+
+class LayerInfo(NamedTuple):
+    """
+    Digests of a written layer, as referenced by an OCI image.
+    """
+    path: str
+    media_type: str
+    # sha256 of the compressed layer
+    digest: str
+    size: int
+    # sha256 of the uncompressed tar
+    diff_id: str
+
+
+class _HashingWriter:
+    """
+    Pass data through to `fileobj`, hashing and counting it on the way.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        self.fileobj.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.fileobj.flush()
+
+    @property
+    def digest(self) -> str:
+        return f"sha256:{self.sha256.hexdigest()}"
+
+
+def _compressor(compression: str, fileobj, threads: int):
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstd layers require the `zstandard` module")
+        params = zstandard.ZstdCompressor(
+            level=DEFAULT_ZSTD_LEVEL,
+            threads=threads,
+            write_content_size=False
+        )
+        return params.stream_writer(fileobj, closefd=False)
+    if compression == COMPRESSION_GZIP:
+        # no file name and a zero mtime keep the gzip header reproducible
+        return gzip.GzipFile(
+            filename="", mode="wb", fileobj=fileobj,
+            compresslevel=DEFAULT_GZIP_LEVEL, mtime=0
+        )
+    raise ValueError(f"Compression: {compression} is invalid!")
+
+
+class LayerWriter:
+    """
+    Streams payload members of RPM packages straight into a compressed
+    tar layer, without staging them on disk.
+
+    The uncompressed tar (diffID) and the compressed layer (digest) are
+    hashed while they are written. Entries keep the order they are
+    added in and the mtimes of the packages, clamped to
+    `SOURCE_DATE_EPOCH`, so the same inputs always give the same digest.
+
+    Parent directories no package provides an entry of are added last,
+    a real directory entry coming later, e.g. `/tmp` with mode 1777, is
+    never shadowed by them.
+    """
+
+    def __init__(self, path: str, compression: str = COMPRESSION_GZIP,
+                 threads: int = -1):
+        self.path = path
+        self.compression = compression
+        self.mtime = source_date_epoch()
+        self._tmp = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(self._tmp, "wb")
+        self._compressed = _HashingWriter(self._file)
+        self._compressor = _compressor(compression, self._compressed, threads)
+        self._uncompressed = _HashingWriter(self._compressor)
+        self._tar = tarfile.open(
+            fileobj=self._uncompressed, mode="w|", format=tarfile.PAX_FORMAT
+        )
+        self._names: Set[str] = set()
+        # parent directories of the entries, see `close`
+        self._parents: Set[str] = set()
+
+    def _clamp(self, mtime: int) -> int:
+        if self.mtime is not None and mtime > self.mtime:
+            return self.mtime
+        return mtime
+
+    def _add_parents(self) -> None:
+        for directory in sorted(self._parents - self._names):
+            info = tarfile.TarInfo(directory)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = self.mtime or 0
+            self._tar.addfile(info)
+            self._names.add(directory)
+
+    def _claim(self, name: str) -> Optional[str]:
+        """
+        Get the tar name of member `name`, None if it is already in the
+        layer: the first package providing a path wins.
+        """
+        if name.startswith("./"):
+            name = name[2:]
+        name = os.path.normpath(name.lstrip("/"))
+        if name in (".", "..") or name.startswith("../"):
+            raise RuntimeError(f"Refusing to add unsafe path: {name}")
+        if name in self._names:
+            return None
+        self._names.add(name)
+        parent = os.path.dirname(name)
+        while parent and parent not in self._parents:
+            self._parents.add(parent)
+            parent = os.path.dirname(parent)
+        return name
+
+    def _info(self, name: str, entry: CpioEntry) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.mode = stat.S_IMODE(entry.mode)
+        info.uid = entry.uid
+        info.gid = entry.gid
+        info.mtime = self._clamp(entry.mtime)
+        return info
+
+    def _add_entry(self, name: str, entry: CpioEntry,
+                   reader: CpioReader) -> Optional[str]:
+        tar_name = self._claim(name)
+        if tar_name is None:
+            return None
+        info = self._info(tar_name, entry)
+        mode = entry.mode
+        if stat.S_ISREG(mode):
+            info.size = entry.size
+            self._tar.addfile(info, reader)
+            return tar_name
+        if stat.S_ISDIR(mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = reader.read().decode("utf-8", errors="surrogateescape")
+        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+            info.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) else tarfile.BLKTYPE
+            info.devmajor, info.devminor = entry.rdev
+        elif stat.S_ISFIFO(mode):
+            info.type = tarfile.FIFOTYPE
+        else:
+            logger.warning(f"Skipping unsupported payload member: {entry.name}")
+            return None
+        self._tar.addfile(info)
+        return tar_name
+
+    def _add_link(self, name: str, entry: CpioEntry, target: str) -> bool:
+        tar_name = self._claim(name)
+        if tar_name is None:
+            return False
+        info = self._info(tar_name, entry)
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        self._tar.addfile(info)
+        return True
+
+    def add_package(self, rpm_file: RPMFile, names: List[str]) -> List[str]:
+        """
+        Stream the payload of `rpm_file` once and add the requested
+        members to the layer, in payload order.
+
+        args:
+            rpm_file: The package.
+            names: Payload member names to add, e.g. `./usr/bin/bash`.
+        return:
+            Names of the members added to the layer.
+        """
+        wanted = set(names)
+        remaining = set(wanted)
+        written = []
+        # hardlinked members waiting for the member that carries the data
+        pending_links: Dict[Tuple[int, int], List[str]] = {}
+        if not wanted:
+            return written
+
+        with rpm_file.open_payload() as reader:
+            for entry in reader:
+                key = (entry.dev, entry.ino)
+                is_link = stat.S_ISREG(entry.mode) and entry.nlink > 1
+                if entry.name in wanted:
+                    remaining.discard(entry.name)
+                elif not (is_link and entry.size and key in pending_links):
+                    continue
+
+                if is_link:
+                    group = pending_links.setdefault(key, [])
+                    if entry.name in wanted:
+                        group.append(entry.name)
+                    if not entry.size:
+                        continue
+                    del pending_links[key]
+                    # tar keeps the data with the first member of a group
+                    target = self._add_entry(group[0], entry, reader)
+                    if target:
+                        written.append(group[0])
+                        for name in group[1:]:
+                            if self._add_link(name, entry, target):
+                                written.append(name)
+                elif self._add_entry(entry.name, entry, reader):
+                    written.append(entry.name)
+
+                if not remaining and not pending_links:
+                    break
+
+        for group in pending_links.values():
+            logger.warning(f"Missing hardlink data for {group} in {rpm_file.path}")
+        return written
+
+    def add_file(self, name: str, data: bytes, mode: int = 0o644) -> bool:
+        """
+        Add a generated regular file, such as the SBOM, to the layer.
+        """
+        tar_name = self._claim(name)
+        if tar_name is None:
+            return False
+        info = tarfile.TarInfo(tar_name)
+        info.mode = mode
+        info.size = len(data)
+        info.mtime = self.mtime or 0
+        self._tar.addfile(info, io.BytesIO(data))
+        return True
+
+    def close(self) -> LayerInfo:
+        """
+        Finish the layer and move it into place.
+        """
+        self._add_parents()
+        self._tar.close()
+        self._compressor.close()
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        return LayerInfo(
+            path=self.path,
+            media_type=MEDIA_TYPES[self.compression],
+            digest=self._compressed.digest,
+            size=self._compressed.size,
+            diff_id=self._uncompressed.digest
+        )
+
+    def abort(self) -> None:
+        """
+        Drop a partially written layer.
+        """
+        self._file.close()
+        if os.path.exists(self._tmp):
+            os.unlink(self._tmp)
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import time
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from tools.image.layer import LayerInfo, source_date_epoch
+
+MEDIA_TYPE_CONFIG = "application/vnd.oci.image.config.v1+json"
+MEDIA_TYPE_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+MEDIA_TYPE_INDEX = "application/vnd.oci.image.index.v1+json"
+ANNOTATION_REF_NAME = "org.opencontainers.image.ref.name"
+# blobs referencing other blobs, also written by other tools into a layout
+MEDIA_TYPES_NESTED = {
+    MEDIA_TYPE_MANIFEST,
+    MEDIA_TYPE_INDEX,
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+}
+
+# normalized architecture -> OCI architecture
+OCI_ARCHES = {
+    "x86_64": "amd64",
+    "aarch64": "arm64",
+}
+
+
+def blob_path(layout_dir: str, digest: str) -> str:
+    algo, hexdigest = digest.split(":", 1)
+    return os.path.join(layout_dir, "blobs", algo, hexdigest)
+
+
+def _dumps(data: dict) -> bytes:
+    # canonical JSON, the digest of equal documents never changes
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_blob(layout_dir: str, data: bytes, media_type: str) -> Dict[str, object]:
+    """
+    Write a blob to the layout.
+
+    return:
+        The OCI descriptor of the blob.
+    """
+    digest = f"sha256:{hashlib.sha256(data).hexdigest()}"
+    _write(blob_path(layout_dir, digest), data)
+    return {"mediaType": media_type, "digest": digest, "size": len(data)}
+
+
+def store_layer(layout_dir: str, layer: LayerInfo) -> LayerInfo:
+    """
+    Move a written layer into the blob store of the layout.
+    """
+    path = blob_path(layout_dir, layer.digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(layer.path, path)
+    return layer._replace(path=path)
+
+
+def layer_descriptor(layer: LayerInfo) -> Dict[str, object]:
+    return {"mediaType": layer.media_type, "digest": layer.digest, "size": layer.size}
+
+
+def load_index(layout_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the index of an existing layout.
+
+    return:
+        The index, None if the layout has none yet.
+    raise:
+        RuntimeError: if `index.json` is not an OCI image index, the
+                      layout is not overwritten.
+    """
+    path = os.path.join(layout_dir, "index.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise RuntimeError(f"Refusing to overwrite the unreadable image index {path}: {e}")
+    if not isinstance(index, dict) or not isinstance(index.get("manifests"), list):
+        raise RuntimeError(f"Refusing to overwrite {path}, it is not an OCI image index")
+    return index
+
+
+def referenced_blobs(layout_dir: str, descriptors: Iterable[Dict[str, Any]]) -> Set[str]:
+    """
+    Get the digests of `descriptors` and of all the blobs their
+    manifests and indexes reference, directly or not.
+    """
+    digests: Set[str] = set()
+    pending = list(descriptors)
+    while pending:
+        descriptor = pending.pop()
+        digest = descriptor.get("digest") if isinstance(descriptor, dict) else None
+        if not isinstance(digest, str) or digest in digests:
+            continue
+        digests.add(digest)
+        if descriptor.get("mediaType") not in MEDIA_TYPES_NESTED:
+            continue
+        try:
+            with open(blob_path(layout_dir, digest), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # a missing blob references nothing to keep
+            continue
+        if not isinstance(data, dict):
+            continue
+        if isinstance(data.get("config"), dict):
+            pending.append(data["config"])
+        for key in ("layers", "manifests"):
+            if isinstance(data.get(key), list):
+                pending.extend(data[key])
+    return digests
+
+
+def write_oci_layout(layout_dir: str, layers: List[LayerInfo], arch: str,
+                     ref_name: str = "latest",
+                     history: Optional[List[str]] = None,
+                     created: Optional[int] = None) -> str:
+    """
+    Write a minimal OCI image layout around already written layer
+    blobs: the image config, the manifest and the index.
+
+    The manifest replaces the one of the same `ref_name` in an existing
+    index, the other images of the layout are kept along with their
+    blobs.
+
+    args:
+        layout_dir: The layout directory, the layers are expected in its
+                    blob store already, see `blob_path`.
+        layers: The layers, from the bottom up.
+        arch: The normalized target architecture.
+        ref_name: The reference of the image in the index.
+        history: Optional description of each layer.
+        created: The creation time of the image, `SOURCE_DATE_EPOCH` or
+                 the epoch if not given, never the current time, which
+                 would change the digests on every write.
+    return:
+        The digest of the image manifest.
+    raise:
+        RuntimeError: if the layout has an index which is not an OCI
+                      image index.
+    """
+    previous = load_index(layout_dir)
+    if created is None:
+        created = source_date_epoch() or 0
+    created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created))
+    config = {
+        "created": created_at,
+        "architecture": OCI_ARCHES.get(arch, arch),
+        "os": "linux",
+        "config": {},
+        "rootfs": {
+            "type": "layers",
+            "diff_ids": [layer.diff_id for layer in layers],
+        },
+    }
+    if history:
+        config["history"] = [
+            {"created": created_at, "created_by": entry} for entry in history
+        ]
+    config_descriptor = write_blob(layout_dir, _dumps(config), MEDIA_TYPE_CONFIG)
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": MEDIA_TYPE_MANIFEST,
+        "config": config_descriptor,
+        "layers": [layer_descriptor(layer) for layer in layers],
+    }
+    manifest_descriptor = write_blob(layout_dir, _dumps(manifest), MEDIA_TYPE_MANIFEST)
+    manifest_descriptor["annotations"] = {ANNOTATION_REF_NAME: ref_name}
+    manifest_descriptor["platform"] = {
+        "architecture": config["architecture"],
+        "os": "linux",
+    }
+    index = dict(previous or {})
+    index.update(schemaVersion=2, mediaType=MEDIA_TYPE_INDEX)
+    index["manifests"] = [
+        descriptor for descriptor in index.get("manifests", [])
+        if not isinstance(descriptor, dict)
+        or (descriptor.get("annotations") or {}).get(ANNOTATION_REF_NAME) != ref_name
+    ] + [manifest_descriptor]
+    _write(os.path.join(layout_dir, "index.json"), _dumps(index))
+    _write(
+        os.path.join(layout_dir, "oci-layout"),
+        _dumps({"imageLayoutVersion": "1.0.0"})
+    )
+    # without an earlier index, the blobs of the layout are not known
+    # to be unreferenced
+    if previous is not None:
+        prune_blobs(layout_dir, referenced_blobs(layout_dir, index["manifests"]))
+    return manifest_descriptor["digest"]
+
+
+def prune_blobs(layout_dir: str, digests: Iterable[str]) -> int:
+    """
+    Remove the blobs of earlier builds into the layout, which the index
+    no longer references.
+
+    args:
+        digests: All the blobs referenced from the index, see
+                 `referenced_blobs`.
+    return:
+        The number of removed blobs.
+    """
+    keep = {blob_path(layout_dir, digest) for digest in digests}
+    removed = 0
+    blobs_dir = os.path.join(layout_dir, "blobs")
+    for dirpath, _, filenames in os.walk(blobs_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            # blobs being written are kept as well
+            if path in keep or ".tmp-" in filename:
+                continue
+            os.unlink(path)
+            removed += 1
+    return removed
@@ -1,4 +1,9 @@
 from tools.logger import log
 
 
-logger = log.SplitterLogger()
\ No newline at end of file
+logger = log.SplitterLogger()
+
+from tools.logger import trace  # noqa: E402
+
+
+tracer = trace.Tracer()
@@ -0,0 +1,273 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import resource
+import sys
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tools.logger import logger, tracer
+
+PROFILER_SAMPLING = "sampling"
+PROFILER_CPROFILE = "cprofile"
+PROFILERS = [PROFILER_SAMPLING, PROFILER_CPROFILE]
+
+# seconds between two samples, 100Hz keeps the overhead around 1%
+DEFAULT_INTERVAL = 0.01
+# functions listed in the hot function summary
+DEFAULT_TOP = 25
+
+SUMMARY_FILE = "summary.txt"
+# all samples, rooted at the stages which took them
+ALL_STACKS_FILE = "all.collapsed"
+PSTATS_FILE = "cut.pstats"
+# samples taken outside of any stage
+NO_STAGE = "other"
+
+# the frames of a thread waiting for a child process
+_SUBPROCESS_WAITS = {"wait", "_wait", "_try_wait", "communicate", "_communicate"}
+
+_active: Optional["SamplingProfiler"] = None
+_audit_hook = False
+# set while a block is profiled, nested blocks are part of it
+_profiling = False
+
+
+def _on_audit(event: str, args: tuple) -> None:
+    if event == "subprocess.Popen" and _active is not None:
+        _active.children[threading.get_ident()] = _command_name(args)
+
+
+def _command_name(args: tuple) -> str:
+    executable, argv = args[0], args[1]
+    if isinstance(argv, (list, tuple)) and argv:
+        executable = argv[0]
+    elif isinstance(argv, (str, bytes)) and executable is None:
+        executable = argv.split()[0] if argv.split() else argv
+    return os.path.basename(os.fsdecode(executable)) if executable else "?"
+
+
+def _frame_name(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    # `;` separates the frames in the collapsed format
+    return f"{module}:{frame.f_code.co_name}".replace(";", ":")
+
+
+def _file_name(stage: str) -> str:
+    return re.sub(r"[^\w.-]", "_", stage) + ".collapsed"
+
+
+class SamplingProfiler:
+    """
+    A statistical profiler sampling the stacks of all threads every
+    `interval` seconds, from a thread of its own.
+
+    Each sample is filed under the tracer spans open in its thread, the
+    wall clock time is profiled: a thread waiting, e.g. for a child
+    process or a download, is sampled as well. Waits for child processes
+    end in a frame naming the command, e.g. `[child rpm]`.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        # (span names, frames) -> samples
+        self.samples: Counter = Counter()
+        # thread id -> the last command it started
+        self.children: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        global _active, _audit_hook
+        if not _audit_hook and hasattr(sys, "addaudithook"):
+            sys.addaudithook(_on_audit)
+            _audit_hook = True
+        _active = self
+        self._thread = threading.Thread(
+            target=self._run, name="splitter-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        global _active
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if _active is self:
+            _active = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                self.sample(tid, frame, names.get(tid, str(tid)))
+
+    def sample(self, tid: int, frame, thread_name: str) -> None:
+        frames = []
+        # the wait may be below, e.g. `selectors` polling the pipes of
+        # `communicate`
+        waiting = False
+        while frame is not None:
+            frames.append(_frame_name(frame))
+            if frame.f_globals.get("__name__") == "subprocess" \
+                    and frame.f_code.co_name in _SUBPROCESS_WAITS:
+                waiting = True
+            frame = frame.f_back
+        frames.reverse()
+        if waiting:
+            frames.append(f"[child {self.children.get(tid, '?')}]")
+        stages = tracer.stages(tid) or [f"{NO_STAGE} ({thread_name})"]
+        self.samples[(tuple(stages), tuple(frames))] += 1
+
+    def by_stage(self) -> Dict[str, Counter]:
+        """
+        The stacks sampled in each stage, the innermost open span.
+        """
+        stages: Dict[str, Counter] = {}
+        for (spans, frames), count in self.samples.items():
+            stages.setdefault(spans[-1], Counter())[frames] += count
+        return stages
+
+    def hot_functions(self, top: int = DEFAULT_TOP) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """
+        return:
+            The functions sampled most often on top of the stack, and
+            anywhere in the stack, with their sample counts.
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for (_, frames), count in self.samples.items():
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return own.most_common(top), total.most_common(top)
+
+    def write(self, output_dir: str, top: int = DEFAULT_TOP) -> str:
+        """
+        Write the collapsed stacks of each stage and of the whole run,
+        for `flamegraph.pl` or speedscope, and the summary.
+
+        return:
+            The summary.
+        """
+        for stage, stacks in self.by_stage().items():
+            _write_collapsed(os.path.join(output_dir, _file_name(stage)), stacks)
+        _write_collapsed(
+            os.path.join(output_dir, ALL_STACKS_FILE),
+            Counter({spans + frames: count for (spans, frames), count in self.samples.items()})
+        )
+
+        total = sum(self.samples.values()) or 1
+        lines = [
+            f"{sum(self.samples.values())} samples every {self.interval * 1000:g}ms "
+            f"of all threads, wall clock time",
+            "",
+            f"{'samples':>8} {'%':>6}  stage",
+        ]
+        stages = sorted(
+            ((stage, sum(stacks.values())) for stage, stacks in self.by_stage().items()),
+            key=lambda item: -item[1]
+        )
+        for stage, count in stages:
+            lines.append(f"{count:>8} {count * 100 / total:>5.1f}%  {stage}")
+        own, inclusive = self.hot_functions(top)
+        for title, functions in (("on top of the stack", own), ("in the stack", inclusive)):
+            lines += ["", f"Top {top} functions {title}:", f"{'samples':>8} {'%':>6}  function"]
+            for name, count in functions:
+                lines.append(f"{count:>8} {count * 100 / total:>5.1f}%  {name}")
+        return "\n".join(lines) + "\n"
+
+
+def _write_collapsed(path: str, stacks: Counter) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for frames, count in sorted(stacks.items()):
+            f.write(f"{';'.join(frames)} {count}\n")
+
+
+def _children_usage(start: resource.struct_rusage) -> str:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        f"CPU time of the child processes: "
+        f"{usage.ru_utime - start.ru_utime:.2f}s user, "
+        f"{usage.ru_stime - start.ru_stime:.2f}s system\n"
+    )
+
+
+def _cprofile_summary(profile: cProfile.Profile, top: int) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    for key in ("tottime", "cumulative"):
+        stats.sort_stats(key).print_stats(top)
+    return stream.getvalue()
+
+
+@contextmanager
+def profiled(output_dir: Optional[str], profiler: str = PROFILER_SAMPLING,
+            interval: float = DEFAULT_INTERVAL,
+            top: int = DEFAULT_TOP) -> Iterator[None]:
+    """
+    Profile the enclosed block and write the results to `output_dir`,
+    nothing is profiled without it. Within a profiled block, e.g. the
+    `cut` command profiling the construction of the splitter and the
+    cut, nested blocks are profiled as part of the outer one.
+
+    The sampling profiler writes collapsed stacks per stage, the stages
+    are the tracer spans, which is enabled for the block if need be.
+    cProfile, also the fallback where sampling is unsupported, only
+    profiles the calling thread and writes a `pstats` dump.
+
+    args:
+        output_dir: The directory of the results.
+        profiler: `sampling` or `cprofile`.
+        interval: Seconds between two samples.
+        top: Number of functions in the hot function summary.
+    """
+    global _profiling
+    if not output_dir or _profiling:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"Profiler: {profiler} is invalid!")
+    if profiler == PROFILER_SAMPLING and not hasattr(sys, "_current_frames"):
+        logger.warning("Sampling is not supported by this interpreter, using cProfile")
+        profiler = PROFILER_CPROFILE
+    os.makedirs(output_dir, exist_ok=True)
+
+    _profiling = True
+    traced = tracer.enabled
+    if not traced:
+        tracer.enable()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if profiler == PROFILER_SAMPLING:
+        sampler = SamplingProfiler(interval)
+        sampler.start()
+    else:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    try:
+        yield
+    finally:
+        _profiling = False
+        if profiler == PROFILER_SAMPLING:
+            sampler.stop()
+            summary = sampler.write(output_dir, top)
+        else:
+            cprofile.disable()
+            cprofile.dump_stats(os.path.join(output_dir, PSTATS_FILE))
+            summary = _cprofile_summary(cprofile, top)
+        if not traced:
+            tracer.disable()
+        summary += "\n" + _children_usage(children)
+        with open(os.path.join(output_dir, SUMMARY_FILE), "w", encoding="utf-8") as f:
+            f.write(summary)
+        logger.info(f"Profile written to: {output_dir}\n{summary}")
@@ -0,0 +1,341 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from tools.logger import logger
+
+# counters kept across all spans, see `Tracer.count`
+BYTES_DOWNLOADED = "bytes_downloaded"
+BYTES_DECOMPRESSED = "bytes_decompressed"
+FILES_MATCHED = "files_matched"
+FILES_WRITTEN = "files_written"
+PACKAGES_CACHED = "packages_cached"
+SUBPROCESSES = "subprocesses"
+
+# spans recorded after the fact, e.g. concurrent downloads, get a lane
+# of their own in the Chrome trace
+LANE_TID_BASE = 1 << 20
+
+
+class Span:
+    """
+    A timed stage of a run, with its statistics in `args`.
+    """
+    __slots__ = ("id", "parent", "name", "start", "end", "tid", "args")
+
+    def __init__(self, id: int, parent: Optional[int], name: str,
+                 start: int, tid: Optional[int], args: Dict[str, Any]):
+        self.id = id
+        self.parent = parent
+        self.name = name
+        # nanoseconds since the tracer was enabled
+        self.start = start
+        self.end = start
+        self.tid = tid
+        self.args = args
+
+    @property
+    def duration(self) -> float:
+        return (self.end - self.start) / 1e9
+
+    def set(self, **args: Any) -> None:
+        self.args.update(args)
+
+    def add(self, key: str, value: int = 1) -> None:
+        self.args[key] = self.args.get(key, 0) + value
+
+
+class _NullSpan:
+    """
+    The span of a disabled tracer, it records nothing.
+    """
+    id = None
+
+    def set(self, **args: Any) -> None:
+        pass
+
+    def add(self, key: str, value: int = 1) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Record the stages of a run as nested spans, with their durations and
+    counters such as the bytes downloaded or the files written.
+
+    The tracer is disabled until `enable` is called, spans cost nothing
+    but a function call then. The spans are written as a Chrome trace,
+    for `chrome://tracing` or Perfetto, or exported to an OpenTelemetry
+    collector.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans: List[Span] = []
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # open spans of each thread, keyed by thread id
+        self._stacks: Dict[int, List[Span]] = {}
+        self._ids = 0
+        self._origin = 0
+        self._wall_origin = 0
+        self._audit = False
+        self._threads: Dict[int, str] = {}
+
+    def enable(self) -> None:
+        """
+        Start recording, dropping the spans of an earlier run.
+        """
+        with self._lock:
+            self.spans = []
+            self.counters = {}
+            self._threads = {}
+            self._origin = time.perf_counter_ns()
+            self._wall_origin = time.time_ns()
+            self.enabled = True
+        if not self._audit and hasattr(sys, "addaudithook"):
+            # every subprocess is counted, those of dnf and rpm included
+            sys.addaudithook(self._on_audit)
+            self._audit = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def now(self) -> int:
+        return time.perf_counter_ns() - self._origin
+
+    def _stack(self) -> List[Span]:
+        tid = threading.get_ident()
+        stack = self._stacks.get(tid)
+        if stack is None:
+            stack = self._stacks[tid] = []
+        return stack
+
+    def stages(self, tid: int) -> List[str]:
+        """
+        The names of the open spans of thread `tid`, outermost first,
+        e.g. for a sampling profiler running in another thread.
+        """
+        return [span.name for span in list(self._stacks.get(tid, ()))]
+
+    def current(self) -> Optional[Span]:
+        """
+        The innermost open span of the calling thread.
+        """
+        if not self.enabled:
+            return None
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def _new(self, name: str, parent: Optional[int], start: int,
+             tid: Optional[int], args: Dict[str, Any]) -> Span:
+        with self._lock:
+            self._ids += 1
+            span = Span(self._ids, parent, name, start, tid, args)
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[Span]:
+        """
+        Time the enclosed block as a span, nested in the open span of
+        the calling thread.
+        """
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+        stack = self._stack()
+        parent = stack[-1].id if stack else None
+        tid = threading.get_ident()
+        if not stack:
+            self._threads[tid] = threading.current_thread().name
+        span = self._new(name, parent, self.now(), tid, args)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = self.now()
+            stack.pop()
+            if not stack:
+                self._stacks.pop(tid, None)
+
+    def record(self, name: str, start: int, end: int,
+               parent: Optional[Span] = None, **args: Any) -> None:
+        """
+        Record a span measured elsewhere, e.g. a download of dnf, which
+        overlaps the others.
+
+        args:
+            start: See `now`.
+            end: See `now`.
+            parent: The span it belongs to, if any.
+        """
+        if not self.enabled:
+            return
+        span = self._new(name, parent.id if parent else None, start, None, args)
+        span.end = end
+
+    def count(self, key: str, value: int = 1) -> None:
+        """
+        Add `value` to the counter `key` of the run and of the innermost
+        open span of the calling thread.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        stack = self._stack()
+        if stack:
+            stack[-1].add(key, value)
+
+    def _on_audit(self, event: str, args: tuple) -> None:
+        if event == "subprocess.Popen" and self.enabled:
+            self.count(SUBPROCESSES)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Aggregate the spans by stage, in the order the stages started.
+        """
+        stages: Dict[str, Dict[str, Any]] = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            stage = stages.setdefault(
+                span.name, {"stage": span.name, "count": 0, "total": 0.0, "max": 0.0}
+            )
+            stage["count"] += 1
+            stage["total"] += span.duration
+            stage["max"] = max(stage["max"], span.duration)
+        return list(stages.values())
+
+    def log_summary(self) -> None:
+        lines = ["Timing report:", f"{'stage':<24}{'count':>8}{'total':>12}{'max':>12}"]
+        for stage in self.summary():
+            lines.append(
+                f"{stage['stage']:<24}{stage['count']:>8}"
+                f"{stage['total']:>11.3f}s{stage['max']:>11.3f}s"
+            )
+        for key, value in sorted(self.counters.items()):
+            lines.append(f"{key}: {value}")
+        logger.info("\n".join(lines))
+
+    def _lanes(self) -> Dict[int, int]:
+        # recorded spans may overlap, each goes to the first lane free
+        # at its start
+        lanes: List[int] = []
+        assigned = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            if span.tid is not None:
+                continue
+            for lane, end in enumerate(lanes):
+                if end <= span.start:
+                    break
+            else:
+                lane = len(lanes)
+                lanes.append(0)
+            lanes[lane] = span.end
+            assigned[span.id] = LANE_TID_BASE + lane
+        return assigned
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """
+        The spans in the Chrome trace event format.
+        """
+        pid = os.getpid()
+        lanes = self._lanes()
+        events = []
+        threads = dict(self._threads)
+        for span in self.spans:
+            tid = lanes.get(span.id, span.tid)
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": span.start / 1000,
+                "dur": (span.end - span.start) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": span.args,
+            })
+            if tid not in threads:
+                threads[tid] = f"lane {tid - LANE_TID_BASE}"
+        used = {event["tid"] for event in events}
+        for tid, name in threads.items():
+            if tid in used:
+                events.append({
+                    "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                    "args": {"name": name},
+                })
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "start": self._wall_origin / 1e9,
+                "counters": self.counters,
+                "stages": self.summary(),
+            },
+        }
+
+    def write_chrome(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def export_otlp(self, endpoint: str, service: str = "splitter") -> None:
+        """
+        Export the spans to an OpenTelemetry collector over OTLP/HTTP,
+        e.g. `http://localhost:4318/v1/traces`.
+
+        raise:
+            RuntimeError: if the OpenTelemetry SDK is not installed.
+        """
+        try:
+            from opentelemetry import trace as otel_trace
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError as e:
+            raise RuntimeError(
+                "Exporting spans requires the `opentelemetry-sdk` and "
+                "`opentelemetry-exporter-otlp-proto-http` modules"
+            ) from e
+        provider = TracerProvider(resource=Resource.create({"service.name": service}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        otel_tracer = provider.get_tracer("splitter")
+        exported = {}
+        # parents start before their children
+        for span in sorted(self.spans, key=lambda span: span.start):
+            context = None
+            if span.parent in exported:
+                context = otel_trace.set_span_in_context(exported[span.parent])
+            attributes = {
+                key: value for key, value in span.args.items()
+                if isinstance(value, (str, bool, int, float))
+            }
+            otel_span = otel_tracer.start_span(
+                span.name, context=context, attributes=attributes,
+                start_time=self._wall_origin + span.start
+            )
+            otel_span.end(end_time=self._wall_origin + span.end)
+            exported[span.id] = otel_span
+        provider.shutdown()
+
+    def report(self, trace_out: Optional[str] = None,
+               otlp_endpoint: Optional[str] = None) -> None:
+        """
+        Log the timing report, then write and export the spans.
+        """
+        if not self.enabled:
+            return
+        self.log_summary()
+        if trace_out:
+            self.write_chrome(trace_out)
+            logger.info(f"Trace written to: {trace_out}")
+        if otlp_endpoint:
+            self.export_otlp(otlp_endpoint)
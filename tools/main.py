@@ -1,5 +1,9 @@
 import click
+from tools.cmd.build import build
+from tools.cmd.cache import cache
 from tools.cmd.cut import cut
+from tools.cmd.gc import gc
+from tools.cmd.serve import serve
 
 
 @click.group()
@@ -9,6 +13,10 @@ def entrance():
 def _add_commands():
     # Unified interface for extension.
     entrance.add_command(cut)
+    entrance.add_command(cache)
+    entrance.add_command(build)
+    entrance.add_command(gc)
+    entrance.add_command(serve)
 
 def main():
     _add_commands()
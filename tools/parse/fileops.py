@@ -0,0 +1,77 @@
+import errno
+import fcntl
+import os
+import shutil
+
+# how extracted files are placed in an output
+LINK_HARDLINK = "hardlink"
+LINK_REFLINK = "reflink"
+LINK_COPY = "copy"
+LINK_MODES = [LINK_HARDLINK, LINK_REFLINK, LINK_COPY]
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+# errors of filesystems or kernels without reflink/copy_file_range
+_UNSUPPORTED = {
+    errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+    errno.ENOTTY, errno.EXDEV, errno.EPERM,
+}
+
+
+def _copy_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    copied = 0
+    while copied < size:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, size - copied)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED and copied == 0:
+                return False
+            raise
+        if n == 0:
+            break
+        copied += n
+    return True
+
+
+def clone_file(src: str, dst: str) -> None:
+    """
+    Copy the content of regular file `src` to `dst`, sharing its blocks
+    where the filesystem supports reflinks, copying in the kernel with
+    `copy_file_range` otherwise, and falling back to a plain copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+        size = os.fstat(fsrc.fileno()).st_size
+        if hasattr(os, "copy_file_range") and _copy_range(
+            fsrc.fileno(), fdst.fileno(), size
+        ):
+            return
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def link_file(src: str, dst: str, link: str = LINK_COPY) -> None:
+    """
+    Place regular file `src` at `dst`, which must not exist.
+
+    args:
+        link: `hardlink` shares the inode of `src`, `reflink` shares its
+              blocks, both fall back to a copy where unsupported, e.g.
+              across filesystems.
+    """
+    if link == LINK_HARDLINK:
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED and e.errno != errno.EMLINK:
+                raise
+    if link in (LINK_HARDLINK, LINK_REFLINK):
+        clone_file(src, dst)
+        return
+    shutil.copyfile(src, dst)
@@ -0,0 +1,197 @@
+import bisect
+import fnmatch
+import re
+
+from typing import Dict, List, Optional, Set, Tuple
+
+MAGIC_CHARS = "*?["
+
+
+def _is_literal(pattern: str) -> bool:
+    return not any(c in pattern for c in MAGIC_CHARS)
+
+
+def _literal_prefix(pattern: str) -> str:
+    for i, c in enumerate(pattern):
+        if c in MAGIC_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+def translate_globstar(pattern: str) -> str:
+    """
+    Translate a glob pattern to a regex where `*`, `?` and `[...]` never
+    match `/`, and `**` matches across directories.
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("/**/", i):
+            # `a/**/b` also matches `a/b`
+            res.append("/(?:.*/)?")
+            i += 4
+            continue
+        if pattern.startswith("**", i):
+            res.append(".*")
+            i += 2
+            continue
+        i += 1
+        if c == "*":
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+                continue
+            stuff = pattern[i:j].replace("\\", "\\\\")
+            # escape the set operations of future regexes, as `fnmatch`
+            stuff = re.sub(r"([&~|])", r"\\\1", stuff)
+            i = j + 1
+            if stuff.startswith("!"):
+                stuff = "^" + stuff[1:]
+            elif stuff.startswith(("^", "[")):
+                stuff = "\\" + stuff
+            # as `*` and `?`, a set never matches `/`
+            res.append(f"(?!/)[{stuff}]")
+        else:
+            res.append(re.escape(c))
+    return f"(?s:{''.join(res)})\\Z"
+
+
+class PrefixTrie:
+    """
+    A trie of literal directory prefixes over path components.
+    """
+
+    def __init__(self):
+        self.root: Dict[str, dict] = {}
+
+    def add(self, prefix: str, pattern: str) -> None:
+        node = self.root
+        for part in prefix.rstrip("/").split("/"):
+            node = node.setdefault(part, {})
+        node.setdefault(None, []).append(pattern)
+
+    def match(self, path: str) -> List[str]:
+        """
+        Get the patterns of all the prefixes `path` lies below.
+        """
+        hits = []
+        node = self.root
+        parts = path.split("/")
+        for i, part in enumerate(parts):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node and i < len(parts) - 1:
+                hits.extend(node[None])
+        return hits
+
+
+class PatternMatcher:
+    """
+    Matches paths against a set of glob patterns compiled once.
+
+    Literal paths are looked up in a hash set, literal directory
+    prefixes (`/dir/*`, or `/dir/**` with globstar) in a prefix trie and
+    every other pattern in a single combined regex.
+
+    By default patterns follow the `fnmatch` semantics where `*` also
+    matches `/`. With `globstar`, `*` stays within a path component and
+    `**` matches across directories.
+    """
+
+    def __init__(self, patterns: List[str], globstar: bool = False):
+        self.patterns = list(dict.fromkeys(patterns))
+        self.globstar = globstar
+        self.literals: Dict[str, str] = {}
+        self.prefixes = PrefixTrie()
+        self.has_prefixes = False
+        self.globs: List[str] = []
+        self._regexes: List[str] = []
+
+        star = "/**" if globstar else "/*"
+        for pattern in self.patterns:
+            if _is_literal(pattern):
+                self.literals[pattern] = pattern
+            elif pattern.endswith(star) and _is_literal(pattern[:-len(star)]):
+                self.prefixes.add(pattern[:-len(star) + 1], pattern)
+                self.has_prefixes = True
+            else:
+                self.globs.append(pattern)
+                self._regexes.append(
+                    translate_globstar(pattern) if globstar
+                    else fnmatch.translate(pattern)
+                )
+
+        self.regex = None
+        if self._regexes:
+            self.regex = re.compile("|".join(
+                f"(?P<_p{i}>{regex})" for i, regex in enumerate(self._regexes)
+            ))
+
+    def _match(self, path: str, hits: Optional[Set[str]] = None) -> bool:
+        matched = False
+        literal = self.literals.get(path)
+        if literal is not None:
+            if hits is None:
+                return True
+            hits.add(literal)
+            matched = True
+        if self.has_prefixes:
+            prefix_hits = self.prefixes.match(path)
+            if prefix_hits:
+                if hits is None:
+                    return True
+                hits.update(prefix_hits)
+                matched = True
+        if self.regex is not None:
+            m = self.regex.match(path)
+            if m:
+                if hits is None:
+                    return True
+                if m.lastgroup and m.lastgroup.startswith("_p"):
+                    hits.add(self.globs[int(m.lastgroup[2:])])
+                matched = True
+        return matched
+
+    def match(self, path: str) -> bool:
+        return self._match(path)
+
+    def filter(self, files: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Filter the files matching any pattern.
+
+        return:
+            The matching files, in the order of `files`.
+            The patterns without any matching file.
+        """
+        hits: Set[str] = set()
+        matched = [path for path in files if self._match(path, hits)]
+        # a combined regex reports one alternative per path, so check the
+        # remaining globs on their own before calling them unmatched, only
+        # against the matched files sharing their literal prefix
+        candidates = sorted(matched)
+        for pattern, regex in zip(self.globs, self._regexes):
+            if pattern in hits:
+                continue
+            prefix = _literal_prefix(pattern)
+            compiled = re.compile(regex)
+            start = bisect.bisect_left(candidates, prefix)
+            for path in candidates[start:]:
+                if not path.startswith(prefix):
+                    break
+                if compiled.match(path):
+                    hits.add(pattern)
+                    break
+        unmatched = [pattern for pattern in self.patterns if pattern not in hits]
+        return matched, unmatched
@@ -1,16 +1,22 @@
-import fnmatch
 import os
-import subprocess
+import shutil
 import tempfile
 
-from typing import List
-from tools.logger import logger
+from typing import List, NamedTuple, Optional, Tuple
+from tools.logger import logger, tracer
+from tools.logger.trace import FILES_MATCHED, FILES_WRITTEN
+from tools.parse.matcher import PatternMatcher
+from tools.parse.rpmfile import RPMFile, copy_members
+from tools.parse.store import FileStore
 
 
 def list_pkg_files(pkg_path: str) -> list[str]:
     """
     List all files in the RPM packages.
 
+    The file list is read from the RPM header, the payload is not
+    decompressed.
+
     Args:
         pkg_path (str): Path to the RPM package.
 
@@ -21,40 +27,44 @@ def list_pkg_files(pkg_path: str) -> list[str]:
         RuntimeError: If listing files fails.
     """
     try:
-        rpm_process = subprocess.run(
-            ["rpm2cpio", pkg_path],
-            check=True,
-            stdout=subprocess.PIPE
-        )
-
-        cpio_process = subprocess.run(
-            ["cpio", "-t"],
-            input=rpm_process.stdout,
-            check=True,
-            stdout=subprocess.PIPE
-        )
-        return cpio_process.stdout.decode().splitlines()
+        with tracer.span("parse.list_files", package=os.path.basename(pkg_path)):
+            return RPMFile(pkg_path).filenames()
     except Exception as e:
         raise RuntimeError(f"Error listing files in RPM: {e}")
 
 
-def match_files(file_list: List[str], patterns: List[str]) -> List[str]:
+def match_files(file_list: List[str], patterns: List[str],
+                globstar: bool = False) -> List[str]:
     """
     Filter files from a given list that match any of the specified patterns.
 
     args:
         file_list: List of RPM files.
         patterns: Pattern list to match.
+        globstar: Whether `*` stays within a path component and `**`
+                  matches across directories, instead of `fnmatch` rules.
     return: 
         List of matching files.
     """
-    matched_files = []
-    for file in file_list:
-        for pattern in patterns:
-            if fnmatch.fnmatch(file, pattern):
-                matched_files.append(file)
-                break
-    return matched_files
+    matcher = PatternMatcher(patterns, globstar=globstar)
+    return [file for file in file_list if matcher.match(file)]
+
+
+def match_patterns(file_list: List[str], patterns: List[str],
+                   globstar: bool = False) -> Tuple[List[str], List[str]]:
+    """
+    Filter files matching any of the patterns and report the patterns
+    which match nothing.
+
+    args:
+        file_list: List of RPM files.
+        patterns: Pattern list to match.
+        globstar: See `match_files`.
+    return:
+        List of matching files, in the order of `file_list`.
+        List of patterns without any matching file.
+    """
+    return PatternMatcher(patterns, globstar=globstar).filter(file_list)
 
 
 def write_files(pkg_path: str, output_dir: str, matched_files: List[str]):
@@ -66,52 +76,175 @@ def write_files(pkg_path: str, output_dir: str, matched_files: List[str]):
         output_dir: Directory to save extracted files.
         matched_files: Set of file paths to extract from the downloaded RPM.
     """
-    temp_file = None
     try:
-        # Create a temporary file containing the list of files to extract
-        with tempfile.NamedTemporaryFile(mode="w+", delete=False) as tmp:
-            tmp.write("\n".join(matched_files))
-            temp_file = tmp.name
-        logger.debug(f"Temporary file list created at: {temp_file}")
-
-        # Run rpm2cpio and capture its output
-        rpm_process = subprocess.run(
-            ["rpm2cpio", pkg_path],
-            check=True,
-            stdout=subprocess.PIPE
-        )
-
-        # Run cpio with extracted file list to `output` directory
-        subprocess.run(
-            ["cpio", "-idmv", "-D", output_dir, "-E", temp_file],
-            input=rpm_process.stdout,
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-    except subprocess.CalledProcessError as e:
+        with tracer.span("parse.write_files", package=os.path.basename(pkg_path)) as span:
+            written = RPMFile(pkg_path).extract(output_dir, matched_files)
+            span.set(files=len(written))
+        tracer.count(FILES_WRITTEN, len(written))
+        logger.debug(f"Extracted {len(written)} files from {pkg_path}")
+    except (OSError, RuntimeError) as e:
         raise RuntimeError(
             f"Failed to extract files from RPM '{pkg_path}': {e}"
         ) from e
-    finally:
-        # Ensure the temporary file is removed
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
 
 
-def extract_files(pkg_path: str, output_dir: str, patterns: List[str]):
+class ExtractResult(NamedTuple):
     """
-    Extract files from the RPM package.
+    Outcome of extracting a RPM package.
+    """
+    files: List[str]
+    unmatched: List[str]
+    # the parsed package, its header is reused for the SBOM
+    rpm_file: Optional[RPMFile] = None
+
+
+def select_members(filenames: List[str], patterns: List[str],
+                   globstar: bool = False,
+                   files: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+    """
+    Select the payload members to extract.
 
     args:
-        pkg_path: RPM package downloaded path.
-        output_dir: Directory to save extracted files.
+        filenames: All payload members, e.g. `./usr/bin/bash`.
         patterns: List of file patterns to extract.
+        globstar: See `match_files`.
+        files: See `extract_files`.
+    return:
+        The selected members, in the order of `filenames` unless
+        `files` is given.
+        The patterns which matched nothing.
     """
-    os.makedirs(output_dir, exist_ok=True)
-    pkg_files = list_pkg_files(pkg_path)
+    if files is not None:
+        # the filelists also carry ghost files, which have no payload
+        members = set(filenames)
+        return [f".{file}" for file in files if f".{file}" in members], []
     relative_patterns = list(map(
         lambda pattern: f".{pattern}", patterns
     ))
-    matched_files = match_files(pkg_files, relative_patterns)
-    write_files(pkg_path, output_dir, matched_files)
+    matched_files, unmatched = match_patterns(
+        filenames, relative_patterns, globstar
+    )
+    return matched_files, [pattern[1:] for pattern in unmatched]
+
+
+class ExtractJob(NamedTuple):
+    """
+    Files of a RPM package to extract into one output directory.
+    """
+    output_dir: str
+    patterns: List[str]
+    # files already matched against `patterns`, see `extract_files`
+    files: Optional[List[str]] = None
+
+
+def extract_files(pkg_path: str, output_dir: str, patterns: List[str],
+                  globstar: bool = False,
+                  files: Optional[List[str]] = None) -> ExtractResult:
+    """
+    Extract files from the RPM package.
+
+    args:
+        pkg_path: RPM package downloaded path.
+        output_dir: Directory to save extracted files.
+        patterns: List of file patterns to extract.
+        globstar: See `match_files`.
+        files: Files already matched against `patterns` ahead of the
+               download, e.g. from the repository filelists. When given,
+               `patterns` are not matched again.
+    return:
+        The written files and the patterns which matched nothing.
+    """
+    return extract_many(
+        pkg_path, [ExtractJob(output_dir, patterns, files)], globstar
+    )[0]
+
+
+def extract_many(pkg_path: str, jobs: List[ExtractJob],
+                 globstar: bool = False,
+                 store: Optional[FileStore] = None,
+                 checksum: Optional[Tuple[str, str]] = None) -> List[ExtractResult]:
+    """
+    Extract files from the RPM package into several output directories,
+    the payload is decompressed only once.
+
+    With more than one job, the files of all jobs are extracted to a
+    staging directory and copied from there to each output. With a
+    `store`, the files missing from the store are extracted to it and
+    placed in each output from there.
+
+    args:
+        pkg_path: RPM package downloaded path.
+        jobs: The files to extract per output directory.
+        globstar: See `match_files`.
+        store: The shared store of extracted files, if any.
+        checksum: The package checksum addressing it in the store.
+    return:
+        The results, in the order of `jobs`.
+    """
+    package = os.path.basename(pkg_path)
+    with tracer.span("parse.header", package=package):
+        try:
+            rpm_file = RPMFile(pkg_path)
+        except (OSError, RuntimeError) as e:
+            raise RuntimeError(f"Error listing files in RPM: {e}") from e
+        filenames = rpm_file.filenames()
+    with tracer.span("parse.match", package=package) as span:
+        selections = []
+        for job in jobs:
+            os.makedirs(job.output_dir, exist_ok=True)
+            selections.append(
+                select_members(filenames, job.patterns, globstar, job.files)
+            )
+        matched = sum(len(matched_files) for matched_files, _ in selections)
+        span.set(files=matched)
+    tracer.count(FILES_MATCHED, matched)
+
+    with tracer.span("parse.extract", package=package, outputs=len(jobs)) as span:
+        try:
+            if store is not None and checksum:
+                wanted = list(dict.fromkeys(
+                    name for matched_files, _ in selections for name in matched_files
+                ))
+                with store.entry(checksum) as entry:
+                    missing = entry.missing(wanted)
+                    if missing:
+                        entry.add(rpm_file.extract(entry.tree, missing))
+                    written = [
+                        entry.materialize(job.output_dir, matched_files)
+                        for job, (matched_files, _) in zip(jobs, selections)
+                    ]
+                logger.debug(
+                    f"Placed files of {pkg_path} in {len(jobs)} outputs, "
+                    f"{len(missing)} extracted to the file store"
+                )
+            elif len(jobs) == 1:
+                written = [rpm_file.extract(jobs[0].output_dir, selections[0][0])]
+            else:
+                wanted = list(dict.fromkeys(
+                    name for matched_files, _ in selections for name in matched_files
+                ))
+                staging = tempfile.mkdtemp(prefix="splitter-")
+                try:
+                    rpm_file.extract(staging, wanted)
+                    written = [
+                        copy_members(staging, job.output_dir, matched_files)
+                        for job, (matched_files, _) in zip(jobs, selections)
+                    ]
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+                logger.debug(f"Extracted files from {pkg_path} to {len(jobs)} outputs")
+        except (OSError, RuntimeError) as e:
+            raise RuntimeError(
+                f"Failed to extract files from RPM '{pkg_path}': {e}"
+            ) from e
+        written_count = sum(len(files) for files in written)
+        span.set(files=written_count)
+    tracer.count(FILES_WRITTEN, written_count)
+    return [
+        ExtractResult(
+            files=files,
+            unmatched=unmatched,
+            rpm_file=rpm_file
+        )
+        for files, (_, unmatched) in zip(written, selections)
+    ]
@@ -0,0 +1,613 @@
+import bz2
+import gzip
+import lzma
+import os
+import stat
+import struct
+
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Tuple
+
+from tools.logger import logger, tracer
+from tools.logger.trace import BYTES_DECOMPRESSED
+from tools.parse.fileops import LINK_COPY, link_file
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+LEAD_SIZE = 96
+LEAD_MAGIC = b"\xed\xab\xee\xdb"
+HEADER_MAGIC = b"\x8e\xad\xe8"
+
+# header tag data types
+RPM_NULL_TYPE = 0
+RPM_CHAR_TYPE = 1
+RPM_INT8_TYPE = 2
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+# header tags used by the splitter
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_SUMMARY = 1004
+RPMTAG_BUILDTIME = 1006
+RPMTAG_LICENSE = 1014
+RPMTAG_URL = 1020
+RPMTAG_ARCH = 1022
+RPMTAG_OLDFILENAMES = 1027
+RPMTAG_FILESIZES = 1028
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILEMTIMES = 1034
+RPMTAG_FILEDIGESTS = 1035
+RPMTAG_FILELINKTOS = 1036
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_SOURCERPM = 1044
+RPMTAG_FILEDEVICES = 1095
+RPMTAG_FILEINODES = 1096
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPMTAG_LONGFILESIZES = 5008
+RPMTAG_FILEDIGESTALGO = 5011
+RPMTAG_PAYLOADDIGEST = 5092
+RPMTAG_PAYLOADDIGESTALGO = 5093
+
+# signature tags
+RPMSIGTAG_SHA1 = 269
+RPMSIGTAG_SHA256 = 273
+
+RPMFILE_GHOST = 1 << 6
+
+CPIO_NEWC_MAGIC = b"070701"
+CPIO_CRC_MAGIC = b"070702"
+CPIO_STRIPPED_MAGIC = b"07070X"
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = "TRAILER!!!"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class RPMHeader:
+    """
+    The tag store of a RPM (signature) header.
+    """
+
+    def __init__(self, tags: Dict[int, Any]):
+        self.tags = tags
+
+    def get(self, tag: int, default: Any = None) -> Any:
+        return self.tags.get(tag, default)
+
+    def scalar(self, tag: int, default: Any = None) -> Any:
+        """
+        Get the first element of a numeric tag.
+        """
+        value = self.tags.get(tag)
+        if isinstance(value, list):
+            return value[0] if value else default
+        return default if value is None else value
+
+    def __contains__(self, tag: int) -> bool:
+        return tag in self.tags
+
+
+class RPMFileInfo(NamedTuple):
+    """
+    Metadata of a single file recorded in the RPM header.
+    """
+    name: str
+    size: int
+    mode: int
+    mtime: int
+    linkto: str
+    digest: str
+    flags: int
+    device: int
+    inode: int
+
+
+class CpioEntry(NamedTuple):
+    """
+    A single member of the cpio payload.
+    """
+    name: str
+    ino: int
+    mode: int
+    uid: int
+    gid: int
+    nlink: int
+    mtime: int
+    size: int
+    dev: Tuple[int, int]
+    rdev: Tuple[int, int]
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise RuntimeError("Unexpected end of RPM file")
+        data += chunk
+    return data
+
+
+def _decode(raw: bytes) -> str:
+    return raw.decode("utf-8", errors="surrogateescape")
+
+
+def _parse_value(store: bytes, tag_type: int, offset: int, count: int) -> Any:
+    if tag_type == RPM_NULL_TYPE:
+        return None
+    if tag_type in (RPM_CHAR_TYPE, RPM_INT8_TYPE):
+        return list(store[offset:offset + count])
+    if tag_type == RPM_INT16_TYPE:
+        return list(struct.unpack_from(f">{count}H", store, offset))
+    if tag_type == RPM_INT32_TYPE:
+        return list(struct.unpack_from(f">{count}I", store, offset))
+    if tag_type == RPM_INT64_TYPE:
+        return list(struct.unpack_from(f">{count}Q", store, offset))
+    if tag_type == RPM_BIN_TYPE:
+        return store[offset:offset + count]
+    if tag_type == RPM_STRING_TYPE:
+        end = store.index(b"\x00", offset)
+        return _decode(store[offset:end])
+    if tag_type in (RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE):
+        values = []
+        for _ in range(count):
+            end = store.index(b"\x00", offset)
+            values.append(_decode(store[offset:end]))
+            offset = end + 1
+        return values
+    raise RuntimeError(f"Unknown RPM header tag type: {tag_type}")
+
+
+def read_header(stream: BinaryIO, pad: bool = False) -> RPMHeader:
+    """
+    Read a RPM header structure from the current position of `stream`.
+
+    args:
+        stream: Binary stream positioned at the header magic.
+        pad: Whether the header is followed by 8-byte alignment padding,
+             which is the case for the signature header.
+    return:
+        The parsed header.
+    """
+    preamble = _read_exact(stream, 16)
+    if preamble[:3] != HEADER_MAGIC:
+        raise RuntimeError("Bad RPM header magic")
+    nindex, hsize = struct.unpack(">II", preamble[8:16])
+    index = _read_exact(stream, nindex * 16)
+    store = _read_exact(stream, hsize)
+
+    tags = {}
+    for i in range(nindex):
+        tag, tag_type, offset, count = struct.unpack_from(">IIII", index, i * 16)
+        tags[tag] = _parse_value(store, tag_type, offset, count)
+
+    if pad and hsize % 8:
+        _read_exact(stream, 8 - hsize % 8)
+    return RPMHeader(tags)
+
+
+class CpioReader:
+    """
+    Sequential reader over the members of a decompressed cpio payload.
+
+    Member data which is not read by the caller is skipped when advancing
+    to the next member.
+    """
+
+    def __init__(self, rpm: "RPMFile", stream: BinaryIO):
+        self.rpm = rpm
+        self.stream = stream
+        self._remaining = 0
+        self._padding = 0
+        self._last_links = None
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read up to `size` bytes of the current member data.
+        """
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        if not size:
+            return b""
+        data = self.stream.read(size)
+        if not data:
+            raise RuntimeError(f"Unexpected end of payload in {self.rpm.path}")
+        self._remaining -= len(data)
+        return data
+
+    def _skip(self) -> None:
+        while self._remaining:
+            self.read(CHUNK_SIZE)
+        if self._padding:
+            _read_exact(self.stream, self._padding)
+            self._padding = 0
+
+    def _stripped_entry(self, fx: int) -> CpioEntry:
+        # Stripped payloads (files over 4GB) only carry an index into
+        # the header file list, hardlinked data comes with the last link.
+        rpm = self.rpm
+        if self._last_links is None:
+            self._last_links = {fxs[-1] for fxs in rpm.hardlinks().values()}
+        info = rpm.files[fx]
+        nlink = 1
+        size = 0
+        if stat.S_ISLNK(info.mode):
+            size = len(os.fsencode(info.linkto))
+        elif stat.S_ISREG(info.mode):
+            links = rpm.hardlinks().get((info.device, info.inode))
+            if links:
+                nlink = len(links)
+            if not links or fx in self._last_links:
+                size = info.size
+        return CpioEntry(
+            f".{info.name}", info.inode, info.mode, 0, 0, nlink,
+            info.mtime, size, (0, info.device), (0, 0)
+        )
+
+    def __iter__(self) -> Iterator[CpioEntry]:
+        return self
+
+    def __next__(self) -> CpioEntry:
+        self._skip()
+        magic = _read_exact(self.stream, 6)
+        if magic == CPIO_STRIPPED_MAGIC:
+            fx = int(_read_exact(self.stream, 8), 16)
+            _read_exact(self.stream, 2)
+            entry = self._stripped_entry(fx)
+        elif magic in (CPIO_NEWC_MAGIC, CPIO_CRC_MAGIC):
+            raw = _read_exact(self.stream, CPIO_HEADER_SIZE - 6)
+            fields = [int(raw[i:i + 8], 16) for i in range(0, len(raw), 8)]
+            (ino, mode, uid, gid, nlink, mtime, size, devmajor, devminor,
+             rdevmajor, rdevminor, namesize, _) = fields
+            name = _decode(_read_exact(self.stream, namesize)[:-1])
+            _read_exact(self.stream, (4 - (CPIO_HEADER_SIZE + namesize) % 4) % 4)
+            if name == CPIO_TRAILER:
+                raise StopIteration
+            entry = CpioEntry(
+                name, ino, mode, uid, gid, nlink, mtime, size,
+                (devmajor, devminor), (rdevmajor, rdevminor)
+            )
+        else:
+            raise RuntimeError(f"Bad cpio magic in {self.rpm.path}: {magic!r}")
+        self._remaining = entry.size
+        self._padding = (4 - entry.size % 4) % 4
+        return entry
+
+
+class RPMFile:
+    """
+    A pure-python reader of RPM packages.
+
+    The file list is served from the RPM header without touching the
+    payload, which is only decompressed, in a single streaming pass,
+    when files are extracted.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            lead = _read_exact(f, LEAD_SIZE)
+            if lead[:4] != LEAD_MAGIC:
+                raise RuntimeError(f"Not a RPM package: {path}")
+            self.signature = read_header(f, pad=True)
+            self.header = read_header(f)
+            self.payload_offset = f.tell()
+        self.files = self._build_files()
+        self._hardlinks = None
+
+    @property
+    def name(self) -> str:
+        return self.header.get(RPMTAG_NAME, "")
+
+    @property
+    def version(self) -> str:
+        return self.header.get(RPMTAG_VERSION, "")
+
+    @property
+    def release(self) -> str:
+        return self.header.get(RPMTAG_RELEASE, "")
+
+    @property
+    def epoch(self) -> int:
+        return self.header.scalar(RPMTAG_EPOCH, 0)
+
+    @property
+    def arch(self) -> str:
+        return self.header.get(RPMTAG_ARCH, "")
+
+    @property
+    def compressor(self) -> str:
+        return self.header.get(RPMTAG_PAYLOADCOMPRESSOR, "gzip")
+
+    def _build_files(self) -> List[RPMFileInfo]:
+        header = self.header
+        if RPMTAG_BASENAMES in header:
+            dirnames = header.get(RPMTAG_DIRNAMES, [])
+            names = [
+                dirnames[idx] + base for idx, base in zip(
+                    header.get(RPMTAG_DIRINDEXES, []),
+                    header.get(RPMTAG_BASENAMES, [])
+                )
+            ]
+        else:
+            names = header.get(RPMTAG_OLDFILENAMES, [])
+
+        count = len(names)
+        sizes = header.get(RPMTAG_LONGFILESIZES) or header.get(RPMTAG_FILESIZES, [0] * count)
+        return [
+            RPMFileInfo(*info) for info in zip(
+                names,
+                sizes,
+                header.get(RPMTAG_FILEMODES, [0] * count),
+                header.get(RPMTAG_FILEMTIMES, [0] * count),
+                header.get(RPMTAG_FILELINKTOS, [""] * count),
+                header.get(RPMTAG_FILEDIGESTS, [""] * count),
+                header.get(RPMTAG_FILEFLAGS, [0] * count),
+                header.get(RPMTAG_FILEDEVICES, [0] * count),
+                header.get(RPMTAG_FILEINODES, list(range(count))),
+            )
+        ]
+
+    def hardlinks(self) -> Dict[Tuple[int, int], List[int]]:
+        """
+        Group the indexes of hardlinked regular files by (device, inode).
+        """
+        if self._hardlinks is None:
+            groups: Dict[Tuple[int, int], List[int]] = {}
+            for fx, info in enumerate(self.files):
+                if stat.S_ISREG(info.mode) and not info.flags & RPMFILE_GHOST:
+                    groups.setdefault((info.device, info.inode), []).append(fx)
+            self._hardlinks = {k: v for k, v in groups.items() if len(v) > 1}
+        return self._hardlinks
+
+    def filenames(self) -> List[str]:
+        """
+        List all members of the payload, named the way `cpio -t` names them.
+
+        return:
+            Payload member names such as `./usr/bin/bash`.
+        """
+        return [
+            f".{info.name}" for info in self.files
+            if not info.flags & RPMFILE_GHOST
+        ]
+
+    @contextmanager
+    def open_payload(self) -> Iterator[CpioReader]:
+        """
+        Open the payload as a streaming cpio reader.
+        """
+        compressor = self.compressor
+        with open(self.path, "rb") as raw:
+            raw.seek(self.payload_offset)
+            if compressor == "gzip":
+                stream = gzip.GzipFile(fileobj=raw, mode="rb")
+            elif compressor == "bzip2":
+                stream = bz2.BZ2File(raw, mode="rb")
+            elif compressor in ("xz", "lzma"):
+                stream = lzma.LZMAFile(raw, mode="rb")
+            elif compressor == "zstd":
+                if zstandard is None:
+                    raise RuntimeError(
+                        f"Python module `zstandard` is required to "
+                        f"decompress {self.path}"
+                    )
+                stream = zstandard.ZstdDecompressor().stream_reader(raw)
+            elif compressor in ("identity", "none"):
+                stream = raw
+            else:
+                raise RuntimeError(
+                    f"Unsupported payload compressor '{compressor}' "
+                    f"of {self.path}"
+                )
+            try:
+                yield CpioReader(self, stream)
+            finally:
+                if tracer.enabled:
+                    # the position of the stream is that of the payload,
+                    # decompression stops after the last wanted member
+                    position = stream.tell()
+                    if stream is raw:
+                        position -= self.payload_offset
+                    tracer.count(BYTES_DECOMPRESSED, position)
+                if stream is not raw:
+                    stream.close()
+
+    def extract(self, output_dir: str, names: List[str]) -> List[str]:
+        """
+        Stream the payload once and write the requested members,
+        keeping their modes, mtimes, symlinks and hardlinks.
+
+        args:
+            output_dir: Directory to save extracted files.
+            names: Payload member names to extract, e.g. `./usr/bin/bash`.
+        return:
+            Names of the members written to `output_dir`.
+        """
+        wanted = set(names)
+        remaining = set(wanted)
+        written = []
+        # hardlinked members waiting for the member that carries the data
+        pending_links: Dict[tuple, List[str]] = {}
+        directories = []
+        if not wanted:
+            return written
+
+        with self.open_payload() as reader:
+            for entry in reader:
+                key = (entry.dev, entry.ino)
+                is_link = stat.S_ISREG(entry.mode) and entry.nlink > 1
+                if entry.name in wanted:
+                    remaining.discard(entry.name)
+                elif not (is_link and entry.size and key in pending_links):
+                    continue
+
+                if is_link:
+                    group = pending_links.setdefault(key, [])
+                    if entry.name in wanted:
+                        group.append(entry.name)
+                    if not entry.size:
+                        continue
+                    del pending_links[key]
+                    first = _safe_join(output_dir, group[0])
+                    _write_regular(reader, entry, first)
+                    for name in group[1:]:
+                        path = _safe_join(output_dir, name)
+                        _prepare(path)
+                        os.link(first, path)
+                    written.extend(group)
+                elif stat.S_ISDIR(entry.mode):
+                    path = _safe_join(output_dir, entry.name)
+                    os.makedirs(path, exist_ok=True)
+                    directories.append((path, entry))
+                    written.append(entry.name)
+                else:
+                    _write_entry(reader, entry, _safe_join(output_dir, entry.name))
+                    written.append(entry.name)
+
+                # stop decompressing once everything has been written
+                if not remaining and not pending_links:
+                    break
+
+        for group in pending_links.values():
+            logger.warning(f"Missing hardlink data for {group} in {self.path}")
+        # directory metadata is applied last, writing files changes mtimes
+        for path, entry in reversed(directories):
+            _apply_metadata(path, entry)
+        return written
+
+
+def _safe_join(output_dir: str, name: str) -> str:
+    rel = os.path.normpath(name.lstrip("/"))
+    if rel == "." or rel == ".." or rel.startswith("../") or rel.startswith("/"):
+        raise RuntimeError(f"Refusing to extract unsafe path: {name}")
+    return os.path.join(output_dir, rel)
+
+
+def _prepare(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path) and not os.path.isdir(path):
+        os.unlink(path)
+
+
+def _apply_metadata(path: str, entry: CpioEntry) -> None:
+    is_link = stat.S_ISLNK(entry.mode)
+    if os.geteuid() == 0:
+        os.lchown(path, entry.uid, entry.gid)
+    if not is_link:
+        os.chmod(path, stat.S_IMODE(entry.mode))
+    os.utime(path, (entry.mtime, entry.mtime), follow_symlinks=False)
+
+
+def _write_regular(reader: CpioReader, entry: CpioEntry, path: str) -> None:
+    _prepare(path)
+    with open(path, "wb") as f:
+        while True:
+            data = reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            f.write(data)
+    _apply_metadata(path, entry)
+
+
+def _write_entry(reader: CpioReader, entry: CpioEntry, path: str) -> None:
+    mode = entry.mode
+    if stat.S_ISREG(mode):
+        _write_regular(reader, entry, path)
+        return
+    _prepare(path)
+    if stat.S_ISLNK(mode):
+        os.symlink(_decode(reader.read()), path)
+    elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode) or stat.S_ISFIFO(mode):
+        try:
+            os.mknod(path, mode, os.makedev(*entry.rdev))
+        except OSError as e:
+            logger.warning(f"Failed to create special file {path}: {e}")
+            return
+    else:
+        logger.warning(f"Skipping unsupported payload member: {entry.name}")
+        return
+    _apply_metadata(path, entry)
+
+
+def _copy_metadata(path: str, st: os.stat_result) -> None:
+    is_link = stat.S_ISLNK(st.st_mode)
+    if os.geteuid() == 0:
+        os.lchown(path, st.st_uid, st.st_gid)
+    if not is_link:
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+    os.utime(path, ns=(st.st_mtime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+
+def copy_members(src_dir: str, output_dir: str, names: List[str],
+                 link: str = LINK_COPY) -> List[str]:
+    """
+    Copy already extracted members from `src_dir` to `output_dir`,
+    keeping their modes, mtimes, symlinks and hardlinks.
+
+    args:
+        src_dir: Directory the members were extracted to.
+        output_dir: Directory to copy the members to.
+        names: Member names, e.g. `./usr/bin/bash`.
+        link: How regular files are placed, see `fileops.link_file`.
+    return:
+        Names of the members written to `output_dir`.
+    """
+    written = []
+    # first copy of every hardlinked file
+    links: Dict[Tuple[int, int], str] = {}
+    directories = []
+    for name in names:
+        src = _safe_join(src_dir, name)
+        path = _safe_join(output_dir, name)
+        try:
+            st = os.lstat(src)
+        except FileNotFoundError:
+            continue
+        mode = st.st_mode
+        if stat.S_ISDIR(mode):
+            os.makedirs(path, exist_ok=True)
+            directories.append((path, st))
+            written.append(name)
+            continue
+
+        _prepare(path)
+        key = (st.st_dev, st.st_ino)
+        if stat.S_ISREG(mode) and key in links:
+            os.link(links[key], path)
+            written.append(name)
+            continue
+        if stat.S_ISLNK(mode):
+            os.symlink(os.readlink(src), path)
+        elif stat.S_ISREG(mode):
+            link_file(src, path, link)
+            if st.st_nlink > 1:
+                links[key] = path
+        else:
+            try:
+                os.mknod(path, mode, st.st_rdev)
+            except OSError as e:
+                logger.warning(f"Failed to create special file {path}: {e}")
+                continue
+        _copy_metadata(path, st)
+        written.append(name)
+
+    for path, st in reversed(directories):
+        _copy_metadata(path, st)
+    return written
@@ -0,0 +1,222 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from tools.logger import logger
+from tools.parse.fileops import LINK_HARDLINK
+from tools.parse.rpmfile import copy_members
+from tools import FILE_STORE_PATH
+
+LOCK_FILE = ".lock"
+MEMBERS_FILE = "members.json"
+TREE_DIR = "tree"
+GC_PREFIX = ".gc-"
+
+
+class StoreEntryInfo(NamedTuple):
+    path: str
+    size: int
+    last_used: float
+
+
+class StoreEntry:
+    """
+    The files extracted so far from one package, as a tree under
+    `TREE_DIR` with the list of its members.
+    """
+
+    def __init__(self, path: str, link: str):
+        self.path = path
+        self.tree = os.path.join(path, TREE_DIR)
+        self.link = link
+        self.members: Set[str] = set()
+        try:
+            with open(os.path.join(path, MEMBERS_FILE), "r", encoding="utf-8") as f:
+                self.members = set(json.load(f))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable file store entry {path}: {e}")
+
+    def missing(self, names: List[str]) -> List[str]:
+        """
+        Get the members of `names` which are not in the store yet.
+        """
+        return [
+            name for name in names
+            if name not in self.members
+            or not os.path.lexists(os.path.join(self.tree, name))
+        ]
+
+    def add(self, names: List[str]) -> None:
+        """
+        Record members freshly extracted to `tree`.
+        """
+        self.members.update(names)
+        path = os.path.join(self.path, MEMBERS_FILE)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sorted(self.members), f)
+        os.replace(tmp, path)
+
+    def materialize(self, output_dir: str, names: List[str]) -> List[str]:
+        """
+        Place stored members in `output_dir`, see `copy_members`.
+        """
+        members = os.path.join(self.path, MEMBERS_FILE)
+        if os.path.exists(members):
+            # the modification time records the last use
+            os.utime(members)
+        return copy_members(self.tree, output_dir, names, self.link)
+
+
+class FileStore:
+    """
+    A persistent store of the files extracted from packages, shared by
+    all outputs and runs.
+
+    Entries are addressed by the package checksum from the repository
+    metadata, the files within by their payload path. Each file is
+    extracted once and placed in the outputs as a hardlink, or a
+    reflink, so building the same files into many outputs costs neither
+    the decompression nor the space again.
+
+    Outputs which hardlink the store share the inodes of its files,
+    they must not be modified in place.
+    """
+
+    def __init__(self, root: str = FILE_STORE_PATH, link: str = LINK_HARDLINK):
+        self.root = os.path.abspath(root)
+        self.link = link
+
+    def entry_path(self, checksum: Tuple[str, str]) -> str:
+        algo, digest = checksum
+        return os.path.join(self.root, algo, digest[:2], digest)
+
+    @contextmanager
+    def entry(self, checksum: Tuple[str, str]) -> Iterator[StoreEntry]:
+        """
+        Lock the entry of the package with `checksum`, concurrent runs
+        extract to and read from it in turn.
+        """
+        path = self.entry_path(checksum)
+        lock_path = os.path.join(path, LOCK_FILE)
+        while True:
+            os.makedirs(path, exist_ok=True)
+            lock = open(lock_path, "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # the entry may have been collected before the lock was taken
+                if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock.close()
+        try:
+            yield StoreEntry(path, self.link)
+        finally:
+            lock.close()
+
+    def entries(self) -> List[StoreEntryInfo]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for algo in os.listdir(self.root):
+            for prefix in _listdir(os.path.join(self.root, algo)):
+                for digest in _listdir(os.path.join(self.root, algo, prefix)):
+                    if digest.startswith(GC_PREFIX):
+                        continue
+                    path = os.path.join(self.root, algo, prefix, digest)
+                    try:
+                        last_used = os.stat(os.path.join(path, MEMBERS_FILE)).st_mtime
+                    except FileNotFoundError:
+                        last_used = 0
+                    entries.append(StoreEntryInfo(path, _disk_usage(path), last_used))
+        return entries
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return {
+            "path": self.root,
+            "packages": len(entries),
+            "size": sum(entry.size for entry in entries),
+        }
+
+    def _remove(self, path: str) -> bool:
+        lock_path = os.path.join(path, LOCK_FILE)
+        try:
+            lock = open(lock_path, "a")
+        except FileNotFoundError:
+            return False
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # in use by a running cut
+                return False
+            # moved aside first, the entry is gone at once for the others
+            trash = os.path.join(
+                os.path.dirname(path), f"{GC_PREFIX}{os.getpid()}-{os.path.basename(path)}"
+            )
+            os.rename(path, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+        return True
+
+    def gc(self, max_size: Optional[int] = None,
+           max_age: Optional[int] = None) -> List[StoreEntryInfo]:
+        """
+        Remove the entries unused for `max_age` seconds, then the least
+        recently used ones until the store fits in `max_size` bytes.
+
+        return:
+            The removed entries.
+        """
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry.last_used)
+        total = sum(entry.size for entry in entries)
+        removed = []
+        for entry in entries:
+            expired = max_age is not None and now - entry.last_used > max_age
+            oversized = max_size is not None and total > max_size
+            if not expired and not oversized:
+                continue
+            if self._remove(entry.path):
+                total -= entry.size
+                removed.append(entry)
+        if removed:
+            logger.info(
+                f"Removed {len(removed)} packages from the file store {self.root}"
+            )
+        return removed
+
+
+def _listdir(path: str) -> List[str]:
+    try:
+        return os.listdir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _disk_usage(path: str) -> int:
+    seen = set()
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            size += st.st_blocks * 512
+    return size
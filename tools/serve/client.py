@@ -0,0 +1,142 @@
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+
+from typing import Any, Dict, Optional, TextIO
+from urllib.parse import urlparse
+
+from tools import SERVE_TOKEN_PATH
+from tools.serve.server import JOB_DONE
+
+# seconds between two polls of a running job
+POLL_INTERVAL = 0.5
+
+
+def load_token(path: str = SERVE_TOKEN_PATH) -> Optional[str]:
+    """
+    Get the token of the TCP API, from `SPLITTER_TOKEN` or the token
+    file written by the server.
+    """
+    if os.environ.get("SPLITTER_TOKEN"):
+        return os.environ.get("SPLITTER_TOKEN")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    A HTTP connection over a unix socket.
+    """
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class SplitterClient:
+    """
+    A client of `splitter serve`.
+
+    args:
+        address: The unix socket of the server, or its URL, e.g.
+                 `http://127.0.0.1:8080`.
+        timeout: Seconds before a request to the server fails.
+        token: The token of a server on a TCP port, see `load_token`
+               by default.
+    """
+
+    def __init__(self, address: str, timeout: Optional[float] = 60,
+                 token: Optional[str] = None):
+        self.address = address
+        self.timeout = timeout
+        self.token = token
+        if token is None and address.startswith(("http://", "https://")):
+            self.token = load_token()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.address.startswith(("http://", "https://")):
+            url = urlparse(self.address)
+            return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+        return UnixHTTPConnection(self.address, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, body: Any = None) -> bytes:
+        try:
+            connection = self._connect()
+        except OSError as e:
+            raise RuntimeError(f"Failed to connect to the splitter server at {self.address}: {e}")
+        try:
+            headers = {}
+            if self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode("utf-8")
+                headers["Content-Type"] = "application/json"
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except OSError as e:
+            raise RuntimeError(f"Failed to connect to the splitter server at {self.address}: {e}")
+        finally:
+            connection.close()
+        if response.status >= 400:
+            try:
+                message = json.loads(payload)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = payload.decode("utf-8", "replace")
+            raise RuntimeError(f"Splitter server: {message}")
+        return payload
+
+    def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue a cut request.
+
+        return:
+            The status of the job.
+        """
+        return json.loads(self._request("POST", "/jobs", request))
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return json.loads(self._request("GET", f"/jobs/{job_id}"))
+
+    def log(self, job_id: str, offset: int = 0) -> bytes:
+        """
+        return:
+            The log of the job from byte `offset`.
+        """
+        return self._request("GET", f"/jobs/{job_id}/log?offset={offset}")
+
+    def wait(self, job_id: str, output: Optional[TextIO] = None,
+             interval: float = POLL_INTERVAL) -> Dict[str, Any]:
+        """
+        Wait for the job to finish, its log is copied to `output` as it
+        is written.
+
+        return:
+            The final status of the job.
+        """
+        output = output or sys.stderr
+        offset = 0
+        while True:
+            # the status goes first, the log is complete once it is done
+            status = self.status(job_id)
+            data = self.log(job_id, offset)
+            if data:
+                offset += len(data)
+                output.write(data.decode("utf-8", "replace"))
+                output.flush()
+            if status["status"] in JOB_DONE:
+                return status
+            time.sleep(interval)
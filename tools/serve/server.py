@@ -0,0 +1,458 @@
+import hmac
+import json
+import os
+import queue
+import secrets
+import shutil
+import signal
+import socketserver
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.logger import logger
+from tools.serve.target import WarmTarget
+from tools.splitter.splitter import _architecture_check
+from tools import SERVE_PATH
+
+DEFAULT_JOBS = 4
+# finished jobs kept for their status and logs
+DEFAULT_HISTORY = 1000
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_DONE = {JOB_SUCCEEDED, JOB_FAILED}
+
+# the keys of a cut request, the other options are those of the server
+JOB_REQUIRED = {"release", "arch", "output", "parts"}
+JOB_OPTIONS = {
+    "slice_commit", "slice_dir", "parallel_downloads", "globstar", "rpmdb",
+    "rebuild", "format", "layer_compression", "layers", "layer_cache",
+    "file_store", "link_mode", "profile", "profiler", "trace_out",
+}
+
+
+class Job:
+    """
+    A cut request and its progress.
+    """
+
+    def __init__(self, request: Dict[str, Any], log_dir: str):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = JOB_QUEUED
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.returncode: Optional[int] = None
+        self.log_path = os.path.join(log_dir, f"{self.id}.log")
+
+    @property
+    def target(self) -> Tuple[str, str, Optional[str], Optional[str]]:
+        request = self.request
+        return (
+            request["release"].upper(), request["arch"],
+            request.get("slice_commit"), request.get("slice_dir"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "request": self.request,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "returncode": self.returncode,
+            "log": self.log_path,
+        }
+
+
+def parse_request(data: Any) -> Dict[str, Any]:
+    """
+    Validate a cut request.
+
+    raise:
+        ValueError: if the request is invalid.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("A cut request must be a JSON object!")
+    missing = JOB_REQUIRED - set(data)
+    if missing:
+        raise ValueError(f"Cut request has no {', '.join(sorted(missing))}!")
+    unknown = set(data) - JOB_REQUIRED - JOB_OPTIONS
+    if unknown:
+        raise ValueError(f"Cut request has unknown keys: {', '.join(sorted(unknown))}")
+    parts = data["parts"]
+    if isinstance(parts, str):
+        parts = parts.split()
+    if not isinstance(parts, list) or not parts:
+        raise ValueError("Cut request has no parts!")
+    request = dict(data)
+    request["release"] = str(data["release"])
+    request["arch"] = _architecture_check(data["arch"])
+    request["parts"] = [str(part) for part in parts]
+    if not os.path.isabs(str(data["output"])):
+        raise ValueError(f"Output: {data['output']} must be an absolute path!")
+    return request
+
+
+class SplitterServer:
+    """
+    A long-running splitter, which keeps the slices and the package
+    sack of each release and arch warm and runs the cut requests it is
+    sent, up to `jobs` at a time.
+
+    Each cut runs in a child forked from the loader process of its
+    target, see `WarmTarget`, it starts with the warm state and its log
+    is kept per job.
+
+    args:
+        state_dir: Directory of the job logs and downloads.
+        jobs: The maximum number of cuts running at the same time.
+        options: Keyword arguments of `Splitter` applying to all cuts,
+                 e.g. `package_cache` and `metadata_expire`.
+        history: The number of finished jobs kept.
+    """
+
+    def __init__(self, state_dir: str = SERVE_PATH, jobs: int = DEFAULT_JOBS,
+                 options: Optional[Dict[str, Any]] = None,
+                 history: int = DEFAULT_HISTORY):
+        self.state_dir = os.path.abspath(state_dir)
+        self.log_dir = os.path.join(self.state_dir, "jobs")
+        self.package_dir = os.path.join(self.state_dir, "packages")
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.jobs = max(1, jobs)
+        self.options = dict(options or {})
+        self.history = history
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._targets: Dict[Tuple, WarmTarget] = {}
+        # a target is loaded by one job at a time, the others wait for it
+        self._loading: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        # the targets of the running cuts
+        self._running: Dict[str, WarmTarget] = {}
+        self._workers: List[threading.Thread] = []
+        # the sacks and slices are reloaded once the metadata or the
+        # release head may have changed, -1 never expires as for dnf
+        ages = [
+            age for age in (self.options.get("metadata_expire"), self.options.get("slice_ttl"))
+            if age is not None and age >= 0
+        ]
+        self.max_age = min(ages, default=float("inf"))
+
+    def start(self) -> None:
+        for index in range(self.jobs):
+            worker = threading.Thread(
+                target=self._work, name=f"splitter-job-{index}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self) -> None:
+        """
+        Stop the running cuts and drop the queued ones.
+        """
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                # as for the running cuts, which are terminated
+                job.returncode = -signal.SIGTERM
+                job.status = JOB_FAILED
+                job.finished = time.time()
+                with open(job.log_path, "a", encoding="utf-8") as f:
+                    f.write("The server stopped before the cut started\n")
+        for _ in self._workers:
+            self._queue.put(None)
+        with self._lock:
+            running = list(self._running.items())
+        for job_id, target in running:
+            target.terminate(job_id)
+        for worker in self._workers:
+            worker.join()
+        for target in self._targets.values():
+            target.close()
+        for target in self._targets.values():
+            target.join()
+
+    def submit(self, data: Any) -> Job:
+        """
+        Queue a cut request.
+
+        raise:
+            ValueError: if the request is invalid.
+        """
+        job = Job(parse_request(data), self.log_dir)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._queue.put(job)
+        logger.info(f"Queued job {job.id}: {' '.join(job.request['parts'])} to {job.request['output']}")
+        return job
+
+    def job(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def warm(self, release: str, arch: str, slice_commit: Optional[str] = None,
+             slice_dir: Optional[str] = None) -> WarmTarget:
+        """
+        Get the warm slices and sack of a release and arch, loading
+        them on first use and when they are older than `max_age`.
+        """
+        key = (release.upper(), _architecture_check(arch), slice_commit, slice_dir)
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        # loaded outside of the server lock, the other targets stay
+        # available meanwhile
+        with loading:
+            with self._lock:
+                stale = self._targets.get(key)
+            if stale and not stale.closed and time.monotonic() - stale.loaded < self.max_age:
+                return stale
+            logger.info(f"Loading slices and packages of {release} ({arch})")
+            fresh = WarmTarget(
+                key, os.path.join(self.state_dir, "targets", "-".join(key[:2])),
+                {
+                    name: self.options[name]
+                    for name in ("metadata_expire", "slice_ttl", "preload")
+                    if name in self.options
+                }
+            )
+            with self._lock:
+                self._targets[key] = fresh
+        if stale:
+            # its loader exits once the cuts forked from it are done
+            stale.close()
+        return fresh
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                with open(job.log_path, "a", encoding="utf-8") as f:
+                    f.write(f"{e}\n")
+                job.returncode = job.returncode if job.returncode is not None else 1
+                job.status = JOB_FAILED
+                job.finished = time.time()
+            self._prune()
+
+    def _run(self, job: Job) -> None:
+        job.started = time.time()
+        job.status = JOB_RUNNING
+        package_dir = os.path.join(self.package_dir, job.id)
+        payload = (job.request, job.log_path, self._job_options(), package_dir)
+        while True:
+            target = self.warm(*job.target)
+            # a target replaced meanwhile is loaded again
+            waiter = target.start(job.id, payload)
+            if waiter is not None:
+                break
+        with self._lock:
+            self._running[job.id] = target
+        try:
+            returncode = waiter.get()
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+            shutil.rmtree(package_dir, ignore_errors=True)
+        if returncode is None:
+            raise RuntimeError(f"The loader of {job.request['release']} ({job.request['arch']}) exited")
+        job.returncode = returncode
+        job.finished = time.time()
+        job.status = JOB_SUCCEEDED if returncode == 0 else JOB_FAILED
+        logger.info(
+            f"Job {job.id} {job.status} in {job.finished - job.started:.2f}s"
+        )
+
+    def _job_options(self) -> Dict[str, Any]:
+        # the options of the warm target are fixed by the server
+        return {
+            key: value for key, value in self.options.items()
+            if key not in ("slice_ttl", "preload")
+        }
+
+    def _prune(self) -> None:
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.status in JOB_DONE]
+            for job in finished[:max(0, len(finished) - self.history)]:
+                del self._jobs[job.id]
+                try:
+                    os.unlink(job.log_path)
+                except FileNotFoundError:
+                    pass
+
+
+def write_token(path: str) -> str:
+    """
+    Generate the token of the TCP API and write it to `path`, readable
+    by the user of the server only.
+
+    return:
+        The token.
+    """
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        # a file left by an earlier server may be more permissive
+        os.fchmod(f.fileno(), 0o600)
+        f.write(token)
+    return token
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of the server:
+
+        POST /jobs             queue a cut request, a JSON object
+        GET  /jobs             list the jobs
+        GET  /jobs/<id>        get the status of a job
+        GET  /jobs/<id>/log    get the log of a job from byte `?offset=`
+
+    On a TCP port, every request carries `Authorization: Bearer <token>`.
+    """
+    server_version = "splitter"
+
+    def _authorized(self) -> bool:
+        token = self.server.token
+        if token is None:
+            return True
+        given = self.headers.get("Authorization", "")
+        if hmac.compare_digest(given.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            return True
+        self._error(401, "A valid token of the server is required!")
+        return False
+
+    def address_string(self) -> str:
+        # clients of the unix socket have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status: int, body: Any) -> None:
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header(
+            "Content-Type",
+            "application/octet-stream" if isinstance(body, bytes) else "application/json"
+        )
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _error(self, status: int, message: str) -> None:
+        self._send(status, {"error": message})
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        if self.path.rstrip("/") != "/jobs":
+            self._error(404, f"No such resource: {self.path}")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b"null")
+            job = self.server.splitter.submit(data)
+        except ValueError as e:
+            self._error(400, str(e))
+            return
+        self._send(202, job.to_dict())
+
+    def do_GET(self) -> None:
+        if not self._authorized():
+            return
+        path, _, query = self.path.partition("?")
+        parts = [part for part in path.split("/") if part]
+        splitter: SplitterServer = self.server.splitter
+        if parts == ["jobs"]:
+            self._send(200, [job.to_dict() for job in splitter.list_jobs()])
+            return
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = splitter.job(parts[1])
+            if job is None:
+                self._error(404, f"No such job: {parts[1]}")
+            elif len(parts) == 2:
+                self._send(200, job.to_dict())
+            elif parts[2] == "log":
+                self._send_log(job, query)
+            else:
+                self._error(404, f"No such resource: {self.path}")
+            return
+        self._error(404, f"No such resource: {self.path}")
+
+    def _send_log(self, job: Job, query: str) -> None:
+        offset = 0
+        for param in query.split("&"):
+            key, _, value = param.partition("=")
+            if key == "offset" and value.isdigit():
+                offset = int(value)
+        try:
+            with open(job.log_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        self._send(200, data)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, handler):
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        super().__init__(path, handler)
+        # the cuts run with the privileges of the server
+        os.chmod(path, 0o600)
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def make_http_server(splitter: SplitterServer, socket_path: Optional[str] = None,
+                     port: Optional[int] = None, token: Optional[str] = None):
+    """
+    Serve the API of `splitter` on a unix socket, or on a local TCP port.
+
+    The unix socket is only accessible to the user of the server, any
+    local user may connect to the TCP port, which requires `token`.
+
+    raise:
+        ValueError: if a TCP port is given without a token.
+    """
+    if port is not None:
+        if not token:
+            raise ValueError("A token is required to serve on a TCP port!")
+        httpd = ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+    else:
+        httpd = UnixHTTPServer(socket_path, RequestHandler)
+        token = None
+    httpd.splitter = splitter
+    httpd.token = token
+    return httpd
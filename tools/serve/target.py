@@ -0,0 +1,267 @@
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from typing import Any, Dict, Optional, Tuple
+
+from tools.download import rpm
+from tools.logger import logger, tracer
+from tools.splitter.layers import LayerSpec
+from tools.splitter.loader import SplitterLoader
+from tools.splitter.splitter import Splitter
+
+# seconds between two checks of the cuts of a loader for their exit
+POLL_INTERVAL = 0.1
+
+# messages between a warm target and its loader: (kind, job id, payload)
+MSG_READY = "ready"
+MSG_ERROR = "error"
+MSG_RUN = "run"
+MSG_TERMINATE = "terminate"
+MSG_CLOSE = "close"
+MSG_EXITED = "exited"
+
+# the keys of a cut request which select its warm target
+TARGET_KEYS = {"release", "arch", "output", "parts", "slice_commit", "slice_dir"}
+
+
+def _exitcode(status: int) -> int:
+    # as `Process.exitcode`, minus the signal of a killed child
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _run_job(loader: SplitterLoader, dnf_client, request: Dict[str, Any],
+             log_path: str, options: Dict[str, Any], package_dir: str) -> None:
+    """
+    Run a cut in a child forked from the loader, which owns its copies
+    of the warm sack and slices.
+    """
+    fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+    # concurrent cuts must not download to the same files
+    rpm.set_package_dir(dnf_client, package_dir)
+
+    request = dict(request)
+    if request.get("layers"):
+        request["layers"] = [LayerSpec(name, list(slices)) for name, slices in request["layers"]]
+    trace_out = request.pop("trace_out", None)
+    kwargs = dict(options)
+    kwargs.update(
+        (key, value) for key, value in request.items() if key not in TARGET_KEYS
+    )
+    tracer.enable()
+    try:
+        splitter = Splitter(
+            request["release"], request["arch"], request["output"], request["parts"],
+            loader=loader,
+            **kwargs
+        )
+        splitter.cut(dnf_client)
+    finally:
+        tracer.report(trace_out)
+
+
+def _fork_job(payload: Tuple, loader: SplitterLoader, dnf_client) -> None:
+    """
+    Run the cut of `payload` in the forked child, which never returns.
+    """
+    code = 1
+    try:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        _run_job(loader, dnf_client, *payload)
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _serve_target(conn, key: Tuple, output: str, options: Dict[str, Any]) -> None:
+    """
+    The loader of a warm target: load the slices and the sack, then fork
+    a child per cut requested on `conn` until it is closed.
+
+    It runs a single thread, so its children never inherit a lock held
+    by another thread, e.g. of logging or librepo.
+    """
+    # stopped by the server, along with its cuts
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    release, arch, slice_commit, slice_dir = key
+    try:
+        splitter = Splitter(
+            release, arch, output, [],
+            slice_commit=slice_commit,
+            slice_dir=slice_dir,
+            rpmdb=False,
+            metadata_expire=options.get("metadata_expire", 0),
+            slice_ttl=options.get("slice_ttl", 0),
+            preload=options.get("preload", False),
+        )
+        dnf_client = splitter.init_dnf_client()
+    except Exception as e:
+        conn.send((MSG_ERROR, None, str(e)))
+        return
+    conn.send((MSG_READY, None, None))
+
+    children: Dict[int, str] = {}
+    connected = True
+    closing = False
+    try:
+        while connected and not closing or children:
+            if not connected:
+                # the server is gone, its cuts are finished nevertheless
+                pid, status = os.waitpid(-1, 0)
+                children.pop(pid, None)
+                continue
+            if conn.poll(POLL_INTERVAL):
+                try:
+                    kind, job_id, payload = conn.recv()
+                except EOFError:
+                    connected = False
+                    continue
+                if kind == MSG_RUN and not closing:
+                    pid = os.fork()
+                    if pid == 0:
+                        conn.close()
+                        _fork_job(payload, splitter.loader, dnf_client)
+                    children[pid] = job_id
+                elif kind == MSG_TERMINATE:
+                    for pid, child in children.items():
+                        if child == job_id:
+                            os.kill(pid, signal.SIGTERM)
+                elif kind == MSG_CLOSE:
+                    closing = True
+            while children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if not pid:
+                    break
+                job_id = children.pop(pid, None)
+                try:
+                    conn.send((MSG_EXITED, job_id, _exitcode(status)))
+                except OSError:
+                    connected = False
+    finally:
+        rpm.clear(dnf_client, splitter.run_dir)
+
+
+class WarmTarget:
+    """
+    The slices and the package sack of a release and arch, loaded once
+    and shared by all the cuts of that target.
+
+    They are loaded by a spawned loader process, which forks each cut
+    from its single thread: a cut forked from the threads of the server
+    could start with the locks they held, e.g. in the middle of logging
+    or of loading another sack.
+
+    args:
+        key: The release, arch, slice commit and slice directory.
+        output: The output of the splitter of the loader, which is
+                never written.
+        options: `metadata_expire`, `slice_ttl` and `preload`.
+    raise:
+        RuntimeError: if the slices or the sack failed to load.
+    """
+
+    def __init__(self, key: Tuple, output: str, options: Dict[str, Any]):
+        self.key = key
+        context = multiprocessing.get_context("spawn")
+        self._conn, conn = context.Pipe()
+        self.process = context.Process(
+            target=_serve_target, args=(conn, key, output, options),
+            name=f"splitter-target-{key[0]}-{key[1]}", daemon=True
+        )
+        self.process.start()
+        conn.close()
+        try:
+            kind, _, message = self._conn.recv()
+        except EOFError:
+            self.process.join()
+            kind, message = MSG_ERROR, f"the loader exited with {self.process.exitcode}"
+        if kind != MSG_READY:
+            self.process.join()
+            raise RuntimeError(f"Failed to load {key[0]} ({key[1]}): {message}")
+        self.loaded = time.monotonic()
+        # held while sending to the loader and while closing it
+        self.lock = threading.Lock()
+        self.closed = False
+        self._waiters: Dict[str, "queue.Queue[Optional[int]]"] = {}
+        self._reader = threading.Thread(
+            target=self._read, name=f"{self.process.name}-reader", daemon=True
+        )
+        self._reader.start()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                kind, job_id, value = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == MSG_EXITED:
+                with self.lock:
+                    waiter = self._waiters.pop(job_id, None)
+                if waiter:
+                    waiter.put(value)
+        # the loader exited, it is never used again
+        with self.lock:
+            self.closed = True
+            waiters, self._waiters = self._waiters, {}
+        for waiter in waiters.values():
+            waiter.put(None)
+        self.process.join()
+
+    def _send(self, kind: str, job_id: Optional[str] = None, payload: Any = None) -> None:
+        try:
+            self._conn.send((kind, job_id, payload))
+        except OSError as e:
+            logger.debug(f"Loader {self.process.name} is gone: {e}")
+
+    def start(self, job_id: str, payload: Tuple) -> Optional["queue.Queue[Optional[int]]"]:
+        """
+        Fork a cut from the loader.
+
+        args:
+            payload: The request, log path, options and package directory
+                     of the cut, see `_run_job`.
+        return:
+            A queue getting the exit code of the cut, None if it exited
+            abnormally, or None if the target is closed.
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            waiter: "queue.Queue[Optional[int]]" = queue.Queue(1)
+            self._waiters[job_id] = waiter
+            self._send(MSG_RUN, job_id, payload)
+        return waiter
+
+    def terminate(self, job_id: str) -> None:
+        with self.lock:
+            self._send(MSG_TERMINATE, job_id)
+
+    def close(self) -> None:
+        """
+        Stop forking cuts, the loader exits once the running ones are done.
+        """
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self._send(MSG_CLOSE)
+
+    def join(self) -> None:
+        self._reader.join()
@@ -1,16 +1,33 @@
 import os
 import shutil
-from tools.parse import parse
 from typing import List, Dict
 
+from tools.cert import sbom
+from tools.parse.fileops import clone_file
+
 
 EXTRA_TEXT = "text"
 EXTRA_COPY = "copy"
+EXTRA_MANIFEST = "manifest"
 EXTRA_ARM64 = "linux-aarch64"
 EXTRA_AMD64 = "linux-x86_64"
 
+# normalized architecture -> extra key
+EXTRA_ARCHES = {
+    "aarch64": EXTRA_ARM64,
+    "x86_64": EXTRA_AMD64,
+}
+
+
+def _tmp_path(path: str) -> str:
+    # the destination is replaced rather than written in place, it may be
+    # hardlinked to the file store
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return f"{path}.tmp-{os.getpid()}"
+
 
 class SliceExtra:
+    __slots__ = ("arm64", "amd64", "copy", "text", "manifest")
 
     def __init__(self):
         # <dst:src>
@@ -19,27 +36,20 @@ class SliceExtra:
         self.copy: Dict[str, str] = {}
         self.text: Dict[str, str] = {}
         self.manifest: List[str] = []
-        self.extra_files: List[str] = []
 
-    def linux_arm64_handler(self, pkg_path: str, output: str):
+    def get_arch_files(self, arch: str) -> List[str]:
         """
-        Handle files specifically required for ARM architecture.
-        """
-        if not self.arm64:
-            return self
-        parse.extract_files(pkg_path, output, self.arm64)
-        self.extra_files.extend(self.arm64)
-        return self
+        Get the file patterns specifically required for `arch`.
 
-    def linux_amd64_handler(self, pkg_path: str, output: str):
+        The files are extracted together with the `common` contents of
+        the package, see `tools.splitter.plan`.
         """
-        Handle files specifically required for AMD architecture.
-        """
-        if not self.amd64:
-            return self
-        parse.extract_files(pkg_path, output, self.amd64)
-        self.extra_files.extend(self.amd64)
-        return self
+        extra_key = EXTRA_ARCHES.get(arch)
+        if extra_key == EXTRA_ARM64:
+            return self.arm64
+        if extra_key == EXTRA_AMD64:
+            return self.amd64
+        return []
 
     def copy_handler(self, output: str):
         """
@@ -47,10 +57,13 @@ class SliceExtra:
         """
         if not self.copy:
             return self
-        for dst, src in self.copy:
-            dst_path = os.path.join(output, dst)
-            shutil.copy2(src, dst_path)
-            self.extra_files.append(dst)
+        for dst, src in self.copy.items():
+            dst_path = os.path.join(output, dst.lstrip("/"))
+            tmp = _tmp_path(dst_path)
+            # reflinked where supported, the copy shares the blocks of `src`
+            clone_file(src, tmp)
+            shutil.copystat(src, tmp)
+            os.replace(tmp, dst_path)
         return self
 
     def text_handler(self, output: str):
@@ -60,18 +73,24 @@ class SliceExtra:
         if not self.text:
             return self
 
-        for dst, text in self.text:
-            dst_path = os.path.join(output, dst)
-            with open(dst_path,  "w", encoding="utf-8") as f:
+        for dst, text in self.text.items():
+            dst_path = os.path.join(output, dst.lstrip("/"))
+            tmp = _tmp_path(dst_path)
+            with open(tmp, "w", encoding="utf-8") as f:
                 f.write(text)
-            self.extra_files.append(dst)
+            os.replace(tmp, dst_path)
         return self
 
-    # TODO waiting implement
-    def manifest_handler(self, output: str):
+    def manifest_handler(self, output: str, records: List["sbom.PackageRecord"]):
         """
-        Generate a `manifest.wall` file for CVE scanning.
+        Generate a `manifest.wall` file for CVE scanning at each of the
+        `manifest` paths, covering all the packages of the output.
         """
+        if not self.manifest:
+            return self
+        for dst in self.manifest:
+            dst_path = os.path.join(output, dst.lstrip("/"))
+            sbom.write_manifest(dst_path, records)
         return self
 
 
@@ -99,5 +118,11 @@ class ExtraBuilder:
         self.extra.text = self.data.get(EXTRA_TEXT, {})
         return self
 
+    def set_manifest(self):
+        manifest = self.data.get(EXTRA_MANIFEST, [])
+        # a single path may be given as a plain string
+        self.extra.manifest = [manifest] if isinstance(manifest, str) else manifest
+        return self
+
     def get_extra(self):
         return self.extra
@@ -0,0 +1,85 @@
+import os
+import pickle
+import time
+
+from typing import Dict, Optional, Tuple
+
+from tools.slice.slice import Slice, SliceDefinitionFile
+from tools.logger import logger
+from tools import SLICE_INDEX_PATH
+
+# bump whenever the layout of the serialized objects changes
+INDEX_VERSION = 2
+# index files which have not been used for this long are removed
+INDEX_MAX_AGE = 7 * 24 * 3600
+
+
+class SliceIndex:
+    """
+    A compiled index of a slice repository commit, mapping each
+    `{package}_{slice}` name straight to its package and `Slice`.
+    """
+
+    def __init__(self, commit: str, slices: Dict[str, Tuple[str, Slice]]):
+        self.commit = commit
+        self.slices = slices
+
+    def get(self, name: str) -> Optional[Tuple[str, Slice]]:
+        return self.slices.get(name)
+
+    def __len__(self) -> int:
+        return len(self.slices)
+
+    @classmethod
+    def build(cls, commit: str,
+              sdf_objs: Dict[str, SliceDefinitionFile]) -> "SliceIndex":
+        """
+        Compile the index from parsed SDF objects keyed by file path.
+        """
+        slices = {}
+        for file, sdf_obj in sdf_objs.items():
+            prefix = os.path.basename(file)[:-len(".yaml")]
+            for sc in sdf_obj.slices:
+                slices[f"{prefix}_{sc.name}"] = (sdf_obj.package, sc)
+        return cls(commit, slices)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path: str) -> Optional["SliceIndex"]:
+        try:
+            with open(path, "rb") as f:
+                index = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable slice index {path}: {e}")
+            return None
+        # the modification time records the last use
+        os.utime(path)
+        return index
+
+
+def index_path(commit: str, root: str = SLICE_INDEX_PATH) -> str:
+    return os.path.join(root, f"{commit}.v{INDEX_VERSION}.pickle")
+
+
+def prune_indexes(root: str, keep: str) -> None:
+    """
+    Remove the index files of commits which have not been used lately.
+    """
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if path == keep:
+            continue
+        try:
+            if now - os.path.getmtime(path) > INDEX_MAX_AGE:
+                os.unlink(path)
+        except OSError:
+            continue
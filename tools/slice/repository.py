@@ -0,0 +1,224 @@
+import fcntl
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+
+from typing import Optional
+
+from tools.logger import logger, tracer
+from tools import SLICE_MIRROR_PATH, SLICE_REPO
+
+# seconds before the release head is checked against the remote again
+DEFAULT_SLICE_TTL = 3600
+# checkouts which have not been used for this long are removed
+CHECKOUT_MAX_AGE = 7 * 24 * 3600
+
+
+def _git(git_dir: str, *args: str) -> str:
+    result = subprocess.run(
+        ["git", "--git-dir", git_dir, *args],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    return result.stdout.strip()
+
+
+class SliceRepository:
+    """
+    A persistent, shallow mirror of the slice-releases repository.
+
+    Every slice commit is materialized once into its own read-only
+    checkout, so concurrent runs never see a checkout change under them
+    and a pinned commit is served without any network access.
+    """
+
+    def __init__(self,
+                 root: str = SLICE_MIRROR_PATH,
+                 url: str = SLICE_REPO,
+                 ttl: int = DEFAULT_SLICE_TTL,
+                 commit: Optional[str] = None,
+                 local_dir: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.url = url
+        self.ttl = ttl
+        self.commit = commit
+        self.local_dir = os.path.abspath(local_dir) if local_dir else None
+        self.git_dir = os.path.join(self.root, "mirror.git")
+        self.checkouts = os.path.join(self.root, "checkouts")
+
+    def checkout(self, release: str) -> str:
+        """
+        Get a checkout of the slices for `release`.
+
+        The remote is only contacted when the mirror has no copy of the
+        release yet, or when the last check is older than the TTL.
+
+        return:
+            Path to the checkout.
+        raise:
+            ValueError: if the release or the pinned commit is not found.
+        """
+        if self.local_dir:
+            if not os.path.isdir(os.path.join(self.local_dir, "slices")):
+                raise ValueError(
+                    f"Slice directory: {self.local_dir} has no `slices`!"
+                )
+            return self.local_dir
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a") as lock, \
+                tracer.span("slices.checkout", release=release):
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._init_mirror()
+            if self.commit:
+                sha = self._resolve_commit(self.commit)
+            else:
+                sha = self._resolve_release(release)
+            path = self._materialize(sha)
+            self._prune_checkouts(keep=path)
+        self.commit = sha
+        logger.info(f"Using slices of {release} at commit {sha}")
+        return path
+
+    def revision(self) -> Optional[str]:
+        """
+        Get the commit of the checkout in use.
+
+        return:
+            The commit hash, or None for a local directory with
+            uncommitted changes or outside of git.
+        """
+        if not self.local_dir:
+            return self.commit
+        try:
+            status, head = [
+                subprocess.run(
+                    ["git", "-C", self.local_dir, *args],
+                    check=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True
+                ).stdout.strip()
+                for args in (["status", "--porcelain"], ["rev-parse", "HEAD"])
+            ]
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return None
+        return None if status else head
+
+    def _init_mirror(self) -> None:
+        if os.path.exists(os.path.join(self.git_dir, "HEAD")):
+            return
+        os.makedirs(self.git_dir, exist_ok=True)
+        _git(self.git_dir, "init", "--bare", "--quiet")
+        _git(self.git_dir, "remote", "add", "origin", self.url)
+
+    def _rev_parse(self, rev: str) -> Optional[str]:
+        try:
+            return _git(self.git_dir, "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}")
+        except subprocess.CalledProcessError:
+            return None
+
+    def _stamp(self, release: str) -> str:
+        return os.path.join(self.root, "checked", release)
+
+    def _resolve_release(self, release: str) -> str:
+        ref = f"refs/heads/{release}"
+        local = self._rev_parse(ref)
+        stamp = self._stamp(release)
+        if local and os.path.exists(stamp) \
+                and time.time() - os.path.getmtime(stamp) < self.ttl:
+            return local
+
+        try:
+            result = subprocess.run(
+                ["git", "ls-remote", "--heads", self.url, release],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+        except subprocess.CalledProcessError as e:
+            if local:
+                logger.warning(
+                    f"Failed to check the slice repository, using the "
+                    f"mirrored {release} at {local}: {e.stderr.strip()}"
+                )
+                return local
+            raise ValueError(f"Release: {release} is invalid!")
+
+        remote = None
+        for line in result.stdout.splitlines():
+            sha, name = line.split()
+            if name == ref:
+                remote = sha
+        if not remote:
+            raise ValueError(f"Release: {release} is invalid!")
+
+        if remote != local:
+            try:
+                _git(self.git_dir, "fetch", "--quiet", "--depth", "1",
+                     "origin", f"+{ref}:{ref}")
+            except subprocess.CalledProcessError as e:
+                raise ValueError(f"Fetch slice repository failed: {e.stderr}")
+        os.makedirs(os.path.dirname(stamp), exist_ok=True)
+        with open(stamp, "w", encoding="utf-8") as f:
+            f.write(remote)
+        return remote
+
+    def _resolve_commit(self, commit: str) -> str:
+        sha = self._rev_parse(commit)
+        if sha:
+            return sha
+        try:
+            _git(self.git_dir, "fetch", "--quiet", "--depth", "1", "origin", commit)
+        except subprocess.CalledProcessError as e:
+            raise ValueError(f"Slice commit: {commit} is not found! {e.stderr}")
+        sha = self._rev_parse("FETCH_HEAD")
+        if not sha:
+            raise ValueError(f"Slice commit: {commit} is not found!")
+        return sha
+
+    def _materialize(self, sha: str) -> str:
+        path = os.path.join(self.checkouts, sha)
+        if os.path.isdir(path):
+            # the modification time records the last use
+            os.utime(path)
+            return path
+
+        tmp = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        archive = subprocess.Popen(
+            ["git", "--git-dir", self.git_dir, "archive", "--format=tar", sha],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        try:
+            with tarfile.open(fileobj=archive.stdout, mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(tmp, filter="data")
+                else:
+                    tar.extractall(tmp)
+        finally:
+            _, stderr = archive.communicate()
+        if archive.returncode:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise ValueError(f"Checkout slice commit {sha} failed: {stderr.decode()}")
+        os.rename(tmp, path)
+        return path
+
+    def _prune_checkouts(self, keep: str) -> None:
+        now = time.time()
+        for name in os.listdir(self.checkouts):
+            path = os.path.join(self.checkouts, name)
+            if path == keep:
+                continue
+            try:
+                if now - os.path.getmtime(path) > CHECKOUT_MAX_AGE:
+                    shutil.rmtree(path)
+            except OSError:
+                continue
@@ -4,6 +4,12 @@ from typing import List, Any
 from tools.slice.extra import SliceExtra, ExtraBuilder
 from tools.logger import logger
 
+# prefer the libyaml based loader, it is much faster than the pure-python one
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 SLICE_MANIFEST = "manifest"
 SLCIE_CONTENTS = "contents"
 SLICE_COMMON = "common"
@@ -12,15 +18,18 @@ SLICE_DEPS = "deps"
 
 
 class Slice:
-    name: str = None
-    common: List[str] = None
-    extra: SliceExtra = None
-    deps: List[str] = None
+    __slots__ = ("name", "common", "extra", "deps")
+
+    name: str
+    common: List[str]
+    extra: SliceExtra
+    deps: List[str]
 
     def __init__(self):
         self.name = ""
         self.common = []
         self.extra = SliceExtra()
+        self.deps = []
 
 
 class SliceBuilder:
@@ -49,6 +58,7 @@ class SliceBuilder:
             .set_amd64()
             .set_arm64()
             .set_copy()
+            .set_manifest()
         )
         self.slice.extra = extra_builder.get_extra()
         return self
@@ -74,7 +84,7 @@ class SliceDefinitionFile:
         # load SDF
         try:
             with open(file, "r", encoding="utf-8") as f:
-                self.data = yaml.safe_load(f)
+                self.data = yaml.load(f, Loader=SafeLoader)
         except FileNotFoundError:
             logger.error(f"The file '{file}' was not found.")
         except yaml.YAMLError as e:
@@ -0,0 +1,217 @@
+"""
+An asyncio API of the splitter, to embed cuts in an event loop.
+
+    async with AsyncSplitter(
+        "24.03-LTS", "x86_64", "/path/to/output", ["python3_standard"],
+        package_cache=True
+    ) as splitter:
+        packages = await splitter.plan()
+        task = asyncio.create_task(splitter.execute())
+        async for event in splitter.events():
+            print(event.stage, event.package, f"{event.done}/{event.total}")
+        await task
+
+The blocking steps, cloning the slices, loading the repository metadata,
+downloading and extracting the packages and running `rpm`, are run in
+an executor, the event loop is never blocked.
+"""
+import asyncio
+import functools
+import threading
+
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional
+
+from tools.download import rpm
+from tools.splitter.splitter import FORMAT_DIR, FORMATS, Splitter, _architecture_check, _slices_check
+
+STAGE_SLICES = "slices"
+STAGE_PLAN = "plan"
+STAGE_METADATA = "metadata"
+STAGE_RESOLVE = "resolve"
+STAGE_PACKAGE = "package"
+STAGE_FINISHED = "finished"
+
+
+class ProgressEvent(NamedTuple):
+    """
+    A step of a cut: the start of a stage, or a package done.
+    """
+    stage: str
+    # the package done, with the path it was downloaded to, which is
+    # empty if the download failed
+    package: Optional[str] = None
+    path: Optional[str] = None
+    done: int = 0
+    total: int = 0
+
+
+class AsyncSplitter:
+    """
+    A cut driven from asyncio, in two steps: `plan` loads the slices and
+    the repository metadata and selects the packages to extract,
+    `execute` downloads and extracts them. `cut` runs both.
+
+    Nothing is loaded or written before `plan`, the constructor only
+    validates its arguments. `execute` releases what `plan` set up, a
+    cut planned but not executed has to be closed with `aclose`, or
+    used as an async context manager.
+
+    Cancelling `plan` or `execute` takes effect once the blocking step
+    in flight returns, or at the next package done while extracting. The
+    downloads in flight are waited for, dnf cannot abort them. Layers
+    being written are removed, the files extracted so far are kept and
+    the build state of the output is left as it was, the next cut
+    rebuilds them.
+
+    args:
+        release, arch, output, slices: See `Splitter`.
+        executor: The executor of the blocking steps, the default
+                  executor of the loop if not given.
+        options: Keyword arguments of `Splitter`, except `profile`.
+    """
+
+    def __init__(self, release: str, arch: str, output: str, slices: List[str],
+                 executor=None, **options: Any):
+        _architecture_check(arch)
+        _slices_check(slices)
+        if options.get("format", FORMAT_DIR) not in FORMATS:
+            raise ValueError(f"Format: {options['format']} is invalid!")
+        if options.get("profile"):
+            # the sampling profiler follows the spans of one thread
+            raise ValueError("Profiling is only supported by `Splitter.cut`!")
+        self.args = (release, arch, output, list(slices))
+        self.options = options
+        self.executor = executor
+        self.splitter: Optional[Splitter] = None
+        self.dnf_client = None
+        self.packages: Optional[Dict[str, object]] = None
+        self._executed = False
+        self._closed = False
+        self._cancel = threading.Event()
+        self._events: Optional[asyncio.Queue] = None
+
+    def _queue(self) -> asyncio.Queue:
+        # created in the loop, the queue is bound to it before python 3.10
+        if self._events is None:
+            self._events = asyncio.Queue()
+        return self._events
+
+    def _emit(self, event: Optional[ProgressEvent]) -> None:
+        self._queue().put_nowait(event)
+
+    async def events(self) -> AsyncIterator[ProgressEvent]:
+        """
+        The progress of the cut, ending once `execute` is done or a step
+        failed. There is a single stream of events per cut.
+        """
+        events = self._queue()
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            yield event
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        """
+        Run a blocking step in the executor, a cancelled step is waited
+        for, it is never left running behind the cut.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self._cancel.set()
+            await asyncio.wait([future])
+            if not future.cancelled():
+                # retrieved, the cancellation is raised instead
+                future.exception()
+            raise
+
+    async def plan(self) -> Dict[str, str]:
+        """
+        Check out the slices, load the repository metadata and select
+        the packages to extract.
+
+        return:
+            The NEVRA of the packages to download, keyed by name.
+        """
+        if self._closed:
+            raise RuntimeError("The cut is closed!")
+        if self.splitter is not None:
+            raise RuntimeError("The cut is already planned!")
+        try:
+            self._emit(ProgressEvent(STAGE_SLICES))
+            self.splitter = await self._run(
+                functools.partial(Splitter, *self.args, **self.options)
+            )
+            self._emit(ProgressEvent(STAGE_PLAN))
+            await self._run(self.splitter.plan)
+            self._emit(ProgressEvent(STAGE_METADATA))
+            self.dnf_client = await self._run(self.splitter.init_dnf_client)
+            self._emit(ProgressEvent(STAGE_RESOLVE))
+            self.packages = await self._run(self.splitter.resolve, self.dnf_client)
+        except BaseException:
+            await self._close()
+            raise
+        return {name: str(pkg) for name, pkg in self.packages.items()}
+
+    async def execute(self) -> None:
+        """
+        Download and extract the packages selected by `plan`, and
+        finish the output.
+        """
+        if self._closed:
+            raise RuntimeError("The cut is closed!")
+        if self.packages is None:
+            raise RuntimeError("The cut is not planned, see `plan`!")
+        if self._executed:
+            raise RuntimeError("The cut is already executed!")
+        self._executed = True
+        loop = asyncio.get_running_loop()
+
+        def progress(done: int, total: int, package: str, path: str) -> None:
+            if self._cancel.is_set():
+                raise asyncio.CancelledError()
+            loop.call_soon_threadsafe(
+                self._emit, ProgressEvent(STAGE_PACKAGE, package, path, done, total)
+            )
+
+        try:
+            await self._run(self.splitter.execute, self.dnf_client, self.packages, progress)
+            self._emit(ProgressEvent(STAGE_FINISHED))
+        finally:
+            await self._close()
+
+    async def cut(self) -> None:
+        """
+        Plan and execute the cut.
+        """
+        await self.plan()
+        await self.execute()
+
+    async def aclose(self) -> None:
+        """
+        Release the repository metadata and the run directory of a cut
+        planned but not executed, after which it can be neither planned
+        nor executed. A running `execute` releases them once done.
+        """
+        self._closed = True
+        if self.dnf_client is not None and not self._executed:
+            await self._close()
+
+    async def __aenter__(self) -> "AsyncSplitter":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def _close(self) -> None:
+        dnf_client, self.dnf_client = self.dnf_client, None
+        try:
+            if dnf_client is not None:
+                # the repo file and downloads are in the run directory
+                # of this cut only
+                await asyncio.shield(self._run(rpm.clear, dnf_client, self.splitter.run_dir))
+        finally:
+            self._emit(None)
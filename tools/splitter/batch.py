@@ -0,0 +1,238 @@
+import multiprocessing
+import os
+import yaml
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from tools.download import rpm
+from tools.download.cache import PackageCache
+from tools.splitter.plan import execute_plans
+from tools.splitter.splitter import Splitter, _architecture_check
+from tools.logger import logger
+
+SPEC_IMAGES = "images"
+SPEC_KEYS = {"name", "release", "arch", "output", "parts", "slice_commit", "slice_dir"}
+
+
+class Target(NamedTuple):
+    """
+    One image of a batch build.
+    """
+    name: str
+    release: str
+    arch: str
+    output: str
+    parts: List[str]
+    slice_commit: Optional[str] = None
+    slice_dir: Optional[str] = None
+
+
+def load_targets(spec_file: str) -> List[Target]:
+    """
+    Load the images of a build spec file.
+
+    An image with a list of arches is expanded into one target per
+    arch, its output must then contain an `{arch}` placeholder, e.g.
+
+        images:
+          - name: python3
+            release: 24.03-LTS
+            arch: [x86_64, aarch64]
+            output: out/python3/{arch}
+            parts: [python3_core]
+
+    raise:
+        ValueError: if the spec is invalid or two targets share an output.
+    """
+    with open(spec_file, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    images = data.get(SPEC_IMAGES) if isinstance(data, dict) else None
+    if not isinstance(images, list) or not images:
+        raise ValueError(f"Build spec: {spec_file} has no `{SPEC_IMAGES}`!")
+
+    targets = []
+    for index, image in enumerate(images):
+        if not isinstance(image, dict):
+            raise ValueError(f"Image #{index + 1} of {spec_file} is invalid!")
+        unknown = set(image) - SPEC_KEYS
+        if unknown:
+            raise ValueError(
+                f"Image #{index + 1} of {spec_file} has unknown keys: "
+                f"{', '.join(sorted(unknown))}"
+            )
+        for key in ("release", "arch", "output", "parts"):
+            if not image.get(key):
+                raise ValueError(f"Image #{index + 1} of {spec_file} has no `{key}`!")
+        arches = image["arch"] if isinstance(image["arch"], list) else [image["arch"]]
+        if len(arches) > 1 and "{arch}" not in image["output"]:
+            raise ValueError(
+                f"Image #{index + 1} of {spec_file} has several arches, "
+                f"its output needs an `{{arch}}` placeholder!"
+            )
+        parts = image["parts"]
+        if isinstance(parts, str):
+            parts = parts.split()
+        for arch in arches:
+            output = os.path.abspath(image["output"].replace("{arch}", arch))
+            targets.append(Target(
+                name=image.get("name") or output,
+                release=str(image["release"]),
+                arch=_architecture_check(arch),
+                output=output,
+                parts=list(parts),
+                slice_commit=image.get("slice_commit"),
+                slice_dir=image.get("slice_dir"),
+            ))
+
+    outputs = {}
+    for target in targets:
+        if target.output in outputs:
+            raise ValueError(
+                f"Images {outputs[target.output]} and {target.name} "
+                f"share the output {target.output}!"
+            )
+        outputs[target.output] = target.name
+    return targets
+
+
+def group_targets(targets: List[Target]) -> Dict[Tuple, List[Target]]:
+    """
+    Group the targets by release, arch and slices, the targets of a group
+    share one package sack, their downloads and their extraction.
+
+    The repository of the sack is defined by the slices, targets pinned
+    to another slice commit or directory get a group of their own.
+    """
+    groups: Dict[Tuple, List[Target]] = {}
+    for target in targets:
+        key = (target.release.upper(), target.arch, target.slice_commit, target.slice_dir)
+        groups.setdefault(key, []).append(target)
+    return groups
+
+
+def build_group(targets: List[Target], options: Dict[str, Any],
+                cache_max_size: Optional[int] = None) -> List[str]:
+    """
+    Build all targets of one release, arch and slices together.
+
+    Every required package is resolved and downloaded once, its payload
+    is decompressed once and fanned out to the outputs of all the
+    targets which need it.
+
+    return:
+        The names of the built targets.
+    """
+    splitters = [
+        Splitter(
+            target.release, target.arch, target.output, target.parts,
+            slice_commit=target.slice_commit,
+            slice_dir=target.slice_dir,
+            **options
+        )
+        for target in targets
+    ]
+    plans = [splitter.plan() for splitter in splitters]
+
+    # all targets share the sack of the release and arch
+    dnf_client = splitters[0].init_dnf_client()
+    try:
+        names = list(dict.fromkeys(name for plan in plans for name in plan))
+        resolved = rpm.resolve(dnf_client, names)
+        needed: Dict[str, List[Splitter]] = {}
+        for splitter in splitters:
+            for name in splitter.select(resolved):
+                needed.setdefault(name, []).append(splitter)
+        logger.info(
+            f"{len(targets)} images of {splitters[0].release} ({splitters[0].arch}) "
+            f"need {len(needed)} packages for "
+            f"{sum(len(users) for users in needed.values())} extractions"
+        )
+
+        cache = PackageCache(max_size=cache_max_size)
+        downloads = rpm.download_all(
+            dnf_client, {name: resolved[name] for name in needed},
+            splitters[0].parallel_downloads, cache=cache
+        )
+        try:
+            for name, local_pkg in downloads:
+                users = needed[name]
+                if not local_pkg:
+                    for splitter in users:
+                        splitter.skip(name)
+                    continue
+                reports = execute_plans(
+                    local_pkg,
+                    [(splitter.plans[name], splitter.output) for splitter in users],
+                    splitters[0].globstar,
+                    splitters[0].file_store,
+                    resolved[name].returnIdSum()
+                )
+                for splitter, report in zip(users, reports):
+                    splitter.add(name, local_pkg, report)
+
+            for splitter in splitters:
+                splitter.finish()
+        finally:
+            # the download thread is joined before its run directory
+            # is removed
+            downloads.close()
+            cache.release()
+    finally:
+        rpm.clear(dnf_client, splitters[0].run_dir)
+    return [target.name for target in targets]
+
+
+def build(targets: List[Target], options: Dict[str, Any],
+          jobs: Optional[int] = None,
+          cache_max_size: Optional[int] = None) -> None:
+    """
+    Build all targets, the groups of different releases, arches or
+    slices run concurrently in up to `jobs` processes.
+
+    Downloads are shared across groups through the persistent package
+    cache, e.g. the noarch packages of both arches of a release.
+
+    args:
+        targets: The images to build.
+        options: Keyword arguments of `Splitter` shared by all targets.
+        jobs: The maximum number of groups built at the same time.
+        cache_max_size: See `PackageCache`.
+    raise:
+        RuntimeError: if any of the groups failed.
+    """
+    groups = group_targets(targets)
+    jobs = min(jobs or os.cpu_count() or 1, len(groups))
+    logger.info(f"Building {len(targets)} images in {len(groups)} groups")
+
+    failed = []
+    try:
+        if jobs <= 1:
+            for key, group in groups.items():
+                try:
+                    build_group(group, options, cache_max_size)
+                except Exception as e:
+                    logger.error(f"Failed to build {key[0]} ({key[1]}): {e}")
+                    failed.append(key)
+        else:
+            # forked workers start without importing the splitter again
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+                futures = {
+                    executor.submit(build_group, group, options, cache_max_size): key
+                    for key, group in groups.items()
+                }
+                for future, key in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to build {key[0]} ({key[1]}): {e}")
+                        failed.append(key)
+    finally:
+        PackageCache(max_size=cache_max_size).prune()
+
+    if failed:
+        raise RuntimeError(
+            f"Failed to build {len(failed)} of {len(groups)} groups!"
+        )
+    logger.info(f"Built {len(targets)} images")
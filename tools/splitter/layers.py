@@ -0,0 +1,137 @@
+import hashlib
+import json
+
+from typing import Dict, List, NamedTuple, Optional
+
+from tools.cert.sbom import FileRecord, PackageRecord
+from tools.image.layer import LayerInfo, LayerWriter, source_date_epoch
+from tools.splitter.loader import SplitterLoader
+from tools.splitter.plan import PackagePlan, build_plans
+from tools.logger import logger
+
+# the layer of the requested slices, on top of all the others
+TOP_LAYER = "app"
+# bump whenever the same inputs are written to different layers, the
+# layers cached before are rebuilt then
+LAYER_VERSION = 2
+
+
+class LayerSpec(NamedTuple):
+    """
+    A layer of the image, holding the closure of `slices`.
+    """
+    name: str
+    slices: List[str]
+
+
+def parse_layer(value: str) -> LayerSpec:
+    """
+    Parse a layer given as `name=slice[,slice...]`, e.g.
+    `base=glibc_libs,openssl_libs`.
+
+    raise:
+        ValueError: if the layer is invalid.
+    """
+    name, sep, slices = value.partition("=")
+    name = name.strip()
+    slices = [sc.strip() for sc in slices.split(",") if sc.strip()]
+    if not sep or not name or not slices:
+        raise ValueError(f"Layer: {value} is invalid, expected `name=slice[,slice...]`!")
+    return LayerSpec(name, slices)
+
+
+class ImageLayer:
+    """
+    One layer of the image: the slices it holds, their package plans
+    and what was written to it.
+    """
+
+    def __init__(self, name: str, slices: List[str],
+                 plans: Dict[str, PackagePlan]):
+        self.name = name
+        self.slices = slices
+        self.plans = plans
+        self.key = ""
+        self.writer: Optional[LayerWriter] = None
+        self.info: Optional[LayerInfo] = None
+        # payload members written to the layer, keyed by package name
+        self.files: Dict[str, List[str]] = {}
+        self.records: Dict[str, PackageRecord] = {}
+        # False once a package of the layer failed to download
+        self.complete = True
+
+    @property
+    def history(self) -> str:
+        return f"splitter layer {self.name}: {' '.join(self.slices)}"
+
+
+def split_layers(loader: SplitterLoader, specs: List[LayerSpec],
+                 slices: List[str], arch: str) -> List[ImageLayer]:
+    """
+    Split the image into layers, from the bottom up.
+
+    Each layer holds the dependency closure of its slices minus the
+    slices of the layers below, the top layer holds the rest of the
+    closure of `slices`. A stable base, e.g. the libc, thus makes a
+    layer of its own which does not change with the layers above.
+
+    args:
+        loader: Loader of the slice definition files.
+        specs: The layers below the top one, from the bottom up.
+        slices: The requested slices.
+        arch: The normalized target architecture.
+    return:
+        The layers, the top one is always last.
+    """
+    seen = set()
+    layers = []
+    for spec in list(specs) + [LayerSpec(TOP_LAYER, slices)]:
+        closure = [sc for sc in loader.resolve(spec.slices) if sc not in seen]
+        seen.update(closure)
+        if not closure and spec.slices is not slices:
+            logger.warning(f"Skipping empty layer {spec.name}, its slices are all in lower layers")
+            continue
+        layers.append(ImageLayer(
+            spec.name, closure, build_plans(loader, closure, arch)
+        ))
+    return layers
+
+
+def layer_key(parent: str, layer: ImageLayer, package_keys: Dict[str, str],
+              compression: str, sbom: Optional[str] = None) -> str:
+    """
+    Digest everything a layer depends on: the layers below it, the
+    inputs of its packages and how it is written.
+
+    args:
+        parent: The key of the layer below, empty for the bottom one.
+        layer: The layer.
+        package_keys: Input keys of the selected packages of the layer,
+                      see `PackagePlan.input_key`.
+        compression: The layer compression.
+        sbom: The name of the SBOM in the layer, if any.
+    """
+    data = json.dumps(
+        [LAYER_VERSION, parent, layer.slices, package_keys, compression,
+         source_date_epoch(), sbom],
+        sort_keys=True
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def merge_records(layers: List[ImageLayer]) -> List[PackageRecord]:
+    """
+    Merge the records of the packages split across several layers.
+    """
+    merged: Dict[str, PackageRecord] = {}
+    for layer in layers:
+        for name, record in layer.records.items():
+            if name not in merged:
+                merged[name] = PackageRecord.from_dict(record.to_dict())
+                continue
+            package = merged[name]
+            package.slices.extend(record.slices)
+            files: Dict[str, FileRecord] = {file.path: file for file in package.files}
+            files.update((file.path, file) for file in record.files)
+            package.files = [files[path] for path in sorted(files)]
+    return list(merged.values())
@@ -1,13 +1,17 @@
 import os
+import time
 
+from concurrent.futures import ProcessPoolExecutor
 from typing import Set, Dict, Tuple, List, Optional
 from tools.slice.extra import SliceExtra
-from tools.slice.slice import SliceDefinitionFile
+from tools.slice.index import SliceIndex, index_path, prune_indexes
+from tools.slice.slice import Slice, SliceDefinitionFile
+from tools.splitter.resolver import SliceResolver
 from tools.logger import logger
-from tools import SLICE_DIR
+from tools import SLICE_DIR, SLICE_INDEX_PATH
 
 
-def _parse_slice(slice: str) -> Tuple[str, str]:
+def _parse_slice(slice: str, sdf_dir: str = SLICE_DIR) -> Tuple[str, str]:
     """
     Parse the SDF file name from slice name.
     """
@@ -15,70 +19,143 @@ def _parse_slice(slice: str) -> Tuple[str, str]:
         raise ValueError(f"Invalid sdf name format: {slice}")
     info = slice.rsplit("_", 1)
     # Get the required {package}.yaml to generate the required slice
-    pkgfile = f"{SLICE_DIR}/{info[0]}.yaml"
+    pkgfile = os.path.join(sdf_dir, f"{info[0]}.yaml")
     slicename = info[1]
     return pkgfile, slicename
 
 
-def load_cache(sdf_dir: str) -> Dict[str, SliceDefinitionFile]:
+def load_cache(sdf_dir: str, workers: Optional[int] = None) -> Dict[str, SliceDefinitionFile]:
     """
-    Load all the SDF.
+    Load all the SDF, parsing them in parallel with a process pool.
+
+    args:
+        sdf_dir: Directory of the SDF files.
+        workers: Number of worker processes, defaults to the CPU count.
+    return:
+        SDF objects keyed by file path.
     """
-    sdf_cache = {}
     logger.debug(f"loading SDF files from {sdf_dir}:")
-    for file in os.listdir(sdf_dir):
-        logger.debug(file)
-        if file.endswith(".yaml"):
-            file = os.path.join(sdf_dir, file)
-            sdf_obj = SliceDefinitionFile(file)
-            sdf_cache[file] = sdf_obj
-    return sdf_cache
+    files = [
+        os.path.join(sdf_dir, file)
+        for file in sorted(os.listdir(sdf_dir))
+        if file.endswith(".yaml")
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        sdf_objs = executor.map(SliceDefinitionFile, files, chunksize=32)
+        return dict(zip(files, sdf_objs))
+
+
+def load_index(sdf_dir: str, commit: str,
+               root: str = SLICE_INDEX_PATH) -> SliceIndex:
+    """
+    Load the compiled index of slice commit `commit`, it is compiled
+    from all the SDF in `sdf_dir` on first use.
+
+    args:
+        sdf_dir: Directory of the SDF files of `commit`.
+        commit: The slice repository commit hash.
+        root: Directory of the index files.
+    return:
+        The slice index.
+    """
+    path = index_path(commit, root)
+    index = SliceIndex.load(path)
+    if index is not None and index.commit == commit:
+        logger.debug(f"Loaded slice index of {commit}: {len(index)} slices")
+        return index
+
+    start = time.monotonic()
+    index = SliceIndex.build(commit, load_cache(sdf_dir))
+    index.save(path)
+    logger.info(
+        f"Compiled slice index of {commit}: {len(index)} slices "
+        f"in {time.monotonic() - start:.2f}s"
+    )
+    prune_indexes(root, keep=path)
+    return index
 
 
 class SplitterLoader:
-    
-    def __init__(self, sdf_dir: str, release: str):
-        self.cached_pkgs = load_cache(sdf_dir)
+    """
+    Loads slice definition files on demand, only the SDF of the
+    requested slices and of their dependencies are ever parsed.
+
+    With a compiled `index` the slices are looked up in the index and
+    no SDF is parsed at all.
+    """
+
+    def __init__(self, sdf_dir: str, release: str, preload: bool = False,
+                 index: Optional[SliceIndex] = None):
+        self.sdf_dir = sdf_dir
+        self.cached_pkgs: Dict[str, SliceDefinitionFile] = {}
         self.release = release
+        self.index = index
+        # slice name -> (package, slice)
+        self._slices: Dict[str, Tuple[str, Optional[Slice]]] = {}
+        self.resolver = SliceResolver(self)
+        if preload:
+            self.cached_pkgs = load_cache(sdf_dir)
+
+    def _get_sdf(self, pkgfile: str) -> Optional[SliceDefinitionFile]:
+        sdf_obj = self.cached_pkgs.get(pkgfile)
+        if sdf_obj is None and os.path.isfile(pkgfile):
+            sdf_obj = SliceDefinitionFile(pkgfile)
+            self.cached_pkgs[pkgfile] = sdf_obj
+        return sdf_obj
+
+    def get_slice(self, slice: str) -> Tuple[str, Optional[Slice]]:
+        """
+        Find the package and the definition of `slice`.
+
+        return:
+            The package name.
+            The slice, or None if its SDF does not define it.
+        """
+        entry = self._slices.get(slice)
+        if entry is not None:
+            return entry
+        if self.index is not None:
+            entry = self.index.get(slice)
+        if entry is None:
+            required_pkg, required_slice = _parse_slice(slice, self.sdf_dir)
+            sdf_obj = self._get_sdf(required_pkg)
+            if not sdf_obj:
+                raise ValueError(f"Slice definition file: {required_pkg} is not found!")
+            entry = (sdf_obj.package, None)
+            for sc in sdf_obj.slices:
+                if sc.name == required_slice:
+                    entry = (sdf_obj.package, sc)
+        self._slices[slice] = entry
+        return entry
+
+    def resolve(self, slices: List[str]) -> List[str]:
+        """
+        Retrieve `slices` and all their dependencies.
+
+        args:
+            slices: The requested slices.
+        return:
+            All required slices, dependencies first.
+        """
+        return self.resolver.resolve(slices)
 
     def get_deps(self, slice: str, cached_deps: Optional[Set[str]]) -> Set[str]:
         """
-        Recursively retrieve all dependencies for `slice`.
+        Retrieve all dependencies for `slice`.
 
         args:
-            cached_pkgs: The cached SDF data.
             slice: Name of the slice which requires to get its all deps.
             cached_deps: The cached dependencies, excludes those of `slice`.
         return: 
             All the dependencies for `slice`.
         """
+        deps = set(self.resolver.closure(slice))
+        deps.discard(slice)
         if cached_deps is None:
-            cached_deps = set()
-
-        if slice in cached_deps:
-            return set()
+            return deps
+        deps -= cached_deps
+        cached_deps.update(deps)
         cached_deps.add(slice)
-
-        required_pkg, required_slice = _parse_slice(slice)
-        sdf_obj = self.cached_pkgs.get(required_pkg)
-        if not sdf_obj:
-            raise ValueError(f"Slice definition file: {required_pkg} is not found!")
-
-        deps = set()
-        # split required slice from its package
-        for sc in sdf_obj.slices:
-            if sc.name != required_slice:
-                continue
-            # `deps` in each first directory of SDF is required by its all `slices`
-            if sc.deps:
-                for item in sc.deps:
-                    if "_" not in item:
-                        continue
-                    deps.add(item)
-        for subdep in deps.copy():
-            deps.update(
-                self.get_deps(slice=subdep, cached_deps=cached_deps)
-            )
         return deps
 
     def get_contents(self, slice: str) -> Tuple[str, List[str]]:
@@ -91,17 +168,10 @@ class SplitterLoader:
             The dependent package name.
             Contents for `slice`.
         """
-        common = []
-        required_pkg, required_slice = _parse_slice(slice)
-        sdf_obj = self.cached_pkgs.get(required_pkg)
-
-        for slice in sdf_obj.slices:
-            if slice.name != required_slice:
-                continue
-            if not slice.common:
-                continue
-            common = slice.common
-        return sdf_obj.package, common
+        package, sc = self.get_slice(slice)
+        if not sc or not sc.common:
+            return package, []
+        return package, sc.common
 
     def get_extras(self, slice: str) -> List[SliceExtra]:
         """
@@ -112,16 +182,10 @@ class SplitterLoader:
         return: 
             `extra` items for `slice`.
         """
-        extras = []
-        required_pkg, required_slice = _parse_slice(slice)
-        sdf_obj = self.cached_pkgs.get(required_pkg)
-        for sc in sdf_obj.slices:
-            if sc.name != required_slice:
-                continue
-            if not sc.extra:
-                continue
-            extras.append(sc.extra)
-        return extras
+        _, sc = self.get_slice(slice)
+        if not sc or not sc.extra:
+            return []
+        return [sc.extra]
 
     def get_package(self, slice: str) -> str:
         """
@@ -132,6 +196,5 @@ class SplitterLoader:
         return: 
             Package of the current sdf dependency.
         """
-        required_pkg, _ = _parse_slice(slice)
-        sdf_obj = self.cached_pkgs.get(required_pkg)
-        return sdf_obj.package
+        package, _ = self.get_slice(slice)
+        return package
@@ -0,0 +1,272 @@
+import time
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from tools.cert.sbom import PackageRecord
+from tools.image.layer import LayerWriter
+from tools.parse import parse
+from tools.parse.rpmfile import RPMFile
+from tools.parse.store import FileStore
+from tools.slice.extra import SliceExtra
+from tools.splitter.loader import SplitterLoader
+from tools.splitter.state import input_key
+from tools.logger import logger, tracer
+from tools.logger.trace import FILES_MATCHED, FILES_WRITTEN
+
+
+class PlanReport:
+    """
+    Timings and pattern statistics of an executed package plan.
+    """
+
+    def __init__(self, package: str):
+        self.package = package
+        self.files: List[str] = []
+        # files written by the copy and text extras
+        self.extra_files: List[str] = []
+        self.patterns = 0
+        self.unmatched: List[str] = []
+        self.extract_time = 0.0
+        self.record: Optional[PackageRecord] = None
+
+    @property
+    def matched(self) -> int:
+        return self.patterns - len(self.unmatched)
+
+    def summary(self) -> str:
+        return (
+            f"{self.package}: {len(self.files)} files, "
+            f"{self.matched}/{self.patterns} patterns matched, "
+            f"extracted in {self.extract_time:.2f}s"
+        )
+
+
+class PackagePlan:
+    """
+    Everything to extract from one package, gathered from all
+    the slices which require it.
+    """
+
+    def __init__(self, package: str):
+        self.package = package
+        self.slices: List[str] = []
+        self.patterns: List[str] = []
+        self.extras: List[SliceExtra] = []
+        # files matched ahead from the repository filelists, if known
+        self.files: Optional[List[str]] = None
+        self.unmatched: List[str] = []
+        self._seen = set()
+
+    def add_slice(self, slice: str, common: List[str],
+                  extras: List[SliceExtra], arch: str):
+        """
+        Merge the common contents and the `arch` extras of `slice`.
+        """
+        self.slices.append(slice)
+        patterns = list(common)
+        for extra in extras:
+            patterns.extend(extra.get_arch_files(arch))
+            if extra not in self.extras:
+                self.extras.append(extra)
+        for pattern in patterns:
+            if pattern in self._seen:
+                continue
+            self._seen.add(pattern)
+            self.patterns.append(pattern)
+        return self
+
+    def input_key(self, pkg, globstar: bool = False) -> str:
+        """
+        Digest the inputs of the plan for the resolved package `pkg`.
+        """
+        extras = [[extra.copy, extra.text, extra.manifest] for extra in self.extras]
+        return input_key(
+            str(pkg), pkg.returnIdSum(), self.patterns, extras, globstar
+        )
+
+    def prematch(self, filelist: List[str], globstar: bool = False) -> bool:
+        """
+        Match the patterns against the file list of the package from the
+        repository metadata, before it is downloaded.
+
+        args:
+            filelist: Absolute paths of all the files of the package.
+            globstar: See `parse.match_files`.
+        return:
+            False if there are patterns and none of them matches a file,
+            the package is not worth downloading then, unless its slices
+            have copy or text extras, which run in any case.
+        """
+        if not self.patterns or not filelist:
+            # nothing to match, or no filelists metadata to match against
+            return True
+        self.files, self.unmatched = parse.match_patterns(
+            filelist, self.patterns, globstar
+        )
+        return bool(self.files) or any(extra.copy or extra.text for extra in self.extras)
+
+    def execute(self, pkg_path: str, output: str,
+                globstar: bool = False,
+                store: Optional[FileStore] = None,
+                checksum: Optional[Tuple[str, str]] = None) -> PlanReport:
+        """
+        Extract all planned files in a single pass over the payload,
+        then run the non-extracting extra operations.
+        """
+        return execute_plans(
+            pkg_path, [(self, output)], globstar, store, checksum
+        )[0]
+
+    def stream(self, pkg_path: str, layer: LayerWriter,
+               globstar: bool = False,
+               exclude: Optional[Set[str]] = None) -> PlanReport:
+        """
+        Stream all planned files straight into an image layer, in payload
+        order, then add the text extras to the layer.
+
+        The copy extras read from the output directory, there is none
+        when streaming, so they are skipped.
+
+        args:
+            exclude: Members already in a lower layer, which are left out.
+        """
+        start = time.monotonic()
+        report = PlanReport(self.package)
+        report.patterns = len(self.patterns)
+        try:
+            rpm_file = RPMFile(pkg_path)
+        except (OSError, RuntimeError) as e:
+            raise RuntimeError(f"Error listing files in RPM: {e}") from e
+        if self.patterns:
+            names, unmatched = parse.select_members(
+                rpm_file.filenames(), self.patterns, globstar, self.files
+            )
+            if exclude:
+                names = [name for name in names if name not in exclude]
+            tracer.count(FILES_MATCHED, len(names))
+            try:
+                with tracer.span("layer.stream", package=self.package) as span:
+                    report.files = layer.add_package(rpm_file, names)
+                    span.set(files=len(report.files))
+            except (OSError, RuntimeError) as e:
+                raise RuntimeError(
+                    f"Failed to stream files from RPM '{pkg_path}': {e}"
+                ) from e
+            tracer.count(FILES_WRITTEN, len(report.files))
+            report.unmatched = self.unmatched + unmatched
+        report.extract_time = time.monotonic() - start
+        report.record = PackageRecord.from_rpm(rpm_file, self.slices, report.files)
+
+        for extra in self.extras:
+            for dst, text in extra.text.items():
+                layer.add_file(dst, text.encode("utf-8"))
+            for dst in extra.copy:
+                logger.warning(
+                    f"Skipping copy extra {dst} of {self.package}, "
+                    f"it is not supported in image layers"
+                )
+        return report
+
+    def _complete(self, output: str, rpm_file: RPMFile,
+                  result: Optional[parse.ExtractResult],
+                  extract_time: float) -> PlanReport:
+        report = PlanReport(self.package)
+        report.patterns = len(self.patterns)
+        if result:
+            report.files = result.files
+            report.unmatched = self.unmatched + result.unmatched
+        report.extract_time = extract_time
+        report.record = PackageRecord.from_rpm(rpm_file, self.slices, report.files)
+
+        # the manifest covers all packages, it is written once they
+        # are all extracted
+        if self.extras:
+            with tracer.span("plan.extras", package=self.package):
+                for extra in self.extras:
+                    (
+                        extra
+                        .copy_handler(output)
+                        .text_handler(output)
+                    )
+                    report.extra_files.extend(
+                        f"./{dst.lstrip('/')}" for dst in [*extra.copy, *extra.text]
+                    )
+        return report
+
+
+def execute_plans(pkg_path: str, targets: List[Tuple[PackagePlan, str]],
+                  globstar: bool = False,
+                  store: Optional[FileStore] = None,
+                  checksum: Optional[Tuple[str, str]] = None) -> List[PlanReport]:
+    """
+    Execute the plans of one package for several outputs, the payload
+    is decompressed only once.
+
+    args:
+        pkg_path: RPM package downloaded path.
+        targets: (plan, output directory) pairs, all for this package.
+        globstar: See `parse.match_files`.
+        store: See `parse.extract_many`.
+        checksum: The package checksum addressing it in the `store`.
+    return:
+        The reports, in the order of `targets`.
+    """
+    start = time.monotonic()
+    results: List[Optional[parse.ExtractResult]] = [None] * len(targets)
+    indexes = [i for i, (plan, _) in enumerate(targets) if plan.patterns]
+    if indexes:
+        jobs = [
+            parse.ExtractJob(targets[i][1], targets[i][0].patterns, targets[i][0].files)
+            for i in indexes
+        ]
+        extracted = parse.extract_many(pkg_path, jobs, globstar, store, checksum)
+        for i, result in zip(indexes, extracted):
+            results[i] = result
+        rpm_file = results[indexes[0]].rpm_file
+    else:
+        rpm_file = RPMFile(pkg_path)
+    extract_time = time.monotonic() - start
+    return [
+        plan._complete(output, rpm_file, result, extract_time)
+        for (plan, output), result in zip(targets, results)
+    ]
+
+
+def build_plans(loader: SplitterLoader, slices: Iterable[str],
+                arch: str) -> Dict[str, PackagePlan]:
+    """
+    Build one extraction plan per package for `slices`.
+
+    args:
+        loader: Loader of the slice definition files.
+        slices: All required slices, dependencies included, the plans
+                follow their order.
+        arch: The normalized target architecture.
+    return:
+        Package plans keyed by package name.
+    """
+    plans: Dict[str, PackagePlan] = {}
+    for sc in slices:
+        sdf_pkg, contents = loader.get_contents(sc)
+        extras = loader.get_extras(sc)
+        if sdf_pkg not in plans:
+            plans[sdf_pkg] = PackagePlan(sdf_pkg)
+        plans[sdf_pkg].add_slice(sc, contents, extras, arch)
+    return plans
+
+
+def log_reports(reports: List[PlanReport]) -> None:
+    """
+    Log per-package timings and matched/unmatched pattern counts.
+    """
+    for report in reports:
+        logger.info(report.summary())
+        for pattern in report.unmatched:
+            logger.warning(
+                f"Pattern '{pattern}' of {report.package} matches no file"
+            )
+    total = sum(report.extract_time for report in reports)
+    logger.info(
+        f"Extracted {sum(len(r.files) for r in reports)} files from "
+        f"{len(reports)} packages in {total:.2f}s"
+    )
@@ -0,0 +1,98 @@
+from typing import Dict, FrozenSet, Iterable, List
+
+VISITING = 1
+DONE = 2
+
+
+def _format_path(path: List[str]) -> str:
+    return " -> ".join(path)
+
+
+class SliceResolver:
+    """
+    Resolves the dependency closure of slices over the slice graph.
+
+    Dependencies of a slice are looked up once and kept in a dict, the
+    closure of every resolved slice is memoized, so overlapping closures
+    of many requested parts are never traversed twice.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._deps: Dict[str, List[str]] = {}
+        self._closures: Dict[str, FrozenSet[str]] = {}
+
+    def _get_deps(self, slice: str, path: List[str]) -> List[str]:
+        deps = self._deps.get(slice)
+        if deps is not None:
+            return deps
+        try:
+            _, sc = self.loader.get_slice(slice)
+        except ValueError as e:
+            raise ValueError(f"{e} Required by: {_format_path(path)}")
+        if sc is None:
+            raise ValueError(
+                f"Slice: {slice} is not found! Required by: {_format_path(path)}"
+            )
+        deps = []
+        for item in sc.deps or []:
+            # `deps` without a slice name are not slice dependencies
+            if "_" in item and item not in deps:
+                deps.append(item)
+        self._deps[slice] = deps
+        return deps
+
+    def resolve(self, slices: Iterable[str]) -> List[str]:
+        """
+        Resolve the closure of all `slices` in one iterative traversal.
+
+        args:
+            slices: The requested slices.
+        return:
+            All required slices, dependencies ordered before the
+            slices which require them.
+        raise:
+            ValueError: if a slice is missing or the dependencies form a
+            cycle, the message carries the full dependency path.
+        """
+        state: Dict[str, int] = {}
+        order: List[str] = []
+        for root in slices:
+            if state.get(root) == DONE:
+                continue
+            path = [root]
+            state[root] = VISITING
+            stack = [(root, iter(self._get_deps(root, path)))]
+            while stack:
+                node, deps = stack[-1]
+                for dep in deps:
+                    dep_state = state.get(dep)
+                    if dep_state == DONE:
+                        continue
+                    if dep_state == VISITING:
+                        cycle = path[path.index(dep):] + [dep]
+                        raise ValueError(
+                            f"Circular slice dependency: {_format_path(cycle)}"
+                        )
+                    state[dep] = VISITING
+                    path.append(dep)
+                    stack.append((dep, iter(self._get_deps(dep, path))))
+                    break
+                else:
+                    stack.pop()
+                    path.pop()
+                    state[node] = DONE
+                    order.append(node)
+                    if node not in self._closures:
+                        self._closures[node] = frozenset([node]).union(
+                            *(self._closures[dep] for dep in self._deps[node])
+                        )
+        return order
+
+    def closure(self, slice: str) -> FrozenSet[str]:
+        """
+        Get `slice` and all of its direct and indirect dependencies.
+        """
+        if slice not in self._closures:
+            self.resolve([slice])
+        return self._closures[slice]
@@ -1,18 +1,37 @@
 import json
-import subprocess
 import os
 
 from datetime import datetime
-from collections import defaultdict
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 
-from tools.parse import parse
 from tools.download import rpm
+from tools.download.cache import PackageCache
 from tools.cert.cert import RPMCertPacker
-from tools.splitter.loader import SplitterLoader
-from tools.logger import logger
+from tools.cert.sbom import build_epoch, manifest_text, sbom_files, write_sbom
+from tools.image import oci
+from tools.image.cache import LayerCache
+from tools.image.layer import COMPRESSION_GZIP, COMPRESSION_ZSTD, LayerWriter
+from tools.parse.fileops import LINK_HARDLINK
+from tools.parse.store import FileStore
+from tools.splitter.loader import SplitterLoader, load_index
+from tools.slice.repository import SliceRepository, DEFAULT_SLICE_TTL
+from tools.splitter.plan import PackagePlan, PlanReport, build_plans, log_reports
+from tools.splitter.layers import ImageLayer, LayerSpec, layer_key, merge_records, split_layers
+from tools.splitter.state import BuildState, PackageState, snapshot
+from tools.logger import logger, tracer
+from tools.logger.profiler import PROFILER_SAMPLING, PROFILERS, profiled
 
-from tools import SLICE_PATH, SLICE_REPO, SLICE_DIR
+FORMAT_DIR = "dir"
+FORMAT_OCI_LAYER = "oci-layer"
+FORMAT_TAR_GZ = "tar.gz"
+FORMAT_TAR_ZST = "tar.zst"
+# output format -> layer compression, None for the directory tree
+FORMATS = {
+    FORMAT_DIR: None,
+    FORMAT_OCI_LAYER: COMPRESSION_GZIP,
+    FORMAT_TAR_GZ: COMPRESSION_GZIP,
+    FORMAT_TAR_ZST: COMPRESSION_ZSTD,
+}
 
 # For better extension, such as `risc-v`, etc.
 ARCHES = {
@@ -25,20 +44,6 @@ ARCHES = {
 }
 
 
-def _release_check(release: str) -> bool:
-    try:
-        result = subprocess.run(
-            ["git", "ls-remote", "--heads", SLICE_REPO, release],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        if not bool(result.stdout.strip()):
-            raise ValueError(f"Release: {release} is invalid!")
-    except subprocess.CalledProcessError as e:
-        raise ValueError(f"Release: {release} is invalid!")
-
-
 def _architecture_check(arch: str) -> str:
     if arch not in ARCHES:
         raise ValueError(f"Architecture: {arch} is invalid!")
@@ -55,22 +60,6 @@ def _slices_check(slices: List[str]) -> None:
             raise ValueError(f"Slice: {sc}'s name is invalid!")
 
 
-def _clone_slices(release: str, path: str) -> None:
-    clone_command = [
-        "git", "clone", "-b", release, SLICE_REPO, path
-    ]
-    try:
-        subprocess.run(
-            clone_command,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-    except subprocess.CalledProcessError as e:
-        raise ValueError(f"Clone slice repository failed: {e.stderr}")
-
-
 class Splitter:
     """
     A class to handle the splitting of packages based on specified
@@ -85,25 +74,114 @@ class Splitter:
                  release: str,
                  arch: str,
                  output: str,
-                 slices: List[str]
+                 slices: List[str],
+                 parallel_downloads: int = rpm.DEFAULT_PARALLEL_DOWNLOADS,
+                 package_cache: bool = False,
+                 cache_max_size: Optional[int] = None,
+                 metadata_expire: int = rpm.DEFAULT_METADATA_EXPIRE,
+                 refresh: bool = False,
+                 slice_commit: Optional[str] = None,
+                 slice_dir: Optional[str] = None,
+                 slice_ttl: int = DEFAULT_SLICE_TTL,
+                 preload: bool = False,
+                 globstar: bool = False,
+                 rpmdb: bool = True,
+                 rebuild: bool = False,
+                 format: str = FORMAT_DIR,
+                 layer_compression: Optional[str] = None,
+                 layers: Optional[List[LayerSpec]] = None,
+                 layer_cache: bool = False,
+                 file_store: bool = False,
+                 link_mode: str = LINK_HARDLINK,
+                 profile: Optional[str] = None,
+                 profiler: str = PROFILER_SAMPLING,
+                 loader: Optional[SplitterLoader] = None
         ):
         self.release = f"openEuler-{release.upper()}"
         self.output = os.path.abspath(output)
         self.slices = slices
+        self.parallel_downloads = max(1, parallel_downloads)
+        self.globstar = globstar
+        self.rebuild = rebuild
+        self.metadata_expire = metadata_expire
+        self.refresh = refresh
+        if format not in FORMATS:
+            raise ValueError(f"Format: {format} is invalid!")
+        self.format = format
+        # the oci layout may hold a zstd layer, the tarballs are named
+        # after their compression
+        self.layer_compression = FORMATS[format]
+        if format == FORMAT_OCI_LAYER and layer_compression:
+            self.layer_compression = layer_compression
+        if layers and format != FORMAT_OCI_LAYER:
+            raise ValueError(f"Format: {format} holds a single layer!")
+        self.layer_specs = layers or []
+        self.layers: List[ImageLayer] = []
+        self.layer_cache = LayerCache() if layer_cache else None
+        self.file_store = None
+        if file_store:
+            self.file_store = FileStore(link=link_mode)
+        if profiler not in PROFILERS:
+            raise ValueError(f"Profiler: {profiler} is invalid!")
+        # the cut is profiled to this directory, if any
+        self.profile = profile
+        self.profiler = profiler
+        self.package_cache = None
+        if package_cache:
+            self.package_cache = PackageCache(max_size=cache_max_size)
         # checks
         _slices_check(self.slices)
-        _release_check(self.release)
         self.arch = _architecture_check(arch)
-        # initialize loader
-        _clone_slices(self.release, SLICE_PATH)
-        self.loader = SplitterLoader(
-            sdf_dir=SLICE_DIR,
-            release=self.release
-        )
-        self.cert = RPMCertPacker(db_root=self.output)
+        if loader is not None:
+            # the slices of a checkout already loaded, e.g. kept warm
+            # by `splitter serve`
+            self.slice_repo = None
+            self.slice_path = os.path.dirname(loader.sdf_dir)
+            self.loader = loader
+        else:
+            with tracer.span("slices.load", release=self.release):
+                self.slice_repo, self.loader = self.load_slices(
+                    slice_ttl, slice_commit, slice_dir, preload
+                )
+            self.slice_path = os.path.dirname(self.loader.sdf_dir)
+        # the SBOM is always written, the rpmdb is optional and needs
+        # the output directory tree
+        self.cert = None
+        if rpmdb and format == FORMAT_DIR:
+            self.cert = RPMCertPacker(db_root=self.output)
+        # the transient files of the dnf client, see `init_dnf_client`
+        self.run_dir: Optional[str] = None
 
 
-    def cut(self):
+    def load_slices(self, slice_ttl: int, slice_commit: Optional[str],
+                    slice_dir: Optional[str],
+                    preload: bool) -> Tuple[SliceRepository, SplitterLoader]:
+        """
+        Check out the slices of the release and set up their loader.
+        """
+        # the release is validated against the slice repository mirror
+        slice_repo = SliceRepository(
+            ttl=slice_ttl,
+            commit=slice_commit,
+            local_dir=slice_dir
+        )
+        slice_path = slice_repo.checkout(self.release)
+        # initialize loader, from the compiled index of the slice commit
+        # when the checkout is pinned to one
+        sdf_dir = os.path.join(slice_path, "slices")
+        revision = slice_repo.revision()
+        index = None
+        if revision and not preload:
+            index = load_index(sdf_dir, revision)
+        loader = SplitterLoader(
+            sdf_dir=sdf_dir,
+            release=self.release,
+            preload=preload,
+            index=index
+        )
+        return slice_repo, loader
+
+    def cut(self, dnf_client=None):
         """
         Parse slice configurations and extract the necessary
         files for the specified slice dependencies.
@@ -111,73 +189,425 @@ class Splitter:
         Steps:
         1. Normalize and validata the architecture parameter.
         2. Load required slices and their contents.
-        3. Download and extract the required files.
-        4. Perform extra operations if any.
+        3. Reuse the packages unchanged since the last build into the
+           output.
+        4. Match the contents against the repository filelists and
+           skip the packages without any matching file.
+        5. Download the packages concurrently and extract the required
+           files of each package as soon as it arrives.
+        6. Remove the files no longer selected and perform extra
+           operations if any.
+
+        With an image `format`, the files are streamed into layers
+        instead, only whole layers are reused from the layer cache.
+        With a `profile` directory, the cut is profiled per stage. The
+        construction of the splitter is not, wrap it in `profiled` as
+        the `cut` command does to profile the checkout of the slices.
+
+        args:
+            dnf_client: A client of the release and arch with its sack
+                        filled, which is left open. A client is set up
+                        and closed by the cut otherwise.
         """
+        with profiled(self.profile, self.profiler), tracer.span(
+            "cut", release=self.release, arch=self.arch, output=self.output,
+            slices=" ".join(self.slices)
+        ):
+            self.plan()
+
+            # create DNF API client
+            owned = dnf_client is None
+            if owned:
+                dnf_client = self.init_dnf_client()
+            else:
+                dnf_client.conf.destdir = self.destdir
+
+            try:
+                # Resolve all packages up front, then extract each of them
+                # as soon as its download finishes.
+                packages = self.resolve(dnf_client)
+                self.execute(dnf_client, packages)
+            finally:
+                # close dnf.Base and remove the files of this run
+                if owned:
+                    rpm.clear(dnf_client, self.run_dir)
 
-        # Collect all slices including their dependencies
-        all_slices = set()
+    def resolve(self, dnf_client) -> Dict[str, object]:
+        """
+        Resolve the packages of the plans and select those to extract,
+        see `select`.
+
+        return:
+            The packages to download and extract keyed by name.
+        """
+        return self.select(rpm.resolve(dnf_client, list(self.plans)))
+
+    def execute(self, dnf_client, packages: Dict[str, object],
+                progress: Optional[Callable[[int, int, str, str], None]] = None) -> None:
+        """
+        Download the selected packages, extract each of them as it
+        arrives and finish the output.
+
+        args:
+            dnf_client: The client the packages were resolved with.
+            packages: The packages selected by `resolve`.
+            progress: Called with the number of packages done, their
+                      total, the package name and its local path after
+                      each package. Anything it raises aborts the cut.
+        """
+        plans = self.plans
+        if self.format != FORMAT_DIR:
+            packages = self.open_layers()
+        downloads = rpm.download_all(
+            dnf_client, packages, self.parallel_downloads,
+            cache=self.package_cache
+        )
+        try:
+            with tracer.span("pipeline", packages=len(packages)):
+                for done, (sdf_pkg, local_pkg) in enumerate(downloads, 1):
+                    if self.format != FORMAT_DIR:
+                        self.stream(sdf_pkg, local_pkg)
+                    elif not local_pkg:
+                        self.skip(sdf_pkg)
+                    else:
+                        # extract common and arch files, then run extra operations
+                        report = plans[sdf_pkg].execute(
+                            local_pkg, self.output, self.globstar, self.file_store,
+                            self.packages[sdf_pkg].returnIdSum()
+                        )
+                        self.add(sdf_pkg, local_pkg, report)
+                    if progress:
+                        progress(done, len(packages), sdf_pkg, local_pkg)
+
+            self.finish()
+        except BaseException:
+            for layer in self.layers:
+                if layer.writer:
+                    layer.writer.abort()
+            raise
+        finally:
+            downloads.close()
+            if self.layer_cache:
+                self.layer_cache.release()
+        if self.package_cache:
+            self.package_cache.release()
+            self.package_cache.prune()
+
+    def plan(self) -> Dict[str, PackagePlan]:
+        """
+        Resolve the slice closure and plan the extraction of each package.
+        """
         logger.info(
             f"Splitting packages from "
             f"{self.release} ({self.arch}) to {self.output}"
         )
 
-        for sc in self.slices:
-            deps = self.loader.get_deps(sc, None)
-            all_slices.update(deps)
-            all_slices.add(sc)
-        logger.info(f"Total: {len(all_slices)} slices:")
-        logger.info(json.dumps(list(all_slices), indent=4))
-
-        # Initialize mapping structures for contents and extras
-        common_contents = defaultdict(list)
-        extras_contents = defaultdict(list)
-
-        # Aggregate contents and extras by package
-        for sc in all_slices:
-            sdf_pkg, contents = self.loader.get_contents(sc)
-            extras = self.loader.get_extras(sc)
-            if contents:
-                common_contents[sdf_pkg].extend(contents)
-            if extras:
-                extras_contents[sdf_pkg].extend(extras)
-
-        # Deduplicate contents for each package
-        for k in common_contents:
-            common_contents[k] = list(set(common_contents[k]))
-
-        for k in extras_contents:
-            extras_contents[k] = list(set(extras_contents[k]))
-
-        # create DNF API client
-        dnf_client = rpm.init_dnf_client(
-            self.arch, self.release, self.output
+        with tracer.span("plan") as span:
+            # Collect all slices including their dependencies, dependencies
+            # are ordered before the slices requiring them
+            self.all_slices = self.loader.resolve(self.slices)
+            if self.format != FORMAT_DIR:
+                # the plans follow the layers, from the bottom up
+                self.layers = split_layers(
+                    self.loader, self.layer_specs, self.slices, self.arch
+                )
+                self.all_slices = [sc for layer in self.layers for sc in layer.slices]
+            logger.info(f"Total: {len(self.all_slices)} slices:")
+            logger.info(json.dumps(self.all_slices, indent=4))
+
+            # One extraction plan per package: common contents plus the
+            # extras of the target architecture from every slice.
+            self.plans = build_plans(self.loader, self.all_slices, self.arch)
+            span.set(slices=len(self.all_slices), packages=len(self.plans))
+        return self.plans
+
+    @property
+    def destdir(self) -> str:
+        if self.format in (FORMAT_TAR_GZ, FORMAT_TAR_ZST):
+            # the output is the tarball itself
+            return os.path.dirname(self.output)
+        return self.output
+
+    def init_dnf_client(self):
+        """
+        Set up a client of the release and arch, its repo file and
+        downloads go to a new `run_dir`, which the caller removes with
+        the client, see `rpm.clear`.
+        """
+        run_dir = rpm.new_run_dir()
+        try:
+            with tracer.span("dnf.init"):
+                dnf_client = rpm.init_dnf_client(
+                    self.arch, self.release, self.destdir, run_dir,
+                    metadata_expire=self.metadata_expire,
+                    refresh=self.refresh,
+                    slice_path=self.slice_path
+                )
+        except BaseException:
+            rpm.clear(None, run_dir)
+            raise
+        self.run_dir = run_dir
+        return dnf_client
+
+    def select(self, resolved: Dict[str, object]) -> Dict[str, object]:
+        """
+        Select the resolved packages which have to be extracted.
+
+        Packages unchanged since the last build into the output are
+        reused, packages whose patterns match none of the files in the
+        repository filelists are skipped.
+
+        args:
+            resolved: The resolved packages of all plans keyed by name.
+        return:
+            The packages to download and extract.
+        """
+        with tracer.span("select", packages=len(resolved)) as span:
+            packages = {
+                sdf_pkg: resolved[sdf_pkg] for sdf_pkg in self.plans
+                if sdf_pkg in resolved
+            }
+            for sdf_pkg in self.plans:
+                if sdf_pkg not in packages:
+                    logger.warning(f"Skipping {sdf_pkg} "
+                                   f"due to download failure")
+
+            # Reuse the packages whose inputs are unchanged since the last
+            # build into the output, only the others are rebuilt.
+            self.previous = BuildState()
+            if self.format == FORMAT_DIR:
+                self.previous = BuildState.load(self.output)
+            self.state = BuildState(self.all_slices)
+            self.reports = []
+            self.local_pkgs = []
+            self.keys = {}
+            for sdf_pkg, pkg in list(packages.items()):
+                self.keys[sdf_pkg] = self.plans[sdf_pkg].input_key(pkg, self.globstar)
+                if self.rebuild:
+                    continue
+                package_state = self.previous.reusable(
+                    sdf_pkg, self.keys[sdf_pkg], self.output
+                )
+                if package_state:
+                    self.state.packages[sdf_pkg] = package_state
+                    del packages[sdf_pkg]
+            self.reused = len(self.state.packages)
+
+            # Match the patterns against the repository filelists, packages
+            # whose patterns match nothing are never downloaded.
+            for sdf_pkg, pkg in list(packages.items()):
+                plan = self.plans[sdf_pkg]
+                if not plan.prematch(pkg.files, self.globstar):
+                    logger.warning(
+                        f"Skipping {sdf_pkg}: none of its {len(plan.patterns)} "
+                        f"patterns matches a file of {pkg}"
+                    )
+                    del packages[sdf_pkg]
+            span.set(reused=self.reused, selected=len(packages))
+        self.packages = packages
+        return packages
+
+    def skip(self, sdf_pkg: str) -> None:
+        """
+        Give up a selected package which failed to download.
+        """
+        logger.warning(f"Skipping {sdf_pkg} "
+                       f"due to download failure")
+        # keep the files of the last build until the next run
+        if sdf_pkg in self.previous.packages:
+            self.state.packages[sdf_pkg] = self.previous.packages[sdf_pkg]
+
+    def add(self, sdf_pkg: str, local_pkg: str, report: PlanReport) -> None:
+        """
+        Record a selected package extracted to the output.
+        """
+        pkg = self.packages[sdf_pkg]
+        report.record.add_checksum(*pkg.returnIdSum())
+        self.reports.append(report)
+        self.local_pkgs.append(local_pkg)
+        files = {}
+        if self.format == FORMAT_DIR:
+            files = snapshot(self.output, report.files + report.extra_files)
+        self.state.packages[sdf_pkg] = PackageState(
+            self.keys[sdf_pkg], str(pkg), files, report.record
         )
 
-        for sdf_pkg, contents in common_contents.items():
-            local_pkg = rpm.download(dnf_client, sdf_pkg)
+    def open_layers(self) -> Dict[str, object]:
+        """
+        Take the unchanged layers from the layer cache and start the
+        others.
+
+        return:
+            The packages to download, those of the layers to build.
+        """
+        parent = ""
+        needed = {}
+        for index, layer in enumerate(self.layers):
+            top = index == len(self.layers) - 1
+            package_keys = {
+                sdf_pkg: self.keys[sdf_pkg] for sdf_pkg in layer.plans
+                if sdf_pkg in self.packages
+            }
+            layer.key = layer_key(
+                parent, layer, package_keys, self.layer_compression,
+                sbom=self.sbom_name if top else None
+            )
+            parent = layer.key
+            cached = None
+            if self.layer_cache and not self.rebuild:
+                cached = self.layer_cache.get(layer.key)
+            if cached:
+                logger.info(f"Reusing layer {layer.name}: {cached.layer.digest}")
+                layer.info = cached.layer
+                layer.files = cached.files
+                layer.records = cached.records
+                continue
+
+            for sdf_pkg in package_keys:
+                pkg = self.packages[sdf_pkg]
+                if layer.plans[sdf_pkg].prematch(pkg.files, self.globstar):
+                    needed[sdf_pkg] = pkg
+            path = self.output
+            if self.format == FORMAT_OCI_LAYER:
+                # moved to its digest once complete
+                path = os.path.join(
+                    self.output, "blobs", "sha256", f".layer-{os.getpid()}-{index}"
+                )
+            layer.writer = LayerWriter(path, self.layer_compression)
+
+        # packages are streamed in plan order, whatever order their
+        # downloads finish in, to keep the layers reproducible
+        self._order = [sdf_pkg for sdf_pkg in self.packages if sdf_pkg in needed]
+        self._arrived: Dict[str, str] = {}
+        self._next = 0
+        return needed
+
+    def stream(self, sdf_pkg: str, local_pkg: str) -> None:
+        """
+        Stream a downloaded package into the layers which need it, once
+        all the packages planned before it are in.
+        """
+        self._arrived[sdf_pkg] = local_pkg
+        while (self._next < len(self._order)
+               and self._order[self._next] in self._arrived):
+            sdf_pkg = self._order[self._next]
+            self._next += 1
+            local_pkg = self._arrived.pop(sdf_pkg)
             if not local_pkg:
                 logger.warning(f"Skipping {sdf_pkg} "
                                f"due to download failure")
-                continue
+            # a package split across layers is only written to the
+            # lowest of them
+            exclude = set()
+            for layer in self.layers:
+                if layer.writer and sdf_pkg in layer.plans:
+                    if not local_pkg:
+                        layer.complete = False
+                        continue
+                    report = layer.plans[sdf_pkg].stream(
+                        local_pkg, layer.writer, self.globstar, exclude
+                    )
+                    report.record.add_checksum(*self.packages[sdf_pkg].returnIdSum())
+                    layer.files[sdf_pkg] = report.files
+                    layer.records[sdf_pkg] = report.record
+                    self.reports.append(report)
+                exclude.update(layer.files.get(sdf_pkg, []))
 
-            # extract common files from slice content
-            parse.extract_files(local_pkg, self.output, contents)
-
-            # slice content extra operations
-            for extra in extras_contents.get(sdf_pkg, []):
-                (
-                    extra
-                    .linux_arm64_handler(local_pkg, self.output)
-                    .linux_amd64_handler(local_pkg, self.output)
-                    .copy_handler(self.output)
-                    .text_handler(self.output)
-                    .manifest_handler(self.output)
-                )
+    def finish(self) -> None:
+        """
+        Remove the files no longer selected, write the build state, the
+        SBOM and the manifests and register the packages in the rpmdb.
+        """
+        if self.layers:
+            self.finish_layers()
+            return
+        with tracer.span("finish"):
+            state, previous = self.state, self.previous
+            state.manifests = sorted({
+                f"./{dst.lstrip('/')}"
+                for plan in self.plans.values()
+                for extra in plan.extras
+                for dst in extra.manifest
+            })
+            # drop the files which are no longer selected
+            removed = previous.remove_stale(self.output, state)
+            state.save(self.output)
+            logger.info(
+                f"Reused {self.reused} packages, rebuilt {len(self.reports)} packages, "
+                f"removed {removed} files no longer selected"
+            )
 
-            # support vuln scanning and SBOM
-            self.cert.pack_cert(rpm_file=local_pkg)
+            # support vuln scanning and SBOM, straight from the RPM headers
+            records = [
+                package.record for package in state.packages.values()
+                if package.record
+            ]
+            with tracer.span("sbom", packages=len(records)):
+                write_sbom(self.output, records, name=" ".join(self.slices))
+                for plan in self.plans.values():
+                    for extra in plan.extras:
+                        extra.manifest_handler(self.output, records)
+            # all packages are registered in a single rpmdb transaction,
+            # replacing the versions of the last build
+            current = {package.nevra for package in state.packages.values()}
+            outdated = [
+                package.nevra for package in previous.packages.values()
+                if package.nevra not in current
+            ]
+            if self.cert and outdated and not self.cert.remove_certs(outdated):
+                logger.warning("Failed to remove some outdated packages from the RPM database")
+            if self.cert and not self.cert.pack_certs(self.local_pkgs):
+                logger.warning("Failed to register some packages in the RPM database")
 
+        log_reports(self.reports)
         logger.info(f"Files extracted to: {self.output}")
-        # clear cache and close dnf.Base
-        rpm.clear(dnf_client)
+
+    @property
+    def sbom_name(self) -> str:
+        return " ".join(self.slices)
+
+    def finish_layers(self) -> None:
+        """
+        Add the SBOM and the manifests to the top layer, complete the
+        layers and write them as an OCI image layout or a plain tarball.
+        """
+        with tracer.span("finish"):
+            records = merge_records(self.layers)
+            top = self.layers[-1].writer
+            if top:
+                for relpath, text in sbom_files(records, self.sbom_name):
+                    top.add_file(relpath, text.encode("utf-8"))
+                manifest = manifest_text(records).encode("utf-8")
+                for plan in self.plans.values():
+                    for extra in plan.extras:
+                        for dst in extra.manifest:
+                            top.add_file(dst, manifest)
+
+            for layer in self.layers:
+                if layer.writer:
+                    with tracer.span("layer.close", layer=layer.name):
+                        layer.info = layer.writer.close()
+                        layer.writer = None
+                        if self.format == FORMAT_OCI_LAYER:
+                            layer.info = oci.store_layer(self.output, layer.info)
+                    if self.layer_cache and layer.complete:
+                        self.layer_cache.put(layer.key, layer.info, layer.files, layer.records)
+                else:
+                    path = self.output
+                    if self.format == FORMAT_OCI_LAYER:
+                        path = oci.blob_path(self.output, layer.info.digest)
+                    layer.info = self.layer_cache.link(layer.info, path)
+                logger.info(
+                    f"Layer {layer.name} {layer.info.digest} (diffID {layer.info.diff_id}, "
+                    f"{layer.info.size} bytes) written to: {layer.info.path}"
+                )
+
+        log_reports(self.reports)
+        if self.format == FORMAT_OCI_LAYER:
+            with tracer.span("oci.write_layout", layers=len(self.layers)):
+                digest = oci.write_oci_layout(
+                    self.output, [layer.info for layer in self.layers], self.arch,
+                    history=[layer.history for layer in self.layers],
+                    created=build_epoch(records)
+                )
+            logger.info(f"Image manifest {digest} written to: {self.output}")
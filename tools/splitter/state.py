@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import stat
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tools.cert.sbom import PackageRecord
+from tools.logger import logger
+
+# the build state is kept in the output, next to the extracted files
+STATE_FILE = ".splitter-state.json"
+# bump whenever the layout of the state file changes
+STATE_VERSION = 2
+
+
+def input_key(nevra: str, checksum: Tuple[str, str], patterns: List[str],
+              extras: List[object], globstar: bool) -> str:
+    """
+    Digest everything a package's output depends on.
+    """
+    data = json.dumps(
+        [nevra, list(checksum), patterns, extras, globstar],
+        sort_keys=True
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def snapshot(output: str, files: Iterable[str]) -> Dict[str, List[int]]:
+    """
+    Record the size and modification time of extracted files, which
+    reveal any later change to them in the output.
+
+    args:
+        output: The output directory.
+        files: Names of the extracted files, e.g. `./usr/bin/bash`.
+    return:
+        [size, mtime in ns] keyed by file name, directories get [0, 0].
+    """
+    stats = {}
+    for name in files:
+        try:
+            st = os.lstat(os.path.join(output, name))
+        except FileNotFoundError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            # directory times change with their contents
+            stats[name] = [0, 0]
+        else:
+            stats[name] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+
+class PackageState:
+    """
+    What was built from one package into the output.
+    """
+
+    def __init__(self, key: str, nevra: str, files: Dict[str, List[int]],
+                 record: Optional[PackageRecord] = None):
+        self.key = key
+        self.nevra = nevra
+        self.files = files
+        self.record = record
+
+    def to_dict(self) -> dict:
+        return {
+            "key": self.key,
+            "nevra": self.nevra,
+            "files": self.files,
+            "record": self.record.to_dict() if self.record else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PackageState":
+        record = data.get("record")
+        return cls(
+            data["key"], data["nevra"], data["files"],
+            PackageRecord.from_dict(record) if record else None
+        )
+
+    def unchanged(self, output: str) -> bool:
+        """
+        Check that none of the files extracted or written by the extras
+        was changed or removed.
+        """
+        return snapshot(output, self.files) == self.files
+
+
+class BuildState:
+    """
+    The state of the last build into an output directory: the resolved
+    slice closure, per package the digest of its inputs and the files
+    extracted from it or written by its extras, and the manifests.
+    """
+
+    def __init__(self, slices: Optional[List[str]] = None,
+                 packages: Optional[Dict[str, PackageState]] = None,
+                 manifests: Optional[List[str]] = None):
+        self.slices = slices or []
+        self.packages = packages or {}
+        # rewritten on every build, they cover all the packages
+        self.manifests = manifests or []
+
+    @staticmethod
+    def path(output: str) -> str:
+        return os.path.join(output, STATE_FILE)
+
+    @classmethod
+    def load(cls, output: str) -> "BuildState":
+        """
+        Load the state of the last build, an empty state if there is none
+        or it is unreadable.
+        """
+        path = cls.path(output)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != STATE_VERSION:
+                logger.info(f"Ignoring build state of another version: {path}")
+                return cls()
+            return cls(
+                data["slices"],
+                {
+                    name: PackageState.from_dict(package)
+                    for name, package in data["packages"].items()
+                },
+                data["manifests"]
+            )
+        except FileNotFoundError:
+            return cls()
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable build state {path}: {e}")
+            return cls()
+
+    def save(self, output: str) -> None:
+        os.makedirs(output, exist_ok=True)
+        path = self.path(output)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": STATE_VERSION,
+                "slices": self.slices,
+                "manifests": self.manifests,
+                "packages": {
+                    name: package.to_dict()
+                    for name, package in sorted(self.packages.items())
+                },
+            }, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def reusable(self, name: str, key: str, output: str) -> Optional[PackageState]:
+        """
+        Get the state of package `name` if its inputs are unchanged and
+        its files are still intact in the output.
+        """
+        package = self.packages.get(name)
+        if package is None or package.key != key or package.record is None:
+            return None
+        if not package.unchanged(output):
+            logger.info(f"Files of {name} were changed in the output, rebuilding")
+            return None
+        return package
+
+    def remove_stale(self, output: str, current: "BuildState") -> int:
+        """
+        Remove the files of this state which no package of the `current`
+        state provides anymore.
+
+        return:
+            The number of removed files.
+        """
+        kept = set(current.manifests)
+        for package in current.packages.values():
+            kept.update(package.files)
+        stale = {name for name in self.manifests if name not in kept}
+        for package in self.packages.values():
+            stale.update(name for name in package.files if name not in kept)
+
+        removed = 0
+        # deepest first, so directories are emptied before removal
+        for name in sorted(stale, key=lambda name: name.count("/"), reverse=True):
+            path = os.path.join(output, name)
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    # directories still holding other files are kept
+                    os.rmdir(path)
+                else:
+                    os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.debug(f"Keeping {path}: {e}")
+        return removed